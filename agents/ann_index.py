@@ -0,0 +1,145 @@
+import math
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from loguru import logger
+
+INDEX_TYPES = ('auto', 'flat', 'hnsw', 'ivf_flat', 'ivf_pq')
+
+
+class ANNIndexFactory:
+    """按配置或语料规模构建本地知识库的 FAISS 向量索引
+
+    type:
+        flat: 精确检索，每次查询扫描全部向量，每个片段保存完整的 float32 向量
+        hnsw: 图索引，查询延迟低、召回高，但内存比 flat 略多（每个向量额外保存 hnsw_m 个邻居）
+        ivf_flat: 倒排索引，查询只扫描 nprobe 个聚类
+        ivf_pq: 倒排 + 乘积量化，每个向量压缩为 pq_m 个 pq_nbits 位的编码，适合数百万片段
+        auto: 片段数少于 auto_hnsw_min_chunks 时用 flat，少于 auto_ivf_pq_min_chunks 时用 hnsw，否则用 ivf_pq
+
+    所有索引均使用 L2 距离，与 FAISS.from_documents 一致（嵌入已归一化，排序等价于余弦相似度）；
+    IVF 索引在最多 train_sample 个随机向量上训练。
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.type = config.get('type', 'auto')
+        if self.type not in INDEX_TYPES:
+            raise ValueError(f"local_kb.index.type 必须是 {INDEX_TYPES} 之一")
+        self.hnsw_m = config.get('hnsw_m', 32)
+        self.ef_construction = config.get('ef_construction', 40)
+        self.ef_search = config.get('ef_search', 64)
+        # 0 表示按语料规模自动选择
+        self.nlist = config.get('nlist', 0)
+        self.nprobe = config.get('nprobe', 16)
+        self.pq_m = config.get('pq_m', 0)
+        self.pq_nbits = config.get('pq_nbits', 0)
+        self.train_sample = config.get('train_sample', 100000)
+        self.embed_batch_size = config.get('embed_batch_size', 1024)
+        self.auto_hnsw_min_chunks = config.get('auto_hnsw_min_chunks', 50000)
+        self.auto_ivf_pq_min_chunks = config.get('auto_ivf_pq_min_chunks', 1000000)
+        self.seed = config.get('seed', 0)
+
+    def build_settings(self) -> Dict[str, Any]:
+        """影响索引内容的设置（efSearch / nprobe 只影响查询，不在其中），用于判断磁盘上的索引是否需要重建"""
+        return {
+            'type': self.type, 'hnsw_m': self.hnsw_m, 'ef_construction': self.ef_construction, 'nlist': self.nlist,
+            'pq_m': self.pq_m, 'pq_nbits': self.pq_nbits, 'train_sample': self.train_sample, 'seed': self.seed,
+            'auto_hnsw_min_chunks': self.auto_hnsw_min_chunks, 'auto_ivf_pq_min_chunks': self.auto_ivf_pq_min_chunks,
+        }
+
+    def resolve_type(self, count: int) -> str:
+        if self.type != 'auto':
+            return self.type
+        if count < self.auto_hnsw_min_chunks:
+            return 'flat'
+        if count < self.auto_ivf_pq_min_chunks:
+            return 'hnsw'
+        return 'ivf_pq'
+
+    def factory_string(self, index_type: str, count: int, dim: int) -> str:
+        """faiss.index_factory 描述
+
+        nlist 默认取 4*sqrt(n)，且保证每个聚类中心至少有 39 个训练样本；PQ 子空间数默认使每段约 16 维，
+        码本位数默认按训练样本数在 4–8 位之间选择，避免小语料上 256 中心的 k-means 训练过慢且欠拟合。
+        """
+        train_count = max(1, min(count, self.train_sample))
+        if index_type == 'flat':
+            return "Flat"
+        if index_type == 'hnsw':
+            return f"HNSW{self.hnsw_m},Flat"
+        nlist = self.nlist or max(1, min(train_count // 39, int(4 * math.sqrt(count))))
+        if index_type == 'ivf_flat':
+            return f"IVF{nlist},Flat"
+        if index_type == 'ivf_pq':
+            pq_m = self.pq_m or next(m for m in range(max(1, dim // 16), 0, -1) if dim % m == 0)
+            pq_nbits = self.pq_nbits or max(4, min(8, int(math.log2(max(2, train_count // 39)))))
+            return f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+        raise ValueError(f"未知的索引类型: {index_type}")
+
+    def create(self, index_type: str, count: int, dim: int):
+        """创建未训练、未添加向量的索引"""
+        index = faiss.index_factory(dim, self.factory_string(index_type, count, dim))
+        hnsw = getattr(faiss.downcast_index(index), 'hnsw', None)
+        if hnsw is not None:
+            hnsw.efConstruction = self.ef_construction
+        return index
+
+    def train(self, index, vectors: np.ndarray):
+        """需要训练的索引（IVF）在随机抽取的最多 train_sample 个向量上训练"""
+        if index.is_trained:
+            return
+        if len(vectors) > self.train_sample:
+            rng = np.random.default_rng(self.seed)
+            vectors = vectors[rng.choice(len(vectors), self.train_sample, replace=False)]
+        index.train(vectors)
+
+    def apply_search_parameters(self, index):
+        """设置查询参数：IVF 索引的 nprobe，HNSW 索引的 efSearch"""
+        try:
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+            return
+        except RuntimeError:
+            pass
+        hnsw = getattr(faiss.downcast_index(index), 'hnsw', None)
+        if hnsw is not None:
+            hnsw.efSearch = self.ef_search
+
+    def build(self, vectors: np.ndarray, index_type: Optional[str] = None):
+        index_type = index_type or self.resolve_type(len(vectors))
+        index = self.create(index_type, len(vectors), vectors.shape[1])
+        self.train(index, vectors)
+        index.add(vectors)
+        self.apply_search_parameters(index)
+        return index
+
+    def embed(self, embeddings, texts: List[str]) -> np.ndarray:
+        """分批编码并直接写入 float32 矩阵，避免大语料时先生成巨大的 Python 浮点数列表"""
+        matrix: Optional[np.ndarray] = None
+        for offset in range(0, len(texts), self.embed_batch_size):
+            batch = np.asarray(embeddings.embed_documents(texts[offset:offset + self.embed_batch_size]), dtype=np.float32)
+            if matrix is None:
+                matrix = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            matrix[offset:offset + len(batch)] = batch
+        return matrix
+
+    def index_documents(self, documents: List[Document], embeddings) -> Tuple[Any, str]:
+        """编码文档并构建索引，返回 (索引, 索引类型)，索引中第 i 个向量对应 documents[i]"""
+        if not documents:
+            raise ValueError("没有可索引的文本片段")
+        vectors = self.embed(embeddings, [doc.page_content for doc in documents])
+        index_type = self.resolve_type(len(vectors))
+        index = self.build(vectors, index_type)
+        logger.info(f"向量索引构建完毕: {index_type} ({self.factory_string(index_type, len(vectors), vectors.shape[1])}), {len(vectors)} 个片段")
+        return index, index_type
+
+    def build_vectorstore(self, documents: List[Document], embeddings) -> FAISS:
+        """编码文档并构建 LangChain FAISS 向量库，代替 FAISS.from_documents"""
+        index, _ = self.index_documents(documents, embeddings)
+        ids = [str(uuid.uuid4()) for _ in documents]
+        return FAISS(embeddings, index, InMemoryDocstore(dict(zip(ids, documents))), dict(enumerate(ids)))
@@ -0,0 +1,27 @@
+import re
+from typing import List, Optional
+
+_REFINED_RE = re.compile(r'<refined id="(\d+)">(.*?)</refined>', re.DOTALL)
+
+
+def format_batch_documents(docs: List[str]) -> str:
+    """将多篇文档以带编号的分隔标签拼接，供 refine_docs_batch 提示词使用"""
+    return "\n\n".join(f'<document id="{i}">\n{doc}\n</document>' for i, doc in enumerate(docs, 1))
+
+
+def parse_batch_refine_output(output: str, expected_count: int) -> Optional[List[str]]:
+    """解析批量精炼的输出
+
+    Args:
+        output: 模型输出
+        expected_count: 输入文档数量
+
+    Returns:
+        Optional[List[str]]: 按输入顺序排列的精炼结果；缺少任一文档的结果时返回None
+    """
+    refined = {}
+    for match in _REFINED_RE.finditer(output or ""):
+        refined.setdefault(int(match.group(1)), match.group(2).strip())
+    if any(i not in refined for i in range(1, expected_count + 1)):
+        return None
+    return [refined[i] for i in range(1, expected_count + 1)]
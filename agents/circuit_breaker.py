@@ -0,0 +1,210 @@
+import random
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+
+class CircuitBreaker:
+    """后端熔断器（closed / open / half-open）
+
+    连续失败达到 failure_threshold 次后打开，打开期间的调用立即以 CircuitOpenError 失败；
+    经过 recovery_timeout 秒后进入半开状态，最多放行 half_open_max_calls 个探测调用，
+    探测成功则关闭，失败则重新打开。
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.name = name
+        self._lock = Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._opened = 0
+        self._rejected = 0
+        self.configure(failure_threshold=failure_threshold, recovery_timeout=recovery_timeout, half_open_max_calls=half_open_max_calls)
+
+    def configure(self, failure_threshold: int = 5, recovery_timeout: float = 30.0, half_open_max_calls: int = 1):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = max(1, half_open_max_calls)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._half_open_calls = 0
+        return self._state
+
+    def allow(self):
+        """检查是否放行本次调用，不放行时抛出 CircuitOpenError"""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            if state == HALF_OPEN and self._half_open_calls < self.half_open_max_calls:
+                self._half_open_calls += 1
+                return
+            self._rejected += 1
+        raise CircuitOpenError(f"{self.name} 熔断器已打开，调用被拒绝")
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN or (state == CLOSED and self._consecutive_failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._opened += 1
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        self.allow()
+        try:
+            result = fn()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._consecutive_failures,
+                "opened": self._opened,
+                "rejected": self._rejected,
+            }
+
+
+class RetryBudget:
+    """全局重试预算（令牌桶）
+
+    每次初次调用存入 ratio 个令牌，每次重试消耗一个令牌；另外每秒补充 min_per_second 个令牌，
+    保证低流量时也能重试。令牌数不超过 max_tokens。后端故障时重试量被限制在正常请求量的 ratio 倍左右。
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 100.0):
+        self._lock = Lock()
+        self.configure(ratio=ratio, min_per_second=min_per_second, max_tokens=max_tokens)
+        self._tokens = self.max_tokens
+        self._last_refill = time.monotonic()
+        self._retries = 0
+        self._exhausted = 0
+
+    def configure(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 100.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._last_refill) * self.min_per_second)
+        self._last_refill = now
+
+    def deposit(self):
+        """记录一次初次调用"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """申请一次重试，预算耗尽时返回False"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self._retries += 1
+                return True
+            self._exhausted += 1
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refill()
+            return {
+                "tokens": round(self._tokens, 2),
+                "retries": self._retries,
+                "exhausted": self._exhausted,
+            }
+
+
+def backoff_delay(base: float, attempt: int, max_delay: float) -> float:
+    """带完全抖动的指数退避：在 [0, min(max_delay, base * 2^(attempt-1))] 内均匀取值"""
+    return random.uniform(0, min(max_delay, base * (2 ** max(0, attempt - 1))))
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = Lock()
+
+# 服务器内所有后端共享的重试预算
+retry_budget = RetryBudget()
+
+
+class RetryCounter:
+    """一次逻辑调用的重试次数，由 call_with_retry_budget（及 ModelRouter.call）累加，供调用方写入统计"""
+
+    def __init__(self):
+        self.retries = 0
+
+
+def call_with_retry_budget(fn: Callable[[], Any], max_attempts: int, base_delay: float, max_delay: float,
+                           retryable: Tuple[Type[BaseException], ...] = (Exception,),
+                           on_retry: Optional[Callable[[BaseException, int], None]] = None,
+                           counter: Optional[RetryCounter] = None) -> Any:
+    """执行 fn，遇到 retryable 异常时按带抖动的指数退避重试
+
+    最多尝试 max_attempts 次，每次重试消耗全局重试预算的一个令牌；熔断器拒绝（CircuitOpenError）、
+    达到尝试次数或预算耗尽时抛出最后一次的异常。on_retry(异常, 已失败次数) 在每次重试前调用，
+    传入 counter 时每次重试都计入 counter.retries（无论最终成功还是失败）。
+    """
+    retry_budget.deposit()
+    attempt = 1
+    while True:
+        try:
+            return fn()
+        except CircuitOpenError:
+            raise
+        except retryable as e:
+            if attempt >= max_attempts or not retry_budget.try_acquire():
+                raise
+            if counter is not None:
+                counter.retries += 1
+            if on_retry is not None:
+                on_retry(e, attempt)
+            time.sleep(backoff_delay(base_delay, attempt, max_delay))
+            attempt += 1
+
+
+def get_circuit_breaker(name: str, **settings) -> CircuitBreaker:
+    """获取服务器内共享的熔断器（按后端名称）；传入的设置会覆盖之前的设置"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **settings)
+        elif settings:
+            breaker.configure(**settings)
+        return breaker
+
+
+def circuit_breaker_stats() -> Dict[str, Dict[str, Any]]:
+    """所有熔断器的状态"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
@@ -0,0 +1,99 @@
+import os
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+from loguru import logger
+from openai import OpenAI
+
+from agents.replay import traffic_replay
+
+# 连接池默认设置，可通过配置文件的 http_client 部分覆盖
+DEFAULT_HTTP_CLIENT_SETTINGS = {
+    'max_connections': 100,
+    'max_keepalive_connections': 20,
+    'keepalive_expiry': 30.0,
+    'http2': False,
+    'timeout': 600.0,
+    'connect_timeout': 10.0,
+}
+
+_settings: Dict[str, Any] = dict(DEFAULT_HTTP_CLIENT_SETTINGS)
+_clients: Dict[Tuple[str, str], httpx.Client] = {}
+_lock = Lock()
+
+
+def configure_http_clients(settings: Optional[Dict[str, Any]] = None):
+    """设置共享连接池参数，只影响之后新建的连接池"""
+    with _lock:
+        _settings.update(settings or {})
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_http_client(base_url: Optional[str], api_key: Optional[str]) -> httpx.Client:
+    """获取 (base_url, api_key) 对应的共享 httpx 客户端，同一端点的所有智能体复用一个长连接池
+
+    Args:
+        base_url: API端点
+        api_key: API密钥
+
+    Returns:
+        httpx.Client: 共享的HTTP客户端
+    """
+    key = (base_url or "", api_key or "")
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            http2 = bool(_settings['http2'])
+            if http2 and not _http2_available():
+                logger.warning("未安装 h2，HTTP/2 不可用，回退到 HTTP/1.1（可通过 pip install 'httpx[http2]' 启用）")
+                http2 = False
+            transport = httpx.HTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=_settings['max_connections'],
+                    max_keepalive_connections=_settings['max_keepalive_connections'],
+                    keepalive_expiry=_settings['keepalive_expiry'],
+                ),
+                http2=http2,
+            )
+            client = httpx.Client(
+                # 录制 / 回放模式下包装或替换传输层
+                transport=traffic_replay.wrap_transport(transport),
+                timeout=httpx.Timeout(_settings['timeout'], connect=_settings['connect_timeout']),
+                follow_redirects=True,
+            )
+            _clients[key] = client
+            logger.info(f"创建共享HTTP连接池: {base_url} (max_connections={_settings['max_connections']}, http2={http2})")
+        return client
+
+
+def get_openai_client(api_key: Optional[str] = None, base_url: Optional[str] = None, **kwargs) -> OpenAI:
+    """创建使用共享连接池的 OpenAI 客户端，api_key / base_url 缺省时读取环境变量"""
+    api_key = api_key or os.environ['OPENAI_API_KEY']
+    base_url = base_url or os.environ['OPENAI_BASE_URL']
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=get_http_client(base_url, api_key), **kwargs)
+
+
+def get_chat_model(config: Dict[str, Any], **kwargs) -> ChatOpenAI:
+    """根据智能体配置（api_key / base_url / model）创建使用共享连接池的 ChatOpenAI"""
+    api_key = config['api_key'] or os.environ['OPENAI_API_KEY']
+    base_url = config['base_url'] or os.environ['OPENAI_BASE_URL']
+    return ChatOpenAI(api_key=api_key, base_url=base_url, model=config['model'],
+                      http_client=get_http_client(base_url, api_key), **kwargs)
+
+
+def close_http_clients():
+    """关闭所有共享连接池（服务关闭时调用）"""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
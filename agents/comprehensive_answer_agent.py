@@ -1,7 +1,10 @@
 from typing import Any, Dict, List
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from langchain_openai import ChatOpenAI
+from agents.client_registry import get_chat_model
+from agents.model_router import model_router
+from agents.instrumentation import submit_with_context, gauges
+from agents.tracing import trace_span
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from langchain.prompts import PromptTemplate
 from langchain_core.runnables import RunnableLambda
@@ -17,11 +20,7 @@ logger = logging.getLogger(__name__)
 
 class ComprehensiveAnswerAgent:
     def __init__(self, config):
-        self.llm = ChatOpenAI(
-            api_key=config['api_key'] or os.environ["OPENAI_API_KEY"],
-            base_url=config['base_url'] or os.environ["OPENAI_BASE_URL"],
-            model=config['model'],
-        )
+        self.llm = get_chat_model(config)
         # 设置最大线程数，可以根据实际情况调整
         self.max_workers = config['max_workers']
         
@@ -33,13 +32,13 @@ class ComprehensiveAnswerAgent:
                 input_variables=['outline', 'title', 'summary', 'documents'],
                 template=PROMPTS['compose_with_subparagraphs']
             )
-            self.compose_with_subparagraphs_chain = compose_with_subparagraphs_template | self.llm | StrOutputParser()
+            self.compose_with_subparagraphs_chain = compose_with_subparagraphs_template | model_router.chat_runnable('compose_with_subparagraphs', self.llm) | StrOutputParser()
 
             compose_entire_article_template = PromptTemplate(
                 input_variables=['outline', 'title', 'summary', 'documents'],
                 template=PROMPTS['compose_entire_article']
             )
-            self.compose_entire_article_chain = compose_entire_article_template | self.llm | StrOutputParser()               
+            self.compose_entire_article_chain = compose_entire_article_template | model_router.chat_runnable('compose_entire_article', self.llm) | StrOutputParser()               
         except Exception as e:
             logger.error(f"预构建 Compose 处理链失败: {e}")
             self.compose_with_subparagraphs_chain = None
@@ -70,14 +69,15 @@ class ComprehensiveAnswerAgent:
                 compose_chain = self.compose_with_subparagraphs_chain
             
             # 调用Compose链生成内容
-            content = compose_chain.invoke(
-                {
-                    'outline': outline,
-                    'title': title,
-                    'summary': summary,
-                    'documents': documents
-                }
-            )
+            with gauges.stage_timer('compose'), trace_span('_compose_single', 'compose', title=title, level=node['level']):
+                content = compose_chain.invoke(
+                    {
+                        'outline': outline,
+                        'title': title,
+                        'summary': summary,
+                        'documents': documents
+                    }
+                )
             node['content'] = content
             logger.info(f"节点 '{title}' 的内容已生成。")
         except Exception as e:
@@ -115,9 +115,10 @@ class ComprehensiveAnswerAgent:
             
             # 使用 ThreadPoolExecutor 来并发处理节点
             with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                gauges.register_executor('compose', executor)
                 # 提交所有节点的处理任务
                 future_to_node = {
-                    executor.submit(self._compose_single, node, framework): node for node in curr_nodes
+                    submit_with_context(executor, self._compose_single, node, framework): node for node in curr_nodes
                 }
                 
                 # 使用 tqdm 显示进度条
@@ -0,0 +1,117 @@
+import hashlib
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from agents.single_flight import normalize_query
+
+
+class DocumentPool:
+    """文章级共享文档池
+
+    同一篇文章的所有叶节点共享一个文档池：按规范化后的检索查询缓存已完成的检索结果，
+    其他节点再发起相同查询时直接复用，不再调用检索后端；按 `Document.id` 加内容摘要缓存原始内容
+    （及其分片），兄弟章节检索到同一URL或知识库片段时复用池中的同一份内容，而不是各自保存一份；
+    并按精炼输入（文档、规范化后的检索查询和待精炼内容）缓存精炼结果，以相同查询检索到同一文档时
+    直接复用其他节点的精炼结果，省去一次LLM调用。
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._raw_contents: Dict[Tuple[str, str], str] = {}
+        self._shingles: Dict[Tuple[str, str], Any] = {}
+        self._refined_contents: Dict[str, str] = {}
+        self._search_results: Dict[Any, List[dict]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._refine_hits = 0
+        self._search_hits = 0
+        self._bytes_saved = 0
+        self._raw_bytes = 0
+
+    def get_search(self, key) -> Optional[List[dict]]:
+        """获取本文章中已完成的相同检索（key 为检索后端、作用域和规范化后的查询）的原始结果"""
+        with self._lock:
+            results = self._search_results.get(key)
+            if results is not None:
+                self._search_hits += 1
+            return results
+
+    def put_search(self, key, results: List[dict]):
+        """缓存一次成功检索的原始结果"""
+        with self._lock:
+            self._search_results.setdefault(key, results)
+
+    def acquire(self, doc):
+        """登记一个新检索到的文档；若池中已有同ID且内容相同的文档，则复用池中的原始内容和分片
+
+        ID 相同但内容不同的文档（如同一URL在不同时间抓取的内容）各自独立登记，绝不互相覆盖。
+
+        Args:
+            doc: 尚未精炼的Document
+
+        Returns:
+            Document: 传入的文档
+        """
+        key = (doc.id, hashlib.sha1(doc.content.encode('utf-8')).hexdigest())
+        with self._lock:
+            pooled_content = self._raw_contents.get(key)
+            if pooled_content is None:
+                self._raw_contents[key] = doc.content
+                self._raw_bytes += len(doc.content.encode('utf-8'))
+                self._misses += 1
+                return doc
+
+            self._hits += 1
+            doc.content = pooled_content
+            pooled_shingles = self._shingles.get(key)
+
+        if pooled_shingles is None:
+            pooled_shingles = doc.shingles
+            with self._lock:
+                self._shingles.setdefault(key, pooled_shingles)
+        else:
+            doc._shingles = pooled_shingles
+        return doc
+
+    @staticmethod
+    def refine_key(doc) -> str:
+        """精炼结果的缓存键：精炼提示词的输入只有待精炼内容和检索查询（作为title和summary），与节点无关"""
+        digest = hashlib.sha1()
+        for part in (doc.source, doc.id, normalize_query(doc.query), doc.content):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get_refined(self, key: str, raw_content: str) -> Optional[str]:
+        """获取以相同输入精炼过的文档内容；命中时省去的精炼输入计入 bytes_saved"""
+        with self._lock:
+            refined = self._refined_contents.get(key)
+            if refined is not None:
+                self._refine_hits += 1
+                self._bytes_saved += len(raw_content.encode('utf-8'))
+            return refined
+
+    def put_refined(self, key: str, content: str):
+        """缓存精炼结果，key 由 refine_key 在精炼前计算"""
+        with self._lock:
+            self._refined_contents.setdefault(key, content)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回文档池统计信息"""
+        with self._lock:
+            return {
+                "documents": len(self._raw_contents),
+                "hits": self._hits,
+                "misses": self._misses,
+                "refine_hits": self._refine_hits,
+                "search_hits": self._search_hits,
+                "bytes_saved": self._bytes_saved,
+                "raw_bytes": self._raw_bytes,
+            }
+
+    def log_summary(self, process_id: str):
+        stats = self.stats()
+        logger.info(f"PID-{process_id}: 文档池共 {stats['documents']} 个文档，命中 {stats['hits']} 次，"
+                    f"检索复用 {stats['search_hits']} 次，精炼缓存命中 {stats['refine_hits']} 次，节省 {stats['bytes_saved']} 字节")
@@ -0,0 +1,242 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+# 延迟直方图的桶上界（秒），最后一个桶为 +Inf
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class LatencyTracker:
+    """记录调用延迟：最近 window 次的滑动窗口用于计算分位数，累计直方图用于观察尾延迟"""
+
+    def __init__(self, window: int = 500):
+        self._lock = Lock()
+        self._samples = np.zeros(window, dtype=np.float64)
+        self._count = 0
+        self._sum = 0.0
+        self._bucket_counts = np.zeros(len(LATENCY_BUCKETS) + 1, dtype=np.int64)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples[self._count % self._samples.size] = seconds
+            self._count += 1
+            self._sum += seconds
+            self._bucket_counts[np.searchsorted(LATENCY_BUCKETS, seconds)] += 1
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def percentile(self, p: float) -> Optional[float]:
+        """滑动窗口内的第 p 百分位延迟，无样本时返回None"""
+        with self._lock:
+            size = min(self._count, self._samples.size)
+            if not size:
+                return None
+            return float(np.percentile(self._samples[:size], p))
+
+    def histogram(self) -> Dict[str, int]:
+        """累计直方图，键为桶上界（le），值为落入该桶及以下的次数"""
+        with self._lock:
+            cumulative = np.cumsum(self._bucket_counts)
+        labels = [str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"]
+        return dict(zip(labels, cumulative.tolist()))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "count": self._count,
+            "sum_seconds": round(self._sum, 3),
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "histogram": self.histogram(),
+        }
+
+
+class _Attempt:
+    """一次提交到线程池的调用，记录其开始执行的时刻；在提交方的上下文副本中执行，保留流程标签和追踪span"""
+
+    def __init__(self, fn: Callable[[], Any]):
+        self.fn = fn
+        self.context = copy_context()
+        self.started = Event()
+        self.start: Optional[float] = None
+
+    def __call__(self) -> Any:
+        self.start = time.monotonic()
+        self.started.set()
+        return self.context.run(self.fn)
+
+
+class HedgedCaller:
+    """带截止时间和对冲请求的后端调用器
+
+    - timeout: 单次逻辑调用的截止时间（秒），超时抛出 TimeoutError，None 或 0 表示不限；
+      从主请求开始执行时计时，在线程池中排队的时间不计入，避免高负载时请求尚未发出就被判为超时
+    - hedge: 主请求在对冲延迟内未完成时发起一个重复请求，先成功者胜出；
+      对冲延迟取最近延迟的第 percentile 百分位（不低于 min_delay），样本少于 min_samples 时不对冲
+    - max_workers: 执行调用的线程池大小
+
+    Python 线程无法被强制中止：落败请求若尚未开始执行会被取消，已在执行的请求在后台跑完后丢弃结果，
+    其最长存活时间由后端客户端自身的超时约束（网络搜索与LLM客户端的超时取自 call_deadlines）。
+    """
+
+    def __init__(self, name: str, timeout: Optional[float] = None, hedge: bool = False, percentile: float = 95,
+                 min_delay: float = 0.5, min_samples: int = 20, max_workers: int = 64):
+        self.name = name
+        self.latency = LatencyTracker()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.max_workers = 0
+        self._lock = Lock()
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._timeouts = 0
+        self._errors = 0
+        self.configure(timeout=timeout, hedge=hedge, percentile=percentile, min_delay=min_delay,
+                       min_samples=min_samples, max_workers=max_workers)
+
+    def configure(self, timeout: Optional[float] = None, hedge: bool = False, percentile: float = 95,
+                  min_delay: float = 0.5, min_samples: int = 20, max_workers: int = 64):
+        self.timeout = timeout or None
+        self.hedge = hedge
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        max_workers = max(1, int(max_workers))
+        with self._lock:
+            if max_workers != self.max_workers:
+                # 线程池大小变化时换用新线程池，旧线程池中已提交的调用照常执行完
+                previous = self._executor
+                self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"hedged-{self.name}")
+                self.max_workers = max_workers
+                if previous is not None:
+                    previous.shutdown(wait=False)
+
+    def hedge_delay(self) -> Optional[float]:
+        """当前的对冲延迟，不满足对冲条件时返回None"""
+        if not self.hedge or self.latency.count < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.percentile(self.percentile) or 0.0)
+
+    def _count(self, attr: str):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+    def _submit(self, fn: Callable[[], Any]):
+        attempt = _Attempt(fn)
+        with self._lock:
+            executor = self._executor
+        return executor.submit(attempt), attempt
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """在截止时间内执行 fn，必要时发起对冲请求，返回先成功的结果"""
+        delay = self.hedge_delay()
+        if self.timeout is None and delay is None:
+            start = time.monotonic()
+            try:
+                result = fn()
+            except Exception:
+                self._count('_errors')
+                raise
+            self.latency.record(time.monotonic() - start)
+            return result
+
+        primary, attempt = self._submit(fn)
+        # 截止时间和对冲延迟都从主请求开始执行时计算
+        attempt.started.wait()
+        start = attempt.start
+        deadline = start + self.timeout if self.timeout else None
+        futures = [primary]
+        if delay is not None:
+            first_wait = delay if deadline is None else min(delay, deadline - time.monotonic())
+            done, _ = wait(futures, timeout=max(0.0, first_wait))
+            if not done and (deadline is None or time.monotonic() < deadline):
+                futures.append(self._submit(fn)[0])
+                self._count('_hedged')
+
+        pending = set(futures)
+        error = None
+        while pending:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    self.latency.record(time.monotonic() - start)
+                    if future is not primary:
+                        self._count('_hedge_wins')
+                    return future.result()
+                error = future.exception()
+
+        if pending:
+            for future in pending:
+                future.cancel()
+            self._count('_timeouts')
+            raise TimeoutError(f"{self.name} 调用超过截止时间 {self.timeout}s")
+        self._count('_errors')
+        raise error
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.latency.stats()
+        with self._lock:
+            stats.update({
+                "hedged": self._hedged,
+                "hedge_wins": self._hedge_wins,
+                "timeouts": self._timeouts,
+                "errors": self._errors,
+            })
+            executor = self._executor
+        stats["queue_depth"] = executor._work_queue.qsize()
+        stats["threads"] = len(executor._threads)
+        stats["max_workers"] = self.max_workers
+        return stats
+
+
+_callers: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], HedgedCaller] = {}
+_callers_lock = Lock()
+
+
+def caller_settings(config: Dict[str, Any], backend: str) -> Dict[str, Any]:
+    """从智能体配置的 call_deadlines / hedging 部分解析某个后端调用器的设置"""
+    call_deadlines = config.get('call_deadlines') or {}
+    hedging_config = config.get('hedging') or {}
+    hedge_backends = hedging_config.get('backends', ['web_search', 'kb_search']) if hedging_config.get('enabled', False) else []
+    return {
+        'timeout': call_deadlines.get(backend),
+        'hedge': backend in hedge_backends,
+        'percentile': hedging_config.get('percentile', 95),
+        'min_delay': hedging_config.get('min_delay', 0.5),
+        'min_samples': hedging_config.get('min_samples', 20),
+        'max_workers': hedging_config.get('max_workers', 64),
+    }
+
+
+def get_hedged_caller(name: str, **settings) -> HedgedCaller:
+    """获取服务器内共享的调用器，按后端名称加设置区分
+
+    设置相同的智能体（通常来自同一份配置）共享一个调用器，延迟分布在所有流程间累积，
+    其线程池（max_workers）即该后端在这份配置下的服务器级并发上限；设置不同的智能体各用一个调用器，
+    互不覆盖，统计中以 "名称#序号" 区分。
+    """
+    key = (name, tuple(sorted(settings.items())))
+    with _callers_lock:
+        caller = _callers.get(key)
+        if caller is None:
+            existing = sum(1 for caller_name, _ in _callers if caller_name == name)
+            label = f"{name}#{existing + 1}" if existing else name
+            caller = _callers[key] = HedgedCaller(label, **settings)
+        return caller
+
+
+def latency_stats() -> Dict[str, Dict[str, Any]]:
+    """所有后端调用器的延迟统计"""
+    with _callers_lock:
+        callers = list(_callers.values())
+    return {caller.name: caller.stats() for caller in callers}
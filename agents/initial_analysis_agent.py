@@ -1,4 +1,7 @@
-from langchain_openai import ChatOpenAI
+from agents.client_registry import get_chat_model
+from agents.model_router import model_router
+from agents.instrumentation import gauges
+from agents.tracing import trace_span
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from langchain.prompts import PromptTemplate
 from langchain_core.runnables import RunnableLambda
@@ -160,9 +163,7 @@ class ArticleOutline():
 
 class InitialAnalysisAgent:
     def __init__(self, config:dict):
-        self.llm = ChatOpenAI(api_key=config['api_key'] or os.environ['OPENAI_API_KEY'],
-                              base_url=config['base_url'] or os.environ['OPENAI_BASE_URL'],
-                              model=config['model'])
+        self.llm = get_chat_model(config)
         
         
     
@@ -172,14 +173,15 @@ class InitialAnalysisAgent:
             template=PROMPTS['initial_analysis_agent']
         )
         
-        analysis_chain = analysis_template | self.llm | JsonOutputParser()
+        analysis_chain = analysis_template | model_router.chat_runnable('initial_analysis_agent', self.llm) | JsonOutputParser()
         
-        response = analysis_chain.invoke(
-            {
-                'topic': topic,
-                'description': description,
-                'problem': problem
-            }
-        )
+        with gauges.stage_timer('outline'), trace_span('get_framework', 'outline'):
+            response = analysis_chain.invoke(
+                {
+                    'topic': topic,
+                    'description': description,
+                    'problem': problem
+                }
+            )
         
         return ArticleOutline(response)
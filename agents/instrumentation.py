@@ -0,0 +1,309 @@
+import time
+import weakref
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from threading import Lock
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from openai import RateLimitError
+
+from agents.hedging import LatencyTracker
+
+# 当前调用的标签（process_id / node_id / iteration），线程池任务需通过 submit_with_context 传递
+_context: ContextVar[Dict[str, Any]] = ContextVar('metrics_context', default={})
+
+
+@contextmanager
+def metrics_context(**tags):
+    """在代码块内为所有LLM/检索调用附加标签"""
+    token = _context.set({**_context.get(), **tags})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def update_metrics_context(**tags):
+    """更新当前上下文的标签（如每轮迭代更新 iteration），作用到外层 metrics_context 结束为止"""
+    _context.set({**_context.get(), **tags})
+
+
+def current_context() -> Dict[str, Any]:
+    return _context.get()
+
+
+def submit_with_context(executor, fn: Callable, *args, **kwargs):
+    """向线程池提交任务，并把当前标签上下文带到工作线程"""
+    return executor.submit(copy_context().run, fn, *args, **kwargs)
+
+
+def _new_counters() -> Dict[str, float]:
+    return {
+        "calls": 0,
+        "errors": 0,
+        "retries": 0,
+        "cache_hits": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "seconds": 0.0,
+        "max_seconds": 0.0,
+    }
+
+
+def _add(counters: Dict[str, float], seconds: float, prompt_tokens: int, completion_tokens: int,
+         retries: int, cache_hit: bool, error: bool):
+    counters["calls"] += 1
+    counters["errors"] += int(error)
+    counters["retries"] += retries
+    counters["cache_hits"] += int(cache_hit)
+    counters["prompt_tokens"] += prompt_tokens
+    counters["completion_tokens"] += completion_tokens
+    counters["seconds"] += seconds
+    counters["max_seconds"] = max(counters["max_seconds"], seconds)
+
+
+def _report(counters: Dict[str, float]) -> Dict[str, Any]:
+    report = dict(counters)
+    report["seconds"] = round(report["seconds"], 3)
+    report["max_seconds"] = round(report["max_seconds"], 3)
+    report["avg_seconds"] = round(counters["seconds"] / counters["calls"], 3) if counters["calls"] else 0.0
+    return report
+
+
+class MetricsRecorder:
+    """内存中的调用统计：按流程、节点、迭代和 PROMPTS 键（检索调用为后端名）聚合token、耗时、重试和缓存命中
+
+    只保存聚合计数而非逐条记录，内存占用与流程数 × 节点数 × 键数成正比；按流程的统计最多保留最近的
+    max_processes 个流程，超出时淘汰最早开始记录的流程（服务器范围的统计不受影响）。
+    """
+
+    def __init__(self, max_processes: int = 100):
+        self._lock = Lock()
+        self._global: Dict[str, Dict[str, float]] = defaultdict(_new_counters)
+        self._processes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.max_processes = max_processes
+
+    def _process(self, process_id: str) -> Dict[str, Any]:
+        process = self._processes.get(process_id)
+        if process is None:
+            process = self._processes[process_id] = {
+                "totals": _new_counters(),
+                "by_key": defaultdict(_new_counters),
+                "by_node": defaultdict(_new_counters),
+                "by_iteration": defaultdict(_new_counters),
+            }
+            while len(self._processes) > self.max_processes:
+                self._processes.popitem(last=False)
+        return process
+
+    def record(self, kind: str, key: Optional[str], seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+               retries: int = 0, cache_hit: bool = False, error: bool = False, **tags):
+        """记录一次调用
+
+        Args:
+            kind: 调用类型，'llm' 或 'search'
+            key: PROMPTS键（LLM调用）或后端名称（检索调用）
+            seconds: 耗时
+            prompt_tokens: 输入token数
+            completion_tokens: 输出token数
+            retries: 重试次数
+            cache_hit: 是否命中缓存或复用了进行中的相同调用
+            error: 调用是否最终失败
+            **tags: 覆盖上下文中的 process_id / node_id / iteration
+        """
+        tags = {**_context.get(), **tags}
+        name = f"{kind}:{key or 'unknown'}"
+        values = (seconds, prompt_tokens, completion_tokens, retries, cache_hit, error)
+        with self._lock:
+            _add(self._global[name], *values)
+            process_id = tags.get('process_id')
+            if not process_id:
+                return
+            process = self._process(process_id)
+            _add(process["totals"], *values)
+            _add(process["by_key"][name], *values)
+            if tags.get('node_id'):
+                _add(process["by_node"][tags['node_id']], *values)
+            if tags.get('iteration') is not None:
+                _add(process["by_iteration"][str(tags['iteration'])], *values)
+
+    def process_metrics(self, process_id: str) -> Optional[Dict[str, Any]]:
+        """单个流程的统计，流程没有任何记录时返回None"""
+        with self._lock:
+            process = self._processes.get(process_id)
+            if process is None:
+                return None
+            return {
+                "totals": _report(process["totals"]),
+                "by_key": {name: _report(counters) for name, counters in process["by_key"].items()},
+                "by_node": {node: _report(counters) for node, counters in process["by_node"].items()},
+                "by_iteration": {iteration: _report(counters) for iteration, counters in process["by_iteration"].items()},
+            }
+
+    def summary(self) -> Dict[str, Any]:
+        """服务器范围的统计：按键聚合并按总耗时降序排列，便于找出热点提示词"""
+        with self._lock:
+            by_key = {name: _report(counters) for name, counters in self._global.items()}
+            process_count = len(self._processes)
+        return {
+            "processes": process_count,
+            "by_key": dict(sorted(by_key.items(), key=lambda item: item[1]["seconds"], reverse=True)),
+        }
+
+    def remove_process(self, process_id: str):
+        with self._lock:
+            self._processes.pop(process_id, None)
+
+
+# 服务器内共享的统计实例
+recorder = MetricsRecorder()
+
+
+def record_completion(key: Optional[str], seconds: float, response: Any = None, retries: int = 0, error: bool = False, **tags):
+    """记录一次 OpenAI chat.completions 调用（含其全部重试），从响应的 usage 中读取token数"""
+    usage = getattr(response, 'usage', None)
+    recorder.record(
+        'llm', key, seconds,
+        prompt_tokens=getattr(usage, 'prompt_tokens', 0) or 0,
+        completion_tokens=getattr(usage, 'completion_tokens', 0) or 0,
+        retries=retries, error=error, **tags
+    )
+
+
+def record_chat_completion(key: Optional[str], seconds: float, message: Any = None, retries: int = 0, error: bool = False):
+    """记录一次 LangChain 聊天模型调用（含其全部重试），从 AIMessage 的 usage_metadata 中读取token数"""
+    usage = getattr(message, 'usage_metadata', None) or {}
+    recorder.record(
+        'llm', key, seconds,
+        prompt_tokens=usage.get('input_tokens', 0) or 0,
+        completion_tokens=usage.get('output_tokens', 0) or 0,
+        retries=retries, error=error,
+    )
+
+
+class RuntimeGauges:
+    """服务器运行时指标：阶段耗时直方图、进行中的调用数、线程池排队深度以及带标签的计数器"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stages: Dict[str, LatencyTracker] = {}
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._counters: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._executors: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def observe_stage(self, stage: str, seconds: float):
+        with self._lock:
+            tracker = self._stages.get(stage)
+            if tracker is None:
+                tracker = self._stages[stage] = LatencyTracker()
+        tracker.record(seconds)
+
+    @contextmanager
+    def stage_timer(self, stage: str):
+        """记录代码块的耗时到阶段直方图"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def begin_call(self, kind: str):
+        with self._lock:
+            self._in_flight[kind] += 1
+
+    def end_call(self, kind: str):
+        with self._lock:
+            self._in_flight[kind] -= 1
+
+    @contextmanager
+    def in_flight(self, kind: str):
+        """统计进行中的调用数"""
+        self.begin_call(kind)
+        try:
+            yield
+        finally:
+            self.end_call(kind)
+
+    def increment(self, name: str, label: str = "", amount: int = 1):
+        with self._lock:
+            self._counters[(name, label)] += amount
+
+    def register_executor(self, name: str, executor):
+        """登记线程池以便导出排队深度，线程池被回收后自动移除"""
+        with self._lock:
+            self._executors[executor] = name
+
+    def stage_stats(self) -> Dict[str, LatencyTracker]:
+        with self._lock:
+            return dict(self._stages)
+
+    def in_flight_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._in_flight)
+
+    def counter_stats(self) -> Dict[Tuple[str, str], int]:
+        with self._lock:
+            return dict(self._counters)
+
+    def executor_stats(self) -> Dict[str, Dict[str, int]]:
+        """按名称汇总的线程池排队任务数和线程数"""
+        with self._lock:
+            executors = list(self._executors.items())
+        stats: Dict[str, Dict[str, int]] = defaultdict(lambda: {"queue_depth": 0, "threads": 0})
+        for executor, name in executors:
+            stats[name]["queue_depth"] += executor._work_queue.qsize()
+            stats[name]["threads"] += len(executor._threads)
+        return dict(stats)
+
+
+# 服务器内共享的运行时指标
+gauges = RuntimeGauges()
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """判断异常是否为后端限流（HTTP 429）"""
+    return isinstance(error, RateLimitError) or '429' in str(error)
+
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """LangChain回调：记录链中每次聊天模型调用的耗时和token用量"""
+
+    def __init__(self, prompt_key: str):
+        self.prompt_key = prompt_key
+        self._starts: Dict[UUID, float] = {}
+        self._lock = Lock()
+
+    def _start(self, run_id: UUID):
+        with self._lock:
+            self._starts[run_id] = time.perf_counter()
+        gauges.begin_call('llm')
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._start(run_id)
+
+    def _elapsed(self, run_id: UUID) -> float:
+        with self._lock:
+            start = self._starts.pop(run_id, None)
+        if start is None:
+            return 0.0
+        gauges.end_call('llm')
+        return time.perf_counter() - start
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        usage = (response.llm_output or {}).get('token_usage') or {}
+        recorder.record(
+            'llm', self.prompt_key, self._elapsed(run_id),
+            prompt_tokens=usage.get('prompt_tokens', 0) or 0,
+            completion_tokens=usage.get('completion_tokens', 0) or 0,
+        )
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        if is_rate_limited(error):
+            gauges.increment('rate_limited', 'llm')
+        recorder.record('llm', self.prompt_key, self._elapsed(run_id), error=True)
@@ -1,9 +1,9 @@
-from langchain_openai import ChatOpenAI
+from agents.client_registry import get_chat_model
+from agents.model_router import model_router
 from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import PromptTemplate
 from agents.prompts import PROMPTS
 from agents.initial_analysis_agent import ArticleOutline
-import os
 from loguru import logger
 
 class IntroductionConclusionAgent:
@@ -16,11 +16,7 @@ class IntroductionConclusionAgent:
     """
     
     def __init__(self, config):
-        self.llm = ChatOpenAI(
-            api_key=config['api_key'] or os.environ["OPENAI_API_KEY"],
-            base_url=config['base_url'] or os.environ["OPENAI_BASE_URL"],
-            model=config['model'],
-        )
+        self.llm = get_chat_model(config)
         
         # 构建引言生成链
         try:
@@ -28,14 +24,14 @@ class IntroductionConclusionAgent:
                 input_variables=['outline', 'main_content', 'topic', 'description'],
                 template=PROMPTS['generate_introduction']
             )
-            self.introduction_chain = introduction_template | self.llm | StrOutputParser()
+            self.introduction_chain = introduction_template | model_router.chat_runnable('generate_introduction', self.llm) | StrOutputParser()
             
             # 构建总结生成链
             conclusion_template = PromptTemplate(
                 input_variables=['outline', 'main_content', 'topic', 'description'],
                 template=PROMPTS['generate_conclusion']
             )
-            self.conclusion_chain = conclusion_template | self.llm | StrOutputParser()
+            self.conclusion_chain = conclusion_template | model_router.chat_runnable('generate_conclusion', self.llm) | StrOutputParser()
             
             logger.info("引言和总结生成链构建成功")
         except Exception as e:
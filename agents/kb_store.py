@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import faiss
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，不对构建过程加锁
+    fcntl = None
+
+from agents.ann_index import ANNIndexFactory
+
+INDEX_FILE = 'index.faiss'
+DOCSTORE_FILE = 'docstore.sqlite'
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = '.build.lock'
+
+# IVF 索引的倒排表用 IO_FLAG_MMAP 映射；Flat / HNSW 的向量用 IO_FLAG_MMAP_IFC 原地映射（两者不能同时使用）
+_IVF_TYPES = ('ivf_flat', 'ivf_pq')
+_MMAP_IFC = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+
+
+def kb_fingerprint(kb_path: str, files: List[str], settings: Dict[str, Any]) -> str:
+    """知识库目录、文件（文件名、大小、修改时间）与构建设置的摘要，任一变化都需要重建磁盘索引"""
+    entries = []
+    for name in sorted(files):
+        stat = os.stat(os.path.join(kb_path, name))
+        entries.append([name, stat.st_size, stat.st_mtime_ns])
+    payload = json.dumps({'kb_path': os.path.abspath(kb_path), 'files': entries, 'settings': settings}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class SQLiteDocstore(Docstore):
+    """只读的 SQLite 文档库：片段正文和元数据按向量在索引中的位置（rowid）存放，检索时按需读取
+
+    构造时即打开唯一一个只读连接并由各线程共享（查询按主键读取，加锁串行执行），并开启 SQLite 的 mmap 读取，
+    多个进程打开同一个文件时共享操作系统页缓存，进程堆中不保存任何片段文本。连接持有的是打开时的文件，
+    即使其他进程随后重建知识库替换了 docstore.sqlite，本进程读到的仍是与已加载索引配套的旧文件。
+    """
+
+    def __init__(self, path: str, mmap_bytes: int = 1 << 30):
+        self.path = path
+        self.mmap_bytes = mmap_bytes
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+        self._connection.execute(f"PRAGMA mmap_size={int(mmap_bytes)}")
+        # 立即读取一次，确保文件已在此刻打开，而不是推迟到第一次检索
+        self._count = self._connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def search(self, search: Union[int, str]) -> Union[str, Document]:
+        with self._lock:
+            row = self._connection.execute("SELECT page_content, metadata FROM chunks WHERE id = ?", (int(search),)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def write(path: str, documents: List[Document]):
+        connection = sqlite3.connect(path)
+        try:
+            connection.execute("CREATE TABLE chunks (id INTEGER PRIMARY KEY, page_content TEXT NOT NULL, metadata TEXT NOT NULL)")
+            connection.executemany(
+                "INSERT INTO chunks (id, page_content, metadata) VALUES (?, ?, ?)",
+                ((position, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False, default=str)) for position, doc in enumerate(documents)),
+            )
+            connection.commit()
+        finally:
+            connection.close()
+
+
+class RowIds(Mapping):
+    """索引位置到文档库 id 的映射：两者相同，不必像 FAISS 包装类默认那样为每个片段保存一个字典项"""
+
+    def __init__(self, count: int):
+        self._count = count
+
+    def __getitem__(self, position: int) -> int:
+        position = int(position)
+        if not 0 <= position < self._count:
+            raise KeyError(position)
+        return position
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._count))
+
+    def __len__(self) -> int:
+        return self._count
+
+
+class MmapKBStore:
+    """本地知识库索引的磁盘格式，供多个进程（如多个 Uvicorn worker）共享
+
+    directory 下保存 index.faiss（FAISS 索引）、docstore.sqlite（片段正文与元数据）和 manifest.json
+    （指纹与索引信息）。加载时索引以 mmap 方式打开，文档库按 id 惰性读取，各进程共享页缓存，
+    每个进程的常驻内存只包含索引的少量结构。指纹不一致时重新构建；构建过程持有文件锁，
+    同时启动的其他进程等待构建完成后直接加载。
+    """
+
+    def __init__(self, directory: str, docstore_mmap_bytes: int = 1 << 30):
+        self.directory = directory
+        self.docstore_mmap_bytes = docstore_mmap_bytes
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def manifest(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(MANIFEST_FILE), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @contextmanager
+    def _build_lock(self, shared: bool = False):
+        """构建时持有排他锁；加载时持有共享锁，保证读到的清单、索引和文档库属于同一次构建"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(LOCK_FILE), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, embeddings, index_factory: ANNIndexFactory, fingerprint: Optional[str] = None) -> Optional[FAISS]:
+        """以 mmap 方式打开磁盘索引；不存在或指纹不一致时返回 None"""
+        if not os.path.isdir(self.directory):
+            return None
+        with self._build_lock(shared=True):
+            return self._load(embeddings, index_factory, fingerprint)
+
+    def _load(self, embeddings, index_factory: ANNIndexFactory, fingerprint: Optional[str] = None) -> Optional[FAISS]:
+        manifest = self.manifest()
+        if manifest is None or (fingerprint is not None and manifest.get('fingerprint') != fingerprint):
+            return None
+        flags = (faiss.IO_FLAG_MMAP if manifest.get('index_type') in _IVF_TYPES else _MMAP_IFC) | faiss.IO_FLAG_READ_ONLY
+        index = faiss.read_index(self._path(INDEX_FILE), flags)
+        index_factory.apply_search_parameters(index)
+        docstore = SQLiteDocstore(self._path(DOCSTORE_FILE), self.docstore_mmap_bytes)
+        logger.info(f"已以 mmap 方式加载磁盘索引: {self.directory} ({manifest.get('factory')}, {index.ntotal} 个片段)")
+        return FAISS(embeddings, index, docstore, RowIds(index.ntotal))
+
+    def save(self, index, index_type: str, documents: List[Document], fingerprint: str, index_factory: ANNIndexFactory):
+        """写入索引、文档库和清单；先写临时文件再替换
+
+        多个进程共享目录时应在排他的构建锁内调用（见 open_or_build）。已加载旧索引的进程继续使用其映射的旧索引和已打开的旧文档库，
+        下次加载时才会读到新文件。
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        index_tmp, docstore_tmp, manifest_tmp = (self._path(f"{name}.tmp") for name in (INDEX_FILE, DOCSTORE_FILE, MANIFEST_FILE))
+        if os.path.exists(docstore_tmp):
+            os.remove(docstore_tmp)
+        faiss.write_index(index, index_tmp)
+        SQLiteDocstore.write(docstore_tmp, documents)
+        manifest = {
+            'fingerprint': fingerprint,
+            'index_type': index_type,
+            'factory': index_factory.factory_string(index_type, index.ntotal, index.d),
+            'chunks': index.ntotal,
+            'dimension': index.d,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        with open(manifest_tmp, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=2)
+        # 清单最后替换，读到新清单时索引和文档库一定已经就绪
+        os.replace(index_tmp, self._path(INDEX_FILE))
+        os.replace(docstore_tmp, self._path(DOCSTORE_FILE))
+        os.replace(manifest_tmp, self._path(MANIFEST_FILE))
+
+    def open_or_build(self, fingerprint: str, embeddings, index_factory: ANNIndexFactory,
+                      load_documents: Callable[[], List[Document]]) -> FAISS:
+        """指纹一致时直接加载磁盘索引，否则加载文档、构建并保存后再以 mmap 方式加载"""
+        store = self.load(embeddings, index_factory, fingerprint)
+        if store is not None:
+            return store
+        with self._build_lock():
+            # 等待锁期间可能已由其他进程构建完成
+            store = self._load(embeddings, index_factory, fingerprint)
+            if store is not None:
+                return store
+            documents = load_documents()
+            index, index_type = index_factory.index_documents(documents, embeddings)
+            self.save(index, index_type, documents, fingerprint, index_factory)
+            logger.info(f"磁盘索引已写入: {self.directory}")
+            del index, documents
+            return self._load(embeddings, index_factory, fingerprint)
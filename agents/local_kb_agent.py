@@ -1,22 +1,26 @@
 from langchain_community.document_loaders import Docx2txtLoader, PyPDFLoader, TextLoader, CSVLoader, UnstructuredEPubLoader  # 读取论文文件
 from langchain_text_splitters import RecursiveCharacterTextSplitter  # 将读取的文件拆分为chunk
 from langchain_community.embeddings import HuggingFaceEmbeddings  # 读取huggingface的embedding模型
-from langchain_community.vectorstores import FAISS  # 把embedding模型的编码结果储存为向量数据库
+from agents.ann_index import ANNIndexFactory  # 把embedding模型的编码结果储存为向量数据库（精确或近似最近邻索引）
+from agents.kb_store import MmapKBStore, kb_fingerprint  # 磁盘索引（mmap）与 SQLite 文档库
 from langchain_community.cross_encoders import HuggingFaceCrossEncoder  # 读取huggingface的cross_embedding模型
 from langchain.retrievers.document_compressors import CrossEncoderReranker  # 设置reranker模型的重排方法
 from langchain.retrievers import ContextualCompressionRetriever  # 整合embedding和reranker
 # 构造 chatgpt + rag
-from langchain_openai import ChatOpenAI
+from agents.model_router import LLMCallGuard, model_router
 from langchain.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 import os
 import logging
 from tqdm import tqdm
-from typing import Dict, List
+from typing import Any, Dict, List, Optional
 from agents.prompts import PROMPTS
+from agents.batch_refine import format_batch_documents, parse_batch_refine_output
 from agents.initial_analysis_agent import ArticleOutline
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from langchain_core.documents import Document
+
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 # 配置日志
@@ -58,7 +62,8 @@ def _file2docs(file_path, chunk_size, chunk_overlap):
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
+            separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
+            add_start_index=True,  # 记录片段在页内的起始位置，区分同一页的多个片段
         )
         texts = text_splitter.split_documents(docs)
         return texts
@@ -66,8 +71,22 @@ def _file2docs(file_path, chunk_size, chunk_overlap):
         logger.error(f"拆分文档失败 ({file_path}): {e}")
         return []
 
+class ScoredCrossEncoderReranker(CrossEncoderReranker):
+    """与 CrossEncoderReranker 相同的重排逻辑，但把交叉编码器的相关性分数写入返回文档的 metadata['relevance_score']"""
+    
+    def compress_documents(self, documents, query, callbacks=None):
+        if not documents:
+            return []
+        scores = self.model.score([(query, doc.page_content) for doc in documents])
+        docs_with_scores = sorted(zip(documents, scores), key=lambda item: item[1], reverse=True)
+        # 向量库返回的是共享的Document对象，复制后再写入分数
+        return [
+            Document(page_content=doc.page_content, metadata={**doc.metadata, 'relevance_score': float(score)})
+            for doc, score in docs_with_scores[:self.top_n]
+        ]
+
 class LocalKBAgent:
-    def __init__(self, config):
+    def __init__(self, config, llm_settings: Optional[Dict[str, Any]] = None):
         self.kb_path = config['kb_path']
         self.embedding_model = config['embedding_model']
         self.reranker_model = config['reranker_model']
@@ -78,10 +97,16 @@ class LocalKBAgent:
         self.device = config['device']
         # 设置最大线程数，可以根据实际情况调整
         self.max_workers = config['max_workers']
+        # 向量索引类型及查询参数，默认按片段数自动选择
+        index_config = config.get('index') or {}
+        self.index_factory = ANNIndexFactory(index_config)
+        # 配置 persist_dir 时索引和文档库保存在磁盘上并以 mmap 方式打开，多个进程共享页缓存
+        self.kb_store = MmapKBStore(index_config['persist_dir'], index_config.get('docstore_mmap_bytes', 1 << 30)) if index_config.get('persist_dir') else None
         
-        self.llm = ChatOpenAI(api_key=config['api_key'] or os.environ['OPENAI_API_KEY'],
-                              base_url=config['base_url'] or os.environ['OPENAI_BASE_URL'],
-                              model=config['model'])
+        # 精炼和假设性文档调用经由截止时间、熔断器和全局重试预算保护，SDK 自身的重试关闭；
+        # llm_settings 提供 call_deadlines / hedging / circuit_breaker / max_retries 等设置（通常为网络检索配置），缺省时取 config
+        self.llm_guard = LLMCallGuard(config, llm_settings)
+        self.llm = self.llm_guard.chat_model(config)
         
         self._create_retriever(
             kb_path=self.kb_path,
@@ -93,8 +118,7 @@ class LocalKBAgent:
             chunk_overlap=self.chunk_overlap
         )
     
-    def _create_retriever(self, kb_path, embedding_model, reranker_model, k, top_n, chunk_size, chunk_overlap):
-        paper_list = _list_files_in_directory(kb_path)
+    def _load_documents(self, kb_path, paper_list, chunk_size, chunk_overlap) -> List[Document]:
         texts_list = []
         logger.info(f"开始加载和拆分文档，共计 {len(paper_list)} 个文件。")
         
@@ -105,16 +129,33 @@ class LocalKBAgent:
         
         if not texts_list:
             logger.warning("没有加载到任何文本片段。")
+        return texts_list
+    
+    def _create_retriever(self, kb_path, embedding_model, reranker_model, k, top_n, chunk_size, chunk_overlap):
+        paper_list = _list_files_in_directory(kb_path)
         
         logger.info('正在构建混合检索器...')
+        # 保留已加载的编码器，供语义去重等其他环节复用
+        self.embeddings = None
         try:
             embeddingsModel = HuggingFaceEmbeddings(model_name=embedding_model,
                                                     model_kwargs={"device": self.device},
                                                     encode_kwargs={"normalize_embeddings": True})
-            retriever = FAISS.from_documents(texts_list, embeddingsModel).as_retriever(search_type='similarity', search_kwargs={"k": k})
+            self.embeddings = embeddingsModel
+            load_documents = lambda: self._load_documents(kb_path, paper_list, chunk_size, chunk_overlap)
+            if self.kb_store is not None:
+                # 磁盘索引有效时不再加载和拆分文档
+                fingerprint = kb_fingerprint(kb_path, paper_list, {
+                    'embedding_model': embedding_model, 'chunk_size': chunk_size, 'chunk_overlap': chunk_overlap,
+                    'start_index': True, 'index': self.index_factory.build_settings(),
+                })
+                vectorstore = self.kb_store.open_or_build(fingerprint, embeddingsModel, self.index_factory, load_documents)
+            else:
+                vectorstore = self.index_factory.build_vectorstore(load_documents(), embeddingsModel)
+            retriever = vectorstore.as_retriever(search_type='similarity', search_kwargs={"k": k})
             
             crossEncoderModel = HuggingFaceCrossEncoder(model_name=reranker_model, model_kwargs={"device": self.device})
-            compressor = CrossEncoderReranker(model=crossEncoderModel, top_n=top_n)
+            compressor = ScoredCrossEncoderReranker(model=crossEncoderModel, top_n=top_n)
             
             self.retriever = ContextualCompressionRetriever(base_compressor=compressor, base_retriever=retriever)
             logger.info('混合检索器构建完毕')
@@ -129,7 +170,7 @@ class LocalKBAgent:
                 template=PROMPTS['hypothetical_doc']
             )
             
-            hypothetical_chain = hypothetical_template | self.llm | StrOutputParser()
+            hypothetical_chain = hypothetical_template | model_router.chat_runnable('hypothetical_doc', self.llm, self.llm_guard) | StrOutputParser()
             
             hypothetical_doc = hypothetical_chain.invoke(
                 {
@@ -143,7 +184,11 @@ class LocalKBAgent:
             logger.error(f"生成假设性文档失败 (标题: {title}): {e}")
             return ""
     
-    def _search_docs(self, query: str) -> List[dict]:        
+    def _search_docs(self, query: str, raise_errors: bool = False) -> List[dict]:
+        """检索知识库文档
+        
+        raise_errors 为 True 时检索异常向上抛出（由调用方重试/熔断），否则记录日志并返回空列表
+        """
         try:
             # 直接使用查询文本进行检索，不再依赖hypothetical_doc
             kb_docs = self.retriever.invoke(query)
@@ -164,11 +209,14 @@ class LocalKBAgent:
                     'title': metadata.get('title', ''),
                     'page': metadata.get('page', 0),
                     'author': metadata.get('author', ''),
+                    'score': metadata.get('relevance_score', 0),
                 })
                 
             return structured_results
         except Exception as e:
             logger.error(f"检索文档失败: {e}")
+            if raise_errors:
+                raise
             return []
         
     def _refine_doc(self, doc: str, title: str, summary: str) -> str:
@@ -178,7 +226,7 @@ class LocalKBAgent:
                 template=PROMPTS['refine_doc']
             )
             
-            refine_chain = refine_template | self.llm | StrOutputParser()
+            refine_chain = refine_template | model_router.chat_runnable('refine_doc', self.llm, self.llm_guard) | StrOutputParser()
             
             refine_result = refine_chain.invoke(
                 {
@@ -192,6 +240,28 @@ class LocalKBAgent:
             logger.error(f"精炼文档失败 (标题: {title}): {e}")
             return ""
     
+    def _refine_docs_batch(self, docs: List[str], title: str, summary: str) -> Optional[List[str]]:
+        """在一次LLM调用中精炼多篇文档，输出无法按编号完整解析时返回None"""
+        try:
+            refine_template = PromptTemplate(
+                input_variables=['title', 'summary', 'documents'],
+                template=PROMPTS['refine_docs_batch']
+            )
+            
+            refine_chain = refine_template | model_router.chat_runnable('refine_docs_batch', self.llm, self.llm_guard) | StrOutputParser()
+            
+            refine_result = refine_chain.invoke(
+                {
+                    'title': title,
+                    'summary': summary,
+                    'documents': format_batch_documents(docs)
+                }
+            )
+            return parse_batch_refine_output(refine_result, len(docs))
+        except Exception as e:
+            logger.error(f"批量精炼文档失败 (标题: {title}): {e}")
+            return None
+    
     def search_for_leaf_nodes(self, framework: ArticleOutline) -> ArticleOutline:
         leaf_nodes = framework.find_leaf_nodes()
         
@@ -0,0 +1,220 @@
+import os
+import time
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.runnables import Runnable, RunnableLambda
+from loguru import logger
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from agents.circuit_breaker import CircuitOpenError, RetryCounter, call_with_retry_budget, get_circuit_breaker
+from agents.client_registry import get_chat_model, get_openai_client
+from agents.hedging import caller_settings, get_hedged_caller
+from agents.instrumentation import UsageCallbackHandler, gauges, is_rate_limited, record_chat_completion
+from agents.tracing import TraceCallbackHandler
+
+# 视为端点过载、应切换到备用模型的异常
+OVERLOAD_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError, CircuitOpenError, TimeoutError)
+# 同一端点上可重试的异常（熔断器拒绝时直接切换到备用模型）
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError, TimeoutError)
+# 端点重试的退避参数，与 OpenAI SDK 的默认值一致
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 8.0
+
+
+class ModelEndpoint:
+    """路由表中的一个模型端点，带独立的并发上限和速率限制
+
+    SDK 自身的重试被关闭，过载时最多重试 max_retries 次（消耗全局重试预算）后再切换到备用模型。
+    """
+
+    def __init__(self, name: str, config: Dict[str, Any]):
+        self.name = name
+        self.model = config['model']
+        self.api_key = config.get('api_key')
+        self.base_url = config.get('base_url')
+        self.fallbacks: List[str] = list(config.get('fallbacks') or [])
+        self.max_concurrency = max(1, int(config.get('max_concurrency', 16)))
+        self.max_retries = max(0, int(config.get('max_retries', 2)))
+        requests_per_minute = config.get('requests_per_minute', 0) or 0
+        self._min_interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._semaphore = BoundedSemaphore(self.max_concurrency)
+        self._rate_lock = Lock()
+        self._next_request_time = 0.0
+        self.breaker = get_circuit_breaker(f"llm:{self.base_url or ''}:{self.model}")
+        self._client = None
+        self._chat_model = None
+
+    @property
+    def client(self):
+        """使用共享连接池的 OpenAI 客户端"""
+        if self._client is None:
+            self._client = get_openai_client(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self._client
+
+    @property
+    def chat_model(self):
+        """使用共享连接池的 ChatOpenAI"""
+        if self._chat_model is None:
+            self._chat_model = get_chat_model({'api_key': self.api_key, 'base_url': self.base_url, 'model': self.model}, max_retries=0)
+        return self._chat_model
+
+    @contextmanager
+    def slot(self):
+        """占用一个并发槽位并遵守速率限制"""
+        with self._semaphore:
+            if self._min_interval:
+                with self._rate_lock:
+                    now = time.monotonic()
+                    wait = self._next_request_time - now
+                    self._next_request_time = max(now, self._next_request_time) + self._min_interval
+                if wait > 0:
+                    time.sleep(wait)
+            yield
+
+
+class LLMCallGuard:
+    """未路由的 LangChain 模型调用的保护，与 UnifiedRetrievalAgent._complete 的直连路径一致
+
+    调用在共享的 'llm' 调用器中执行（截止时间、对冲和延迟统计），经过端点的熔断器，
+    过载时按带抖动的指数退避重试并消耗全局重试预算。endpoint_config 提供 api_key / base_url / model，
+    settings 提供 call_deadlines / hedging / circuit_breaker / max_retries / retry_delay / max_retry_delay，缺省时取 endpoint_config。
+    """
+
+    def __init__(self, endpoint_config: Dict[str, Any], settings: Optional[Dict[str, Any]] = None):
+        settings = settings or endpoint_config
+        base_url = endpoint_config.get('base_url') or os.environ.get('OPENAI_BASE_URL', '')
+        self.breaker = get_circuit_breaker(f"llm:{base_url}", **(settings.get('circuit_breaker') or {}))
+        llm_caller_settings = caller_settings(settings, 'llm')
+        self.caller = get_hedged_caller('llm', **llm_caller_settings)
+        self.timeout = llm_caller_settings['timeout']
+        self.max_retries = settings.get('max_retries', 3)
+        self.retry_delay = settings.get('retry_delay', 1)
+        self.max_retry_delay = settings.get('max_retry_delay', 10)
+
+    def chat_model(self, endpoint_config: Dict[str, Any]):
+        """创建关闭 SDK 重试、以 LLM 截止时间为HTTP超时的 ChatOpenAI"""
+        kwargs = {'timeout': self.timeout} if self.timeout else {}
+        return get_chat_model(endpoint_config, max_retries=0, **kwargs)
+
+    def call(self, fn: Callable[[], Any], counter: Optional[RetryCounter] = None) -> Any:
+        def attempt():
+            try:
+                return self.caller.call(fn)
+            except Exception as e:
+                if is_rate_limited(e):
+                    gauges.increment('rate_limited', 'llm')
+                raise
+
+        def on_retry(error, attempt_number):
+            logger.warning(f"调用LLM失败 ({attempt_number}/{self.max_retries})，重试: {error}")
+
+        return call_with_retry_budget(lambda: self.breaker.call(attempt), self.max_retries, self.retry_delay,
+                                      self.max_retry_delay, RETRYABLE_ERRORS, on_retry, counter)
+
+
+class ModelRouter:
+    """按 PROMPTS 键把调用路由到不同的模型端点
+
+    未出现在路由表中的提示词沿用各智能体配置中的模型；被路由的调用在端点过载（429、5xx、超时、熔断）时
+    依次尝试该端点配置的备用模型。
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.endpoints: Dict[str, ModelEndpoint] = {}
+        self.routes: Dict[str, str] = {}
+
+    def configure(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        endpoints = {name: ModelEndpoint(name, endpoint_config) for name, endpoint_config in (config.get('models') or {}).items()}
+        routes = dict(config.get('routes') or {})
+        for prompt_key, name in routes.items():
+            if name not in endpoints:
+                raise ValueError(f"提示词 '{prompt_key}' 路由到了未定义的模型 '{name}'")
+        for endpoint in endpoints.values():
+            for name in endpoint.fallbacks:
+                if name not in endpoints:
+                    raise ValueError(f"模型 '{endpoint.name}' 的备用模型 '{name}' 未定义")
+        with self._lock:
+            self.endpoints = endpoints
+            self.routes = routes
+
+    def endpoints_for(self, prompt_key: Optional[str]) -> List[ModelEndpoint]:
+        """返回提示词对应的端点及其备用端点（按尝试顺序），未路由时返回空列表"""
+        with self._lock:
+            name = self.routes.get(prompt_key) if prompt_key else None
+            if name is None:
+                return []
+            primary = self.endpoints[name]
+            return [primary] + [self.endpoints[fallback] for fallback in primary.fallbacks]
+
+    def call(self, endpoints: List[ModelEndpoint], fn: Callable[[ModelEndpoint], Any], counter: Optional[RetryCounter] = None) -> Any:
+        """依次在端点上执行 fn，端点过载且重试用尽时切换到下一个端点；同一端点的重试和切换到备用模型都计入 counter"""
+        last_error = None
+        for index, endpoint in enumerate(endpoints):
+            if index and counter is not None:
+                counter.retries += 1
+
+            def attempt(endpoint=endpoint):
+                with endpoint.slot():
+                    return endpoint.breaker.call(lambda: fn(endpoint))
+
+            try:
+                return call_with_retry_budget(attempt, endpoint.max_retries + 1, RETRY_DELAY, MAX_RETRY_DELAY, RETRYABLE_ERRORS,
+                                              counter=counter)
+            except OVERLOAD_ERRORS as e:
+                last_error = e
+                logger.warning(f"模型 {endpoint.name}({endpoint.model}) 过载，尝试备用模型: {e}")
+        raise last_error
+
+    def chat_runnable(self, prompt_key: str, default_llm: Runnable, guard: Optional[LLMCallGuard] = None) -> Runnable:
+        """为 LangChain 链选择模型：未路由时返回 default_llm（传入 guard 时经其截止时间、熔断和重试保护），
+        否则返回带并发限制和备用模型的 Runnable；都会记录用量统计（重试时按一次调用记录，并计入重试次数）和追踪span"""
+        callbacks = [TraceCallbackHandler(prompt_key)]
+        if not self.endpoints_for(prompt_key):
+            if guard is None:
+                return default_llm.with_config(callbacks=[UsageCallbackHandler(prompt_key)] + callbacks)
+
+            def invoke_guarded(prompt_value, config):
+                return self._record_chat(prompt_key, lambda counter: guard.call(
+                    lambda: default_llm.invoke(prompt_value, config=config), counter))
+
+            return RunnableLambda(invoke_guarded, name=f"guarded:{prompt_key}").with_config(callbacks=callbacks)
+
+        def invoke_endpoint(endpoint, prompt_value, config):
+            try:
+                return endpoint.chat_model.invoke(prompt_value, config=config)
+            except Exception as e:
+                if is_rate_limited(e):
+                    gauges.increment('rate_limited', 'llm')
+                raise
+
+        def invoke(prompt_value, config):
+            return self._record_chat(prompt_key, lambda counter: self.call(
+                self.endpoints_for(prompt_key), lambda endpoint: invoke_endpoint(endpoint, prompt_value, config), counter))
+
+        return RunnableLambda(invoke, name=f"routed:{prompt_key}").with_config(callbacks=callbacks)
+
+    @staticmethod
+    def _record_chat(prompt_key: str, call: Callable[[RetryCounter], Any]) -> Any:
+        """执行一次带重试的聊天模型调用，按一次调用记录耗时、token用量和重试次数"""
+        counter = RetryCounter()
+        start_time = time.perf_counter()
+        try:
+            with gauges.in_flight('llm'):
+                message = call(counter)
+        except Exception:
+            record_chat_completion(prompt_key, time.perf_counter() - start_time, retries=counter.retries, error=True)
+            raise
+        record_chat_completion(prompt_key, time.perf_counter() - start_time, message, retries=counter.retries)
+        return message
+
+
+# 服务器内共享的路由表，在创建智能体之前通过 configure_model_routing 配置
+model_router = ModelRouter()
+
+
+def configure_model_routing(config: Optional[Dict[str, Any]] = None):
+    model_router.configure(config)
@@ -0,0 +1,100 @@
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from agents.text_similarity import jaccard, shingle_hashes
+
+
+class NoveltyScorer:
+    """基于启发式新颖度判断是否提前停止迭代检索，从而省去一次评估LLM调用
+
+    三个信号任意一个达到阈值即判定本轮已无足够新信息：
+    - new_doc_ratio: 本轮检索结果中去重后新文档的占比，低于 `min_new_doc_ratio` 时停止
+    - content_growth: 本轮精炼后内容长度相对上一轮的增长率，低于 `min_content_growth` 时停止
+    - content_similarity: 本轮内容与上一轮内容的分片相似度，高于 `max_content_similarity` 时停止
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.enabled = config.get('enabled', False)
+        self.min_new_doc_ratio = config.get('min_new_doc_ratio', 0.2)
+        self.min_content_growth = config.get('min_content_growth', 0.1)
+        self.max_content_similarity = config.get('max_content_similarity', 0.8)
+
+    def score(self, retrieved_count: int, new_count: int, previous_content: str, current_content: str) -> Dict[str, Any]:
+        """计算本轮迭代的新颖度信号
+
+        Args:
+            retrieved_count: 本轮检索到的文档总数
+            new_count: 去重后的新文档数
+            previous_content: 本轮精炼前的节点内容
+            current_content: 本轮精炼后的节点内容
+
+        Returns:
+            Dict[str, Any]: 各项信号、是否应停止以及停止原因
+        """
+        new_doc_ratio = new_count / retrieved_count if retrieved_count else 0.0
+        if previous_content:
+            content_growth = (len(current_content) - len(previous_content)) / len(previous_content)
+            content_similarity = jaccard(shingle_hashes(previous_content), shingle_hashes(current_content))
+        else:
+            # 首轮没有可比较的已有内容
+            content_growth = float('inf')
+            content_similarity = 0.0
+
+        reasons = []
+        if new_doc_ratio < self.min_new_doc_ratio:
+            reasons.append(f"new_doc_ratio={new_doc_ratio:.2f}<{self.min_new_doc_ratio}")
+        if content_growth < self.min_content_growth:
+            reasons.append(f"content_growth={content_growth:.2f}<{self.min_content_growth}")
+        if content_similarity > self.max_content_similarity:
+            reasons.append(f"content_similarity={content_similarity:.2f}>{self.max_content_similarity}")
+
+        return {
+            "new_doc_ratio": new_doc_ratio,
+            "content_growth": content_growth,
+            "content_similarity": content_similarity,
+            "should_stop": self.enabled and bool(reasons),
+            "reasons": reasons,
+        }
+
+
+class EarlyStopStats:
+    """统计一次检索流程中评估调用的执行/跳过次数以及节点耗时"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._evaluate_calls = 0
+        self._evaluate_seconds = 0.0
+        self._evaluate_skipped = 0
+        self._early_stopped_nodes = set()
+        self._node_seconds: Dict[str, float] = {}
+
+    def record_evaluate(self, seconds: float):
+        with self._lock:
+            self._evaluate_calls += 1
+            self._evaluate_seconds += seconds
+
+    def record_skip(self, node_id: str):
+        with self._lock:
+            self._evaluate_skipped += 1
+            self._early_stopped_nodes.add(node_id)
+
+    def record_node(self, node_id: str, seconds: float):
+        with self._lock:
+            self._node_seconds[node_id] = seconds
+
+    def stats(self) -> Dict[str, Any]:
+        """返回统计报告，其中 estimated_seconds_saved 按评估调用的平均耗时估算"""
+        with self._lock:
+            avg_evaluate = self._evaluate_seconds / self._evaluate_calls if self._evaluate_calls else 0.0
+            stopped = [t for node_id, t in self._node_seconds.items() if node_id in self._early_stopped_nodes]
+            others = [t for node_id, t in self._node_seconds.items() if node_id not in self._early_stopped_nodes]
+            return {
+                "evaluate_calls": self._evaluate_calls,
+                "evaluate_calls_skipped": self._evaluate_skipped,
+                "avg_evaluate_seconds": round(avg_evaluate, 3),
+                "estimated_seconds_saved": round(avg_evaluate * self._evaluate_skipped, 3),
+                "early_stopped_nodes": len(stopped),
+                "avg_node_seconds_early_stopped": round(sum(stopped) / len(stopped), 3) if stopped else None,
+                "avg_node_seconds_other": round(sum(others) / len(others), 3) if others else None,
+            }
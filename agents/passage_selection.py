@@ -0,0 +1,183 @@
+import re
+from typing import List, Optional
+
+import numpy as np
+
+from agents.text_similarity import detect_language, shingle_hashes, term_hashes
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 中文句末标点之后、英文句号后的空白处以及换行作为句子边界（避免在小数点处切分）
+_SENTENCE_BOUNDARY_RE = re.compile(r'(?<=[。！？；])|(?<=[.!?;])\s+|\n+')
+
+
+def split_sentences(text: str) -> List[str]:
+    """按中英文句末标点和换行切分句子"""
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY_RE.split(text or "") if sentence and sentence.strip()]
+
+
+def extractive_trim(text: str, query: str, max_chars: int) -> str:
+    """廉价的抽取式裁剪：保留与查询分片重合度最高的句子，按原文顺序拼接到 max_chars 以内
+
+    Args:
+        text: 原文
+        query: 检索查询
+        max_chars: 保留的最大字符数
+
+    Returns:
+        str: 裁剪后的文本
+    """
+    if len(text) <= max_chars:
+        return text
+    sentences = split_sentences(text)
+    if not sentences:
+        return text[:max_chars]
+
+    query_shingles = shingle_hashes(query, ngram_size=2)
+    scores = []
+    for i, sentence in enumerate(sentences):
+        overlap = np.intersect1d(shingle_hashes(sentence, ngram_size=2), query_shingles, assume_unique=True).size
+        scores.append((overlap, -i))
+
+    selected = set()
+    total = 0
+    for overlap, neg_index in sorted(scores, reverse=True):
+        # 与查询无重合的句子只在没有任何命中时才保留
+        if overlap == 0 and selected:
+            break
+        index = -neg_index
+        length = len(sentences[index])
+        if total + length > max_chars:
+            continue
+        selected.add(index)
+        total += length
+
+    if not selected:
+        return sentences[0][:max_chars]
+    separator = "" if detect_language(text) == 'cjk' else " "
+    return separator.join(sentences[i] for i in sorted(selected))
+
+
+def split_passages(text: str, passage_chars: int) -> List[str]:
+    """将文本按句子边界切分为长度约为 passage_chars 的段落，超长句子按长度硬切"""
+    sentences = split_sentences(text)
+    separator = "" if detect_language(text) == 'cjk' else " "
+    passages = []
+    current: List[str] = []
+    current_length = 0
+    for sentence in sentences:
+        for start in range(0, len(sentence), passage_chars):
+            piece = sentence[start:start + passage_chars]
+            if current and current_length + len(separator) + len(piece) > passage_chars:
+                passages.append(separator.join(current))
+                current, current_length = [], 0
+            current_length += len(piece) + (len(separator) if current else 0)
+            current.append(piece)
+    if current:
+        passages.append(separator.join(current))
+    return passages
+
+
+class BM25Index:
+    """预先计算词项哈希的BM25索引，查询时一次向量化地为所有文档打分"""
+
+    def __init__(self, texts: List[str], ngram_size: int = 1):
+        self.ngram_size = ngram_size
+        parts = [term_hashes(text, ngram_size) for text in texts]
+        self._size = len(parts)
+        self._lengths = np.array([part.size for part in parts], dtype=np.float64)
+        self._terms = np.concatenate(parts) if parts else np.empty(0, dtype=np.uint64)
+        self._labels = np.repeat(np.arange(len(parts)), self._lengths.astype(np.int64))
+        avg_length = self._lengths.mean() if parts else 0.0
+        self._norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths / (avg_length or 1.0))
+
+    def __len__(self):
+        return self._size
+
+    def scores(self, query: str) -> np.ndarray:
+        """计算查询与每个文档的BM25分数"""
+        query_terms = np.unique(term_hashes(query, self.ngram_size))
+        if self._size == 0 or query_terms.size == 0:
+            return np.zeros(self._size)
+
+        # 只统计查询词项在各文档中的词频
+        mask = np.isin(self._terms, query_terms)
+        tf = np.zeros((self._size, query_terms.size))
+        np.add.at(tf, (self._labels[mask], np.searchsorted(query_terms, self._terms[mask])), 1)
+
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log(1 + (self._size - df + 0.5) / (df + 0.5))
+        return (idf * tf * (BM25_K1 + 1) / (tf + self._norm[:, None])).sum(axis=1)
+
+
+def bm25_scores(query: str, passages: List[str], ngram_size: int = 1) -> np.ndarray:
+    """以段落集合为语料，向量化地计算查询与每个段落的BM25分数
+
+    Args:
+        query: 查询文本
+        passages: 段落列表
+        ngram_size: 词项的n-gram长度（CJK文本建议用2，即字符二元组）
+
+    Returns:
+        np.ndarray: 每个段落的BM25分数
+    """
+    return BM25Index(passages, ngram_size).scores(query)
+
+
+def embedding_scores(query: str, passages: List[str], embeddings) -> np.ndarray:
+    """用编码器计算查询与每个段落的余弦相似度"""
+    query_vector = np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    passage_vectors = np.asarray(embeddings.embed_documents(passages), dtype=np.float32)
+    query_vector /= np.linalg.norm(query_vector) or 1.0
+    passage_vectors /= np.maximum(np.linalg.norm(passage_vectors, axis=1, keepdims=True), 1e-12)
+    return passage_vectors @ query_vector
+
+
+def select_passages(text: str, query: str, max_chars: int, passage_chars: int = 400, embeddings=None) -> str:
+    """抽取式段落选择：切分段落并与查询打分，保留得分最高的段落（按原文顺序）直到 max_chars
+
+    Args:
+        text: 原文
+        query: 检索查询
+        max_chars: 保留的最大字符数
+        passage_chars: 段落长度
+        embeddings: 可选的LangChain编码器，提供时按语义相似度打分，否则使用BM25
+
+    Returns:
+        str: 选出的段落，以空行分隔
+    """
+    if not text or len(text) <= max_chars:
+        return text or ""
+    passages = split_passages(text, min(passage_chars, max_chars))
+    if len(passages) <= 1:
+        return text[:max_chars]
+
+    scores: Optional[np.ndarray] = None
+    if embeddings is not None:
+        try:
+            scores = embedding_scores(query, passages, embeddings)
+        except Exception:
+            scores = None
+    if scores is None:
+        ngram_size = 2 if detect_language(text) == 'cjk' else 1
+        scores = bm25_scores(query, passages, ngram_size)
+
+    separator = "\n\n"
+    selected = []
+    total = 0
+    # 分数相同时优先靠前的段落
+    for index in np.argsort(-scores, kind='stable'):
+        # 与查询无关的段落只在没有任何命中时才保留
+        if scores[index] <= 0 and selected:
+            break
+        # 除第一个段落外，每个段落还要占用一个分隔符
+        length = len(passages[index]) + (len(separator) if selected else 0)
+        if total + length > max_chars:
+            continue
+        selected.append(index)
+        total += length
+    if not selected:
+        return passages[int(np.argmax(scores))][:max_chars]
+    return separator.join(passages[i] for i in sorted(selected))
@@ -0,0 +1,115 @@
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from loguru import logger
+
+
+class ProfilerBusyError(RuntimeError):
+    """已有采样正在进行"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def _thread_label(name: str) -> str:
+    # 同一线程池的工作线程合并为一个根节点，如 ThreadPoolExecutor-3_7 -> ThreadPoolExecutor-3
+    return re.sub(r'_\d+$', '', name)
+
+
+class SamplingProfiler:
+    """基于 sys._current_frames 的采样分析器：后台线程每隔 interval 秒抓取所有线程的调用栈
+
+    输出 collapsed-stack 格式（每行 "线程;外层帧;...;内层帧 次数"），可用 flamegraph.pl、speedscope
+    或 inferno 生成火焰图。采样不区分线程是在运行还是在等待（网络、锁），因此也能看出等待时间花在哪里。
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._running = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                raise ProfilerBusyError("采样分析正在进行中")
+            self._running = True
+        self._stacks = Counter()
+        self.samples = 0
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._sample_loop, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """停止采样并返回 collapsed-stack 文本"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.stopped_at = time.time()
+        with self._lock:
+            self._running = False
+        logger.info(f"采样分析结束: {self.samples} 次采样, {len(self._stacks)} 个不同调用栈, 耗时 {self.stopped_at - self.started_at:.1f}s")
+        return self.collapsed()
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names: Dict[int, str] = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(_thread_label(names.get(thread_id, str(thread_id))))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    @contextmanager
+    def profile(self):
+        """在代码块执行期间采样，结束后通过 self.collapsed() 获取结果"""
+        self.start()
+        try:
+            yield self
+        finally:
+            self.stop()
+
+
+# 服务器内共享的分析器，同一时刻只允许一次采样
+_server_profiler = SamplingProfiler()
+_server_profiler_lock = threading.Lock()
+
+
+def profile_for(seconds: float, interval: float = 0.01) -> str:
+    """对当前进程的所有线程采样 seconds 秒，返回 collapsed-stack 文本；已有采样进行中时抛出 ProfilerBusyError"""
+    if not _server_profiler_lock.acquire(blocking=False):
+        raise ProfilerBusyError("采样分析正在进行中")
+    try:
+        _server_profiler.interval = interval
+        _server_profiler.start()
+        time.sleep(seconds)
+        return _server_profiler.stop()
+    finally:
+        _server_profiler_lock.release()
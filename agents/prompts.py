@@ -710,3 +710,78 @@ PROMPTS['refine_content_with_new_results'] = """你是一位专业的科学文
 最终输出应是一个完整、连贯、内容丰富且明显扩展的章节文本，包含适当的引用标记。篇幅应当有显著增长，内容深度和广度都要有明显提升。
 
 请只输出优化后的完整内容，不要包含解释或其他附加信息。请确保所有重要的新信息都已整合，并且文本读起来流畅自然。"""
+
+PROMPTS['refine_and_evaluate'] = """你是一位专业的科学写作与文献检索专家。请根据新检索到的信息优化和扩展已有的章节内容，并在同一次回复中判断是否需要进一步检索。
+
+章节标题: {title}
+章节概述: {summary}
+
+当前内容:
+---
+{current_content}
+---
+
+新检索到的信息:
+{new_results}
+
+已使用的检索查询:
+{previous_queries}
+
+## 任务一：优化章节内容
+
+1. 系统性分析新信息，提取所有有价值的内容（新的研究发现和数据、支持或反驳现有观点的证据、技术细节、应用案例、发展趋势）
+2. 全面深入地扩展现有内容，增加专业深度，补充具体数据和权威研究结果
+3. 确保新增内容与原有内容有机融合，保持连贯和逻辑流畅，不要生硬拼接
+4. 如有必要，修正或更新已有内容中的不准确信息
+5. **必须添加引用标记**：引用格式为[source_id]，其中source_id是检索结果中每个文档的引用标识符(citation_key)，在使用检索信息的句子结尾处添加，例如："研究表明，AI在医疗诊断中准确率可达95%[web_a1b2c3]。"；综合多个来源时列出所有相关引用，例如：[kb_d4e5f6, web_g7h8i9]
+
+## 任务二：评估是否需要继续检索
+
+基于优化后的内容判断：
+- 章节是否涵盖了标题和概述中的所有要点？
+- 内容是否有足够的深度和广度？
+- 是否有重要概念需要更多的证据或例子支持？
+- 是否有相关的最新研究或争议需要补充？
+
+如果内容已充分覆盖章节主题，将retrieval_complete设为true，new_queries为空列表；否则将retrieval_complete设为false，并在new_queries中给出针对现有内容不足之处的新检索查询（不要与已使用的检索查询重复）。
+
+## 输出格式
+
+只输出如下JSON对象，不要添加任何解释或markdown标记：
+{{
+  "content": "优化后的完整章节内容",
+  "retrieval_complete": false,
+  "new_queries": ["新查询1", "新查询2"]
+}}"""
+
+PROMPTS['refine_docs_batch'] = """
+---
+### **任务描述**
+
+您需要根据提供的"标题"和"概述"，分别从下面每一篇"相关文档"中提取出该段落写作所需的全部关键信息。要求如下：
+1. **保留必要信息**：确保内容完整，不遗漏任何关键点。
+2. **删除冗余信息**：剔除重复、无关或不必要的内容。
+3. **逻辑清晰**：组织内容结构合理，便于后续写作。
+4. **简洁表达**：使用简明扼要的语言进行表述。
+5. **逐篇独立处理**：每篇文档单独精炼，不要合并或交叉引用不同文档的内容。
+
+相关文档以 <document id="编号"> 和 </document> 包裹。请对每篇文档输出一段以 <refined id="编号"> 开头、以 </refined> 结尾的精炼结果，编号与输入文档一一对应，且每篇文档都必须有输出（若文档与主题无关，输出空的 <refined id="编号"></refined>）。除这些结果块外不要输出任何额外内容和解释。
+
+---
+### **输出格式示例**
+
+<refined id="1">第一篇文档的精炼内容</refined>
+<refined id="2">第二篇文档的精炼内容</refined>
+
+---
+### **你的任务**
+
+**标题**: {title}
+
+**概述**: {summary}
+
+**相关文档**:
+{documents}
+
+**输出**: 
+"""
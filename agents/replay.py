@@ -0,0 +1,355 @@
+import copy
+import hashlib
+import json
+import os
+import random
+import time
+from collections import defaultdict
+from string import Formatter
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+MODES = ('off', 'record', 'replay')
+
+
+def _canonical(data: Any) -> str:
+    return json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+
+def _http_key(request: httpx.Request, body: bytes) -> str:
+    try:
+        body_text = _canonical(json.loads(body)) if body else ""
+    except ValueError:
+        body_text = body.decode('utf-8', errors='replace')
+    return _hash(request.method, request.url.path, body_text)
+
+
+def _search_key(provider: str, kwargs: Dict[str, Any]) -> str:
+    # 超时只影响传输，不影响结果，不计入请求键
+    return _hash(provider, _canonical({key: value for key, value in kwargs.items() if key != 'timeout'}))
+
+
+class LatencyModel:
+    """回放时注入的延迟
+
+    distribution:
+        recorded: 录制时的实际耗时乘以 scale（默认）
+        fixed: 固定 seconds 秒
+        uniform: [low, high] 内均匀分布
+        lognormal: 对数正态分布，median 为中位数，sigma 为对数标准差（长尾）
+    """
+
+    def __init__(self, spec: Optional[Dict[str, Any]] = None, seed: Optional[int] = None):
+        spec = spec or {}
+        self.distribution = spec.get('distribution', 'recorded')
+        self.scale = float(spec.get('scale', 1.0))
+        self.seconds = float(spec.get('seconds', 0.0))
+        self.low = float(spec.get('low', 0.0))
+        self.high = float(spec.get('high', 0.0))
+        self.median = float(spec.get('median', 1.0))
+        self.sigma = float(spec.get('sigma', 0.5))
+        self._random = random.Random(seed)
+        self._lock = Lock()
+
+    def sample(self, recorded: float = 0.0) -> float:
+        with self._lock:
+            if self.distribution == 'fixed':
+                return self.seconds
+            if self.distribution == 'uniform':
+                return self._random.uniform(self.low, self.high)
+            if self.distribution == 'lognormal':
+                return self._random.lognormvariate(0.0, self.sigma) * self.median
+        return recorded * self.scale
+
+
+class TrafficLog:
+    """录制文件（JSON Lines）：每行一次LLM HTTP交互或搜索调用"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = Lock()
+        self._file = None
+
+    def append(self, entry: Dict[str, Any]):
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def load(self) -> List[Dict[str, Any]]:
+        with open(self.path, 'r', encoding='utf-8') as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ReplayStore:
+    """按请求键索引的录制数据
+
+    相同键的多条记录按录制顺序轮流返回；键未命中时（如并发导致提示词中文档顺序不同），
+    非 strict 模式退回到同一类别（HTTP路径+模型+提示词键 / 搜索提供方）下的记录轮流返回，并计入 misses。
+    无法识别提示词键的LLM请求没有类别，未命中时直接报错，不会拿其他提示词的响应顶替。
+    """
+
+    def __init__(self, entries: List[Dict[str, Any]], strict: bool = False):
+        self.strict = strict
+        self._lock = Lock()
+        self._by_key: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._by_group: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._cursors: Dict[str, int] = defaultdict(int)
+        self.hits = 0
+        self.misses = 0
+        for entry in entries:
+            self._by_key[entry['key']].append(entry)
+            # HTTP 记录的类别按请求重新计算，旧录制文件的类别（只有路径和模型）不再使用
+            if entry.get('kind') == 'http':
+                group = _http_group(entry['request']['path'], entry['request']['body'].encode('utf-8'))
+            else:
+                group = entry['group']
+            if group is not None:
+                self._by_group[group].append(entry)
+
+    def _next(self, index: str, entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+        position = self._cursors[index]
+        self._cursors[index] = position + 1
+        return entries[position % len(entries)]
+
+    def lookup(self, key: str, group: Optional[str]) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._by_key.get(key)
+            if entries:
+                self.hits += 1
+                return self._next(key, entries)
+            self.misses += 1
+            fallback = self._by_group.get(group) if group is not None else None
+            if self.strict or not fallback:
+                raise LookupError(f"录制数据中没有匹配的请求 (group={group})")
+            return self._next(f"group:{group}", fallback)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": sum(len(entries) for entries in self._by_key.values()), "hits": self.hits, "misses": self.misses}
+
+
+_prompt_segments: Optional[List[Tuple[str, List[str]]]] = None
+
+
+def _prompt_key(text: str) -> Optional[str]:
+    """按 PROMPTS 模板的固定文本识别提示词键：模板的所有固定片段按顺序出现在提示中即视为匹配，取固定文本最多的模板"""
+    global _prompt_segments
+    if _prompt_segments is None:
+        from agents.prompts import PROMPTS
+        _prompt_segments = [
+            (key, [literal.strip() for literal, _, _, _ in Formatter().parse(template) if literal.strip()])
+            for key, template in PROMPTS.items()
+        ]
+    best_key, best_length = None, 0
+    for key, segments in _prompt_segments:
+        position = 0
+        for segment in segments:
+            position = text.find(segment, position)
+            if position < 0:
+                break
+            position += len(segment)
+        else:
+            length = sum(len(segment) for segment in segments)
+            if length > best_length:
+                best_key, best_length = key, length
+    return best_key
+
+
+def _http_group(path: str, body: bytes) -> Optional[str]:
+    """LLM请求的回退类别：路径、模型和提示词键，无法识别提示词键时返回None（不回退）"""
+    try:
+        payload = json.loads(body) if body else {}
+        model = payload.get('model', '')
+        text = "\n".join(str(message.get('content', '')) for message in payload.get('messages') or [])
+    except (ValueError, AttributeError):
+        return None
+    prompt_key = _prompt_key(text)
+    if prompt_key is None:
+        return None
+    return f"http:{path}:{model}:{prompt_key}"
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """包装真实传输层，记录每次请求和响应"""
+
+    def __init__(self, transport: httpx.BaseTransport, log: TrafficLog):
+        self._transport = transport
+        self._log = log
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        start = time.perf_counter()
+        response = self._transport.handle_request(request)
+        content = response.read()
+        latency = time.perf_counter() - start
+        self._log.append({
+            "kind": "http",
+            "key": _http_key(request, body),
+            "group": _http_group(request.url.path, body),
+            "request": {"method": request.method, "path": request.url.path, "body": body.decode('utf-8', errors='replace')},
+            "response": {
+                "status": response.status_code,
+                "content_type": response.headers.get('content-type', 'application/json'),
+                "body": content.decode('utf-8', errors='replace'),
+            },
+            "latency": round(latency, 4),
+        })
+        # 响应体已被读取并解码，去掉压缩相关的头后交给客户端
+        headers = [(name, value) for name, value in response.headers.items() if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')]
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request, extensions=response.extensions)
+
+    def close(self):
+        self._transport.close()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """不访问网络，按录制数据返回响应，OpenAI 和 ChatOpenAI 都经由它得到假响应"""
+
+    def __init__(self, store: ReplayStore, latency: LatencyModel):
+        self._store = store
+        self._latency = latency
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        entry = self._store.lookup(_http_key(request, body), _http_group(request.url.path, body))
+        delay = self._latency.sample(entry.get('latency', 0.0))
+        if delay > 0:
+            time.sleep(delay)
+        response = entry['response']
+        return httpx.Response(response['status'], headers={'content-type': response['content_type']},
+                              content=response['body'].encode('utf-8'), request=request)
+
+
+class RecordingSearchClient:
+    """包装真实搜索客户端（如 TavilyClient），记录每次 search 调用"""
+
+    def __init__(self, provider: str, client: Any, log: TrafficLog):
+        self._provider = provider
+        self._client = client
+        self._log = log
+
+    def search(self, **kwargs) -> Dict[str, Any]:
+        start = time.perf_counter()
+        result = self._client.search(**kwargs)
+        self._log.append({
+            "kind": "search",
+            "key": _search_key(self._provider, kwargs),
+            "group": f"search:{self._provider}",
+            "request": kwargs,
+            "response": result,
+            "latency": round(time.perf_counter() - start, 4),
+        })
+        return result
+
+
+class ReplaySearchClient:
+    """TavilyClient 的进程内替身，按录制数据返回搜索结果"""
+
+    def __init__(self, provider: str, store: ReplayStore, latency: LatencyModel):
+        self._provider = provider
+        self._store = store
+        self._latency = latency
+
+    def search(self, **kwargs) -> Dict[str, Any]:
+        entry = self._store.lookup(_search_key(self._provider, kwargs), f"search:{self._provider}")
+        delay = self._latency.sample(entry.get('latency', 0.0))
+        if delay > 0:
+            time.sleep(delay)
+        return copy.deepcopy(entry['response'])
+
+
+class TrafficReplay:
+    """LLM 与搜索流量的录制 / 回放开关
+
+    mode=record 时真实调用照常进行，同时把请求和响应追加到 path；mode=replay 时不访问网络，
+    LLM 请求由 httpx 传输层、搜索请求由 TavilyClient 替身按录制数据返回，并按 latency 设置注入延迟，
+    使端到端吞吐实验可以离线、可重复地运行。
+    """
+
+    def __init__(self):
+        self.mode = 'off'
+        self._log: Optional[TrafficLog] = None
+        self._store: Optional[ReplayStore] = None
+        self._llm_latency = LatencyModel()
+        self._search_latency = LatencyModel()
+        self._simulated_transport: Optional[httpx.BaseTransport] = None
+        self._simulated_search: Optional[Callable[[str], Any]] = None
+
+    def configure(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        mode = config.get('mode', 'off')
+        if mode not in MODES:
+            raise ValueError(f"replay.mode 必须是 {MODES} 之一")
+        if self._log is not None:
+            self._log.close()
+        self.mode = mode
+        self._log = TrafficLog(config.get('path', 'recordings/traffic.jsonl')) if mode != 'off' else None
+        self._store = None
+        self._simulated_transport = self._simulated_search = None
+        latency = config.get('latency') or {}
+        seed = config.get('seed', 0)
+        self._llm_latency = LatencyModel(latency.get('llm'), seed)
+        self._search_latency = LatencyModel(latency.get('search'), None if seed is None else seed + 1)
+        if mode == 'replay':
+            self._store = ReplayStore(self._log.load(), strict=bool(config.get('strict', False)))
+            logger.info(f"回放模式: 从 {self._log.path} 载入 {self._store.stats()['entries']} 条录制记录")
+        elif mode == 'record':
+            logger.info(f"录制模式: LLM 与搜索流量写入 {self._log.path}")
+
+    def simulate(self, transport: httpx.BaseTransport, search_client: Callable[[str], Any]):
+        """使用合成后端代替真实服务（基准测试用）：LLM 请求交给 transport，搜索提供方使用 search_client(provider) 返回的客户端"""
+        self.configure()
+        self.mode = 'simulate'
+        self._simulated_transport = transport
+        self._simulated_search = search_client
+
+    def wrap_transport(self, transport: httpx.BaseTransport) -> httpx.BaseTransport:
+        """为共享HTTP连接池选择传输层"""
+        if self.mode == 'simulate':
+            return self._simulated_transport
+        if self.mode == 'record':
+            return RecordingTransport(transport, self._log)
+        if self.mode == 'replay':
+            return ReplayTransport(self._store, self._llm_latency)
+        return transport
+
+    def search_client(self, provider: str, factory: Callable[[], Any]) -> Any:
+        """为搜索提供方选择客户端；回放和模拟模式下不创建真实客户端（无需API密钥）"""
+        if self.mode == 'simulate':
+            return self._simulated_search(provider)
+        if self.mode == 'record':
+            return RecordingSearchClient(provider, factory(), self._log)
+        if self.mode == 'replay':
+            return ReplaySearchClient(provider, self._store, self._search_latency)
+        return factory()
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"mode": self.mode}
+        if self._store is not None:
+            stats.update(self._store.stats())
+        return stats
+
+
+# 进程内共享的录制 / 回放设置，须在创建智能体之前通过 configure_replay 配置
+traffic_replay = TrafficReplay()
+
+
+def configure_replay(config: Optional[Dict[str, Any]] = None):
+    traffic_replay.configure(config)
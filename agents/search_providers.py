@@ -0,0 +1,306 @@
+import asyncio
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from threading import BoundedSemaphore, Lock
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from tavily import TavilyClient
+
+from agents.instrumentation import gauges
+from agents.passage_selection import BM25Index, select_passages
+from agents.replay import traffic_replay
+
+# 本地语料支持的文件类型
+LOCAL_CORPUS_EXTENSIONS = ('.html', '.htm', '.md', '.markdown', '.txt')
+_MARKDOWN_TITLE_RE = re.compile(r'^\s*#\s+(.+)$', re.MULTILINE)
+_BLANK_LINES_RE = re.compile(r'\n\s*\n+')
+
+
+class SearchProvider:
+    """搜索提供方基类
+
+    子类实现 `_search`，返回与 Tavily 相同结构的字典：`{'results': [{'url', 'title', 'content', 'score', 'raw_content'}]}`。
+    基类负责每个提供方的并发上限（max_concurrency）和请求速率（requests_per_second，0 表示不限速），
+    并通过 `asearch` 提供异步接口。
+    """
+
+    name = "base"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.max_concurrency = max(1, int(config.get('max_concurrency', 5)))
+        requests_per_second = config.get('requests_per_second', 0) or 0
+        self._min_interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._semaphore = BoundedSemaphore(self.max_concurrency)
+        self._rate_lock = Lock()
+        self._next_request_time = 0.0
+
+    def _wait_for_rate_limit(self):
+        if not self._min_interval:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + self._min_interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def _search(self, query: str, max_results: int, include_raw_content: bool, **kwargs) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def search(self, query: str, max_results: int = 5, include_raw_content: bool = False, **kwargs) -> Dict[str, Any]:
+        """执行一次搜索，受并发上限和速率限制约束"""
+        with self._semaphore:
+            self._wait_for_rate_limit()
+            return self._search(query, max_results, include_raw_content, **kwargs)
+
+    async def asearch(self, query: str, max_results: int = 5, include_raw_content: bool = False, **kwargs) -> Dict[str, Any]:
+        """异步搜索：在线程中执行同步调用，不阻塞事件循环"""
+        return await asyncio.to_thread(self.search, query, max_results, include_raw_content, **kwargs)
+
+
+class TavilySearchProvider(SearchProvider):
+    """Tavily 搜索
+
+    timeout 为单次请求的HTTP超时（秒），未配置时使用 Tavily 客户端的默认值。
+    """
+
+    name = "tavily"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        super().__init__(config)
+        config = config or {}
+        self.timeout = config.get('timeout')
+        self.client = traffic_replay.search_client(
+            self.name, lambda: TavilyClient(api_key=config.get('api_key') or os.environ['TAVILY_API_KEY']))
+
+    def _search(self, query: str, max_results: int, include_raw_content: bool, **kwargs) -> Dict[str, Any]:
+        if self.timeout:
+            kwargs.setdefault('timeout', self.timeout)
+        return self.client.search(
+            query=query,
+            max_results=max_results,
+            include_raw_content=include_raw_content,
+            **kwargs
+        )
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """提取HTML的标题和可见文本，忽略脚本和样式"""
+
+    _SKIP_TAGS = {'script', 'style', 'noscript', 'template'}
+    _BLOCK_TAGS = {'p', 'div', 'br', 'li', 'tr', 'section', 'article', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+
+    def __init__(self):
+        super().__init__()
+        self.title = ""
+        self._parts: List[str] = []
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == 'title':
+            self._in_title = True
+        elif tag in self._BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        elif tag == 'title':
+            self._in_title = False
+        elif tag in self._BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+        elif not self._skip_depth:
+            self._parts.append(data)
+
+    def text(self) -> str:
+        return _BLANK_LINES_RE.sub("\n\n", "".join(self._parts)).strip()
+
+
+def _load_corpus_file(file_path: str) -> Optional[Dict[str, str]]:
+    try:
+        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+            raw = f.read()
+    except OSError as e:
+        logger.error(f"读取语料文件失败 ({file_path}): {e}")
+        return None
+
+    title = ""
+    if file_path.lower().endswith(('.html', '.htm')):
+        parser = _HTMLTextExtractor()
+        parser.feed(raw)
+        title, text = parser.title.strip(), parser.text()
+    else:
+        text = raw.strip()
+        match = _MARKDOWN_TITLE_RE.search(text)
+        if match:
+            title = match.group(1).strip()
+    if not text:
+        return None
+    return {
+        'url': f"file://{os.path.abspath(file_path)}",
+        'title': title or os.path.splitext(os.path.basename(file_path))[0],
+        'text': text,
+    }
+
+
+class LocalCorpusSearchProvider(SearchProvider):
+    """基于本地语料目录（HTML/Markdown/纯文本）的离线搜索，使用BM25检索
+
+    用于压测和无外网部署。分数按本次查询的最高分归一化到 0-1，与 Tavily 分数处于同一量级。
+    """
+
+    name = "local"
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        super().__init__(config)
+        config = config or {}
+        self.corpus_path = config['corpus_path']
+        # 结果摘要片段的长度，对应 Tavily 的 content 字段
+        self.snippet_chars = config.get('snippet_chars', 500)
+        self.documents = self._load_corpus(self.corpus_path)
+        texts = [doc['title'] + "\n" + doc['text'] for doc in self.documents]
+        # 语料可能中英混合，统一按单个CJK字符/单词作为词项
+        self.index = BM25Index(texts, ngram_size=1)
+        logger.info(f"本地搜索语料加载完成: {len(self.documents)} 个文档 ({self.corpus_path})")
+
+    @staticmethod
+    def _load_corpus(corpus_path: str) -> List[Dict[str, str]]:
+        documents = []
+        for root, _, files in os.walk(corpus_path):
+            for file_name in sorted(files):
+                if file_name.lower().endswith(LOCAL_CORPUS_EXTENSIONS):
+                    document = _load_corpus_file(os.path.join(root, file_name))
+                    if document:
+                        documents.append(document)
+        return documents
+
+    def _search(self, query: str, max_results: int, include_raw_content: bool, **kwargs) -> Dict[str, Any]:
+        scores = self.index.scores(query)
+        if scores.size == 0:
+            return {'query': query, 'results': []}
+        top_score = float(scores.max()) or 1.0
+        results = []
+        for index in scores.argsort(kind='stable')[::-1][:max_results]:
+            if scores[index] <= 0:
+                break
+            document = self.documents[index]
+            result = {
+                'url': document['url'],
+                'title': document['title'],
+                'content': select_passages(document['text'], query, self.snippet_chars),
+                'score': float(scores[index]) / top_score,
+            }
+            if include_raw_content:
+                result['raw_content'] = document['text']
+            results.append(result)
+        return {'query': query, 'results': results}
+
+
+SEARCH_PROVIDERS = {
+    TavilySearchProvider.name: TavilySearchProvider,
+    LocalCorpusSearchProvider.name: LocalCorpusSearchProvider,
+}
+
+
+class MultiProviderSearch:
+    """并行调用多个搜索提供方并合并结果
+
+    相同URL的结果只保留分数最高的一条，合并结果按分数降序排列；单个提供方失败只记录日志，不影响其他提供方。
+    所有提供方都失败时，raise_errors 为 True 则抛出最后一个异常（由调用方重试/熔断），否则返回空结果。
+    """
+
+    def __init__(self, providers: List[SearchProvider]):
+        self.providers = providers
+        self._executor = ThreadPoolExecutor(max_workers=sum(p.max_concurrency for p in providers),
+                                            thread_name_prefix="search-provider")
+        gauges.register_executor('search_providers', self._executor)
+
+    @staticmethod
+    def _merge(responses: List[Optional[Dict[str, Any]]], query: str) -> Dict[str, Any]:
+        merged: Dict[str, Dict[str, Any]] = {}
+        for response in responses:
+            for result in (response or {}).get('results', []):
+                key = result.get('url') or f"{result.get('title', '')}:{len(merged)}"
+                if key not in merged or (result.get('score') or 0) > (merged[key].get('score') or 0):
+                    merged[key] = result
+        results = sorted(merged.values(), key=lambda result: result.get('score') or 0, reverse=True)
+        return {'query': query, 'results': results}
+
+    def _collect(self, responses: List[Any], query: str, raise_errors: bool) -> Dict[str, Any]:
+        errors = []
+        for provider, response in zip(self.providers, responses):
+            if isinstance(response, Exception):
+                logger.error(f"搜索提供方 {provider.name} 失败: {response}")
+                errors.append(response)
+        if raise_errors and len(errors) == len(self.providers):
+            raise errors[-1]
+        return self._merge([r if isinstance(r, dict) else None for r in responses], query)
+
+    @staticmethod
+    def _search_one(provider: SearchProvider, query: str, max_results: int, include_raw_content: bool, **kwargs):
+        try:
+            return provider.search(query, max_results, include_raw_content, **kwargs)
+        except Exception as e:
+            return e
+
+    def search(self, query: str, max_results: int = 5, include_raw_content: bool = False, raise_errors: bool = False,
+               **kwargs) -> Dict[str, Any]:
+        """每个提供方各返回最多 max_results 条结果，合并后返回"""
+        if len(self.providers) == 1:
+            responses = [self._search_one(self.providers[0], query, max_results, include_raw_content, **kwargs)]
+        else:
+            futures = [
+                self._executor.submit(self._search_one, provider, query, max_results, include_raw_content, **kwargs)
+                for provider in self.providers
+            ]
+            responses = [future.result() for future in futures]
+        return self._collect(responses, query, raise_errors)
+
+    async def asearch(self, query: str, max_results: int = 5, include_raw_content: bool = False, raise_errors: bool = False,
+                      **kwargs) -> Dict[str, Any]:
+        responses = await asyncio.gather(
+            *(provider.asearch(query, max_results, include_raw_content, **kwargs) for provider in self.providers),
+            return_exceptions=True
+        )
+        return self._collect(responses, query, raise_errors)
+
+
+def create_search_client(config: Dict[str, Any]) -> MultiProviderSearch:
+    """根据网络搜索配置创建搜索客户端
+
+    优先读取 `search_providers` 列表（每项包含 `type` 及该提供方的参数）；
+    未配置时沿用旧的 `search_engine` / `search_api_key` 配置创建单个 Tavily 提供方。
+    未单独设置 `timeout` 的 Tavily 提供方以 `call_deadlines.web_search` 作为HTTP超时，
+    截止时间到达后落败的请求随之结束，不会继续占用调用线程。
+    """
+    web_deadline = (config.get('call_deadlines') or {}).get('web_search')
+    provider_configs = config.get('search_providers')
+    if not provider_configs:
+        if config.get('search_engine') != 'tavily':
+            raise ImportError("'search_engine' must be 'tavily'.")
+        provider_configs = [{'type': 'tavily', 'api_key': config.get('search_api_key'),
+                             'max_concurrency': config.get('max_workers', 5)}]
+
+    providers = []
+    for provider_config in provider_configs:
+        provider_type = provider_config.get('type')
+        if provider_type not in SEARCH_PROVIDERS:
+            raise ValueError(f"未知的搜索提供方 '{provider_type}'，可选: {list(SEARCH_PROVIDERS)}")
+        if provider_type == 'tavily' and not provider_config.get('api_key'):
+            provider_config = {**provider_config, 'api_key': config.get('search_api_key')}
+        if provider_type == 'tavily' and web_deadline and not provider_config.get('timeout'):
+            provider_config = {**provider_config, 'timeout': web_deadline}
+        providers.append(SEARCH_PROVIDERS[provider_type](provider_config))
+    return MultiProviderSearch(providers)
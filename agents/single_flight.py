@@ -0,0 +1,88 @@
+import re
+import unicodedata
+from threading import Event, Lock
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+# 查询首尾的标点不影响检索结果
+_EDGE_PUNCTUATION = ' \t\r\n"\'“”‘’`.,;:!?。，；：！？、'
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """规范化检索查询，使仅在大小写、全半角、空白和首尾标点上不同的查询视为同一查询"""
+    query = unicodedata.normalize('NFKC', query or '').lower()
+    query = _WHITESPACE_RE.sub(' ', query)
+    return query.strip(_EDGE_PUNCTUATION)
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result: Any = None
+        self.error: BaseException = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """同键并发调用合并（single-flight）
+
+    同一时刻对同一个键的多个调用只有第一个（leader）真正执行，其余调用等待并共享其结果或异常。
+    调用结束后立即移除该键，因此这里只合并并发调用，不做结果缓存。
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._executed = 0
+        self._coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """执行或加入一次调用
+
+        Args:
+            key: 调用键
+            fn: 无参可调用对象，仅由leader执行
+
+        Returns:
+            Tuple[Any, bool]: 调用结果，以及该结果是否来自其他调用方正在进行的调用
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+# 服务器内所有检索智能体共享，使不同节点、不同流程的相同查询也能合并
+search_flight = SingleFlight()
@@ -0,0 +1,163 @@
+import re
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+# CJK 统一表意文字、扩展A、兼容表意文字，以及日文假名和韩文音节
+_CJK_CHAR_PATTERN = r'㐀-䶿一-鿿豈-﫿぀-ヿ가-힯'
+_CJK_RE = re.compile(f'[{_CJK_CHAR_PATTERN}]')
+# 单个CJK字符作为一个词元，连续的字母数字作为一个词元，其余字符（空白、标点）丢弃
+_TOKEN_RE = re.compile(f'[{_CJK_CHAR_PATTERN}]|[^\\W_{_CJK_CHAR_PATTERN}]+')
+
+# CJK字符占比超过该阈值时按字符n-gram分片，否则按词分片
+CJK_RATIO_THRESHOLD = 0.3
+# CJK文本的字符n-gram长度
+CJK_NGRAM_SIZE = 3
+# 非CJK文本的词n-gram长度（1即词集合，与原先的空格分词行为一致）
+WORD_NGRAM_SIZE = 1
+
+# 滚动哈希使用的64位乘数（uint64运算自然按2^64取模）
+_HASH_BASE = np.uint64(1099511628211)
+# 词元ID空间偏移，避免拉丁词的crc32与CJK码点冲突
+_WORD_ID_OFFSET = 1 << 32
+
+_EMPTY = np.empty(0, dtype=np.uint64)
+
+
+def detect_language(text: str) -> str:
+    """根据CJK字符占比粗略判断文本语言
+
+    Args:
+        text: 输入文本
+
+    Returns:
+        str: 'cjk' 或 'latin'
+    """
+    if not text:
+        return 'latin'
+    tokens = _TOKEN_RE.findall(text)
+    if not tokens:
+        return 'latin'
+    cjk_count = sum(1 for token in tokens if _CJK_RE.fullmatch(token))
+    return 'cjk' if cjk_count / len(tokens) >= CJK_RATIO_THRESHOLD else 'latin'
+
+
+def _token_ids(tokens: List[str]) -> np.ndarray:
+    """将词元映射为uint64整数ID：CJK字符取码点，拉丁词取crc32并偏移"""
+    ids = np.empty(len(tokens), dtype=np.uint64)
+    for i, token in enumerate(tokens):
+        if len(token) == 1 and _CJK_RE.match(token):
+            ids[i] = ord(token)
+        else:
+            ids[i] = zlib.crc32(token.encode('utf-8')) + _WORD_ID_OFFSET
+    return ids
+
+
+def term_hashes(text: str, ngram_size: Optional[int] = None) -> np.ndarray:
+    """计算文本的n-gram词项哈希序列（保留重复，按出现顺序），供需要词频的打分使用
+
+    Args:
+        text: 输入文本
+        ngram_size: 分片长度，默认根据检测到的语言选择
+
+    Returns:
+        np.ndarray: uint64词项哈希数组
+    """
+    if not text:
+        return _EMPTY
+    tokens = _TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return _EMPTY
+    if ngram_size is None:
+        ngram_size = CJK_NGRAM_SIZE if detect_language(text) == 'cjk' else WORD_NGRAM_SIZE
+
+    ids = _token_ids(tokens)
+    # 文本短于分片长度时，整段作为一个分片
+    n = min(ngram_size, len(ids))
+    window_count = len(ids) - n + 1
+    hashes = np.zeros(window_count, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for offset in range(n):
+            hashes = hashes * _HASH_BASE + ids[offset:offset + window_count]
+    return hashes
+
+
+def shingle_hashes(text: str, ngram_size: Optional[int] = None) -> np.ndarray:
+    """计算文本的n-gram分片哈希集合
+
+    CJK文本按字符切分（中文没有空格分词，按空格切分只会得到几个超长“词”），
+    其他文本按小写单词切分；随后用向量化的多项式滚动哈希生成n-gram分片。
+
+    Args:
+        text: 输入文本
+        ngram_size: 分片长度，默认根据检测到的语言选择
+
+    Returns:
+        np.ndarray: 排序去重后的uint64分片哈希数组
+    """
+    return np.unique(term_hashes(text, ngram_size))
+
+
+def jaccard(hashes1: np.ndarray, hashes2: np.ndarray) -> float:
+    """计算两个分片哈希集合的Jaccard相似度
+
+    Args:
+        hashes1: 第一个排序去重后的分片哈希数组
+        hashes2: 第二个排序去重后的分片哈希数组
+
+    Returns:
+        float: 相似度分数(0-1)
+    """
+    if hashes1.size == 0 or hashes2.size == 0:
+        return 0.0
+    intersection = np.intersect1d(hashes1, hashes2, assume_unique=True).size
+    union = hashes1.size + hashes2.size - intersection
+    return intersection / union
+
+
+class ShingleIndex:
+    """一组文档分片集合的索引，支持一次性向量化地计算与所有已收录文档的最大Jaccard相似度"""
+
+    def __init__(self):
+        self._parts: List[np.ndarray] = []
+        self._hashes = _EMPTY
+        self._labels = np.empty(0, dtype=np.int64)
+        self._sizes = np.empty(0, dtype=np.int64)
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._parts)
+
+    def add(self, hashes: np.ndarray):
+        """收录一个文档的分片哈希集合"""
+        self._parts.append(hashes)
+        self._dirty = True
+
+    def _rebuild(self):
+        sizes = np.array([part.size for part in self._parts], dtype=np.int64)
+        self._hashes = np.concatenate(self._parts) if self._parts else _EMPTY
+        self._labels = np.repeat(np.arange(len(self._parts), dtype=np.int64), sizes)
+        self._sizes = sizes
+        self._dirty = False
+
+    def max_similarity(self, hashes: np.ndarray) -> float:
+        """计算给定分片集合与索引内所有文档的最大Jaccard相似度
+
+        Args:
+            hashes: 排序去重后的分片哈希数组
+
+        Returns:
+            float: 最大相似度分数(0-1)，索引为空时为0
+        """
+        if not self._parts or hashes.size == 0:
+            return 0.0
+        if self._dirty:
+            self._rebuild()
+        # 所有已收录文档的分片拼接后一次性做成员判断，再按文档归并出交集大小
+        member = np.isin(self._hashes, hashes, assume_unique=False)
+        intersections = np.bincount(self._labels[member], minlength=len(self._parts))
+        unions = self._sizes + hashes.size - intersections
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(unions > 0, intersections / unions, 0.0)
+        return float(scores.max())
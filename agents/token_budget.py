@@ -0,0 +1,130 @@
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿豈-﫿぀-ヿ가-힯]')
+
+
+class TokenCounter:
+    """本地分词计数器
+
+    优先使用 tiktoken（langchain-openai 的依赖）按模型选择编码；
+    tiktoken 不可用或编码文件无法加载时退化为启发式估算：CJK字符每字约1个token，其余字符每4个约1个token。
+    """
+
+    def __init__(self, model: Optional[str] = None):
+        self._encoding = None
+        try:
+            import tiktoken
+            try:
+                self._encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding('cl100k_base')
+            except KeyError:
+                self._encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception as e:
+            logger.warning(f"无法加载tiktoken编码，使用启发式token估算: {e}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._encoding is not None:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        cjk_count = len(_CJK_RE.findall(text))
+        return cjk_count + (len(text) - cjk_count + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截断文本，使其不超过 max_tokens 个token"""
+        if max_tokens <= 0:
+            return ""
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            return self._encoding.decode(tokens[:max_tokens])
+        if self.count(text) <= max_tokens:
+            return text
+        # 启发式模式下二分查找满足预算的最长前缀
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low]
+
+
+def normalized_scores(docs: Sequence) -> Dict[int, float]:
+    """按来源归一化相关性分数，返回 {id(文档): 分数}
+
+    网络结果的 Tavily 分数（0–1）与知识库的重排模型分数不在同一尺度上，因此在每个来源内部做 min-max 归一化：
+    该来源分数最高的文档为 1，最低的为 0，来源内分数全部相同（或只有一个文档）时均为 1；缺少分数的文档为 0。
+    """
+    by_source: Dict[str, List] = {}
+    for doc in docs:
+        by_source.setdefault(doc.source, []).append(doc)
+
+    normalized: Dict[int, float] = {}
+    for source_docs in by_source.values():
+        scores = [doc.metadata.get('score') for doc in source_docs if doc.metadata.get('score') is not None]
+        low, high = (min(scores), max(scores)) if scores else (0, 0)
+        for doc in source_docs:
+            score = doc.metadata.get('score')
+            if score is None:
+                normalized[id(doc)] = 0.0
+            else:
+                normalized[id(doc)] = (score - low) / (high - low) if high > low else 1.0
+    return normalized
+
+
+def rank_documents(docs: Sequence) -> List:
+    """按来源内归一化后的相关性分数从高到低排序（分数相同保持原顺序）"""
+    scores = normalized_scores(docs)
+    return sorted(docs, key=lambda doc: scores[id(doc)], reverse=True)
+
+
+def pack_documents(docs: Sequence, budget: int, counter: TokenCounter, render: Callable[[object, Optional[str]], str],
+                   min_document_tokens: int = 200) -> Tuple[List[str], List, int]:
+    """按相关性从高到低将文档装入token预算
+
+    文档按来源内归一化后的 `metadata['score']` 降序排列（见 rank_documents），依次放入预算；
+    放不下的第一个文档在剩余预算不少于 `min_document_tokens` 时截断后放入，其余文档丢弃。
+    即使预算已耗尽，也至少保留相关性最高的一个文档（截断到 `min_document_tokens`），保证迭代能够推进。
+
+    Args:
+        docs: 待装入的文档
+        budget: 可用于文档的token预算
+        counter: token计数器
+        render: 将 (文档, 覆盖内容或None) 渲染为提示文本的函数
+        min_document_tokens: 截断文档时保留的最少token数
+
+    Returns:
+        Tuple[List[str], List, int]: 渲染后的文档文本、被装入的文档、截断的文档数
+    """
+    ranked = rank_documents(docs)
+    rendered: List[str] = []
+    packed = []
+    truncated = 0
+    remaining = budget
+
+    for doc in ranked:
+        text = render(doc, None)
+        tokens = counter.count(text)
+        if tokens <= remaining:
+            rendered.append(text)
+            packed.append(doc)
+            remaining -= tokens
+            continue
+
+        # 渲染外壳（来源、元数据、分隔符）占用的token
+        overhead = counter.count(render(doc, ""))
+        allowance = remaining - overhead
+        if not packed:
+            allowance = max(allowance, min_document_tokens)
+        if allowance >= min_document_tokens:
+            rendered.append(render(doc, counter.truncate(doc.content, allowance)))
+            packed.append(doc)
+            truncated += 1
+        break
+
+    return rendered, packed, truncated
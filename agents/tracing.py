@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from loguru import logger
+
+from agents.instrumentation import current_context
+
+# 当前线程所在的span，线程池任务需通过 submit_with_context 传递
+_current_span: ContextVar[Optional["Span"]] = ContextVar('trace_span', default=None)
+
+
+def _attribute(value: Any):
+    return value if isinstance(value, (str, int, float, bool)) else str(value)
+
+
+class Span:
+    """一个计时区间；phase 为挂在span下、依次替换的子区间（如节点的每轮迭代）"""
+
+    def __init__(self, name: str, category: str, args: Dict[str, Any], parent: Optional["Span"] = None, otel_span=None):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.parent = parent
+        self.otel_span = otel_span
+        self.trace_id = str(args.get('process_id') or 'default')
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.start_us = time.time() * 1e6
+        self._start = time.perf_counter()
+        self.phase: Optional["Span"] = None
+
+    def elapsed_us(self) -> float:
+        return (time.perf_counter() - self._start) * 1e6
+
+
+class Tracer:
+    """轻量span追踪：按流程（process_id）缓存 Chrome trace-event，可导出为JSON文件在 chrome://tracing 或 Perfetto 中查看
+
+    未启用时所有span都是空操作。配置 otlp_endpoint 且安装了 opentelemetry-sdk 时，span同时导出到OTLP采集器。
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._traces: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._otel = None
+        self.configure()
+
+    def configure(self, config: Optional[Dict[str, Any]] = None):
+        config = config or {}
+        self.enabled = bool(config.get('enabled', False))
+        self.output_dir = config.get('output_dir', 'traces')
+        self.max_events = int(config.get('max_events', 200000))
+        self.max_traces = int(config.get('max_traces', 20))
+        endpoint = config.get('otlp_endpoint')
+        self._otel = self._create_otel_tracer(endpoint, config.get('service_name', 'editorial-agents')) if self.enabled and endpoint else None
+
+    @staticmethod
+    def _create_otel_tracer(endpoint: str, service_name: str):
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError:
+            logger.warning("未安装 opentelemetry-sdk / opentelemetry-exporter-otlp-proto-http，跳过OTLP导出，仅写入本地trace文件")
+            return None
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+        logger.info(f"OTLP追踪导出到: {endpoint}")
+        return provider.get_tracer("editorial_agents")
+
+    def _start(self, name: str, category: str, args: Dict[str, Any], parent: Optional[Span]) -> Span:
+        args = {key: _attribute(value) for key, value in {**current_context(), **args}.items() if value is not None}
+        otel_span = None
+        if self._otel is not None:
+            from opentelemetry.trace import set_span_in_context
+            context = set_span_in_context(parent.otel_span) if parent is not None and parent.otel_span is not None else None
+            otel_span = self._otel.start_span(name, context=context, attributes={"category": category, **args})
+        return Span(name, category, args, parent, otel_span)
+
+    def _finish(self, span: Span, error: Optional[BaseException] = None):
+        if error is not None:
+            span.args['error'] = repr(error)
+        if span.otel_span is not None:
+            if error is not None:
+                span.otel_span.set_attribute('error', repr(error))
+            span.otel_span.end()
+        self._append(span.trace_id, span.thread_id, span.thread_name, {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": round(span.start_us, 1),
+            "dur": round(span.elapsed_us(), 1),
+            "args": span.args,
+        })
+
+    def _append(self, trace_id: str, thread_id: int, thread_name: str, event: Dict[str, Any]):
+        event["pid"] = os.getpid()
+        event["tid"] = thread_id
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                trace = self._traces[trace_id] = {"events": [], "threads": {}, "dropped": 0}
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            if len(trace["events"]) >= self.max_events:
+                trace["dropped"] += 1
+                return
+            trace["events"].append(event)
+            trace["threads"][thread_id] = thread_name
+
+    @contextmanager
+    def span(self, name: str, category: str = "", **args):
+        """记录代码块为一个span，自动附加 metrics_context 中的 process_id / node_id / iteration 标签"""
+        if not self.enabled:
+            yield None
+            return
+        span = self._start(name, category, args, _current_span.get())
+        token = _current_span.set(span)
+        error = None
+        try:
+            yield span
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._end_phase(span)
+            _current_span.reset(token)
+            self._finish(span, error)
+
+    def phase(self, name: str, category: str = "", **args):
+        """在当前span下开始一个新的阶段子span，并结束同一span下的上一个阶段；外层span结束时最后一个阶段随之结束
+
+        用于循环中的每轮迭代等无法用 with 包裹的区间。
+        """
+        if not self.enabled:
+            return
+        owner = _current_span.get()
+        if owner is None:
+            return
+        while owner.parent is not None and owner.parent.phase is owner:
+            owner = owner.parent
+        self._end_phase(owner)
+        owner.phase = self._start(name, category, args, owner)
+        _current_span.set(owner.phase)
+
+    def _end_phase(self, owner: Span):
+        phase, owner.phase = owner.phase, None
+        if phase is not None:
+            _current_span.set(owner)
+            self._finish(phase)
+
+    def chrome_trace(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """流程的 Chrome trace-event JSON，没有记录时返回None"""
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                return None
+            events: List[Dict[str, Any]] = list(trace["events"])
+            threads = dict(trace["threads"])
+            dropped = trace["dropped"]
+        pid = os.getpid()
+        metadata = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"process {trace_id}"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}} for tid, name in threads.items()]
+        return {
+            "traceEvents": metadata + sorted(events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"process_id": trace_id, "dropped_events": dropped},
+        }
+
+    def export(self, trace_id: str, path: Optional[str] = None) -> Optional[str]:
+        """把流程的trace写入文件（默认 {output_dir}/{process_id}.trace.json），返回文件路径"""
+        trace = self.chrome_trace(trace_id)
+        if trace is None:
+            return None
+        path = path or os.path.join(self.output_dir, f"{trace_id}.trace.json")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(trace, file, ensure_ascii=False)
+        logger.info(f"追踪已导出: {path} ({len(trace['traceEvents'])} 个事件)")
+        return path
+
+
+# 服务器内共享的追踪器，通过 configure_tracing 启用
+tracer = Tracer()
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """LangChain回调：把链中每次聊天模型调用记录为当前span下的子span"""
+
+    def __init__(self, prompt_key: str):
+        self.prompt_key = prompt_key
+        self._spans: Dict[UUID, Span] = {}
+        self._lock = Lock()
+
+    def _start(self, run_id: UUID):
+        if not tracer.enabled:
+            return
+        span = tracer._start(self.prompt_key, 'llm', {'prompt_key': self.prompt_key}, _current_span.get())
+        with self._lock:
+            self._spans[run_id] = span
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs):
+        self._start(run_id)
+
+    def _finish(self, run_id: UUID, error: Optional[BaseException] = None):
+        with self._lock:
+            span = self._spans.pop(run_id, None)
+        if span is not None:
+            tracer._finish(span, error)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs):
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs):
+        self._finish(run_id, error)
+
+
+def configure_tracing(config: Optional[Dict[str, Any]] = None):
+    tracer.configure(config)
+
+
+def trace_span(name: str, category: str = "", **args):
+    return tracer.span(name, category, **args)
+
+
+def trace_phase(name: str, category: str = "", **args):
+    tracer.phase(name, category, **args)
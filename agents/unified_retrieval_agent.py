@@ -7,12 +7,24 @@ import hashlib
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Any, Optional
 
+import numpy as np
 from loguru import logger
-from openai import OpenAI
 
+from agents.client_registry import get_openai_client
+from agents.model_router import RETRYABLE_ERRORS, model_router
+from agents.instrumentation import metrics_context, update_metrics_context, current_context, submit_with_context, recorder, record_completion, gauges, is_rate_limited
+from agents.tracing import trace_span, trace_phase
 from agents.web_search_agent import WebSearchAgent
 from agents.local_kb_agent import LocalKBAgent
 from agents.prompts import PROMPTS
+from agents.text_similarity import shingle_hashes, jaccard, ShingleIndex
+from agents.document_pool import DocumentPool
+from agents.single_flight import search_flight, normalize_query
+from agents.novelty import NoveltyScorer, EarlyStopStats
+from agents.token_budget import TokenCounter, pack_documents, rank_documents
+from agents.passage_selection import extractive_trim
+from agents.hedging import caller_settings, get_hedged_caller, latency_stats
+from agents.circuit_breaker import CircuitOpenError, RetryCounter, backoff_delay, call_with_retry_budget, circuit_breaker_stats, get_circuit_breaker, retry_budget
 from web_api.models_api import LeafNodeStatusUpdate, DocumentPreview
 
 # Attempt to import the status manager instance
@@ -25,6 +37,28 @@ from web_api.models_api import LeafNodeStatusUpdate, DocumentPreview
 # In a real FastAPI app, this would be injected or accessed via a shared context.
 # For the purpose of this focused edit, we will assume it's passed as an argument.
 
+# 配置了提示词token预算时，当前内容等固定部分过长会被截断，保证检索结果至少占预算的这一比例
+RESULTS_BUDGET_SHARE = 0.25
+
+# 融合迭代模式的结构化输出格式
+REFINE_AND_EVALUATE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "refine_and_evaluate",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "content": {"type": "string"},
+                "retrieval_complete": {"type": "boolean"},
+                "new_queries": {"type": "array", "items": {"type": "string"}},
+            },
+            "required": ["content", "retrieval_complete", "new_queries"],
+            "additionalProperties": False,
+        },
+    },
+}
+
 class Document:
     """统一的文档表示类，用于网络和本地知识库检索"""
     def __init__(self, content: str, source: str, query: str, metadata: Optional[Dict[str, Any]] = None):
@@ -40,10 +74,25 @@ class Document:
         else:  # source == 'kb'
             file_path = self.metadata.get('source', '')
             page = self.metadata.get('page', 0)
-            self.id = f"{file_path}:{page}"
+            # 同一页（如 .txt 文件的全部内容）会被拆成多个片段，用片段起始位置区分；旧索引缺少起始位置时用内容摘要
+            start_index = self.metadata.get('start_index')
+            chunk = start_index if start_index is not None else hashlib.md5(content.encode('utf-8')).hexdigest()[:12]
+            self.id = f"{file_path}:{page}:{chunk}"
             file_name = os.path.basename(file_path) if file_path else "unknown"
             self.citation_key = f"kb_{hashlib.md5(self.id.encode()).hexdigest()[:6]}"
 
+        self._shingles = None
+
+    @property
+    def shingles(self):
+        """文档内容的n-gram分片哈希集合，首次访问时计算并缓存
+
+        去重发生在精炼之前，因此缓存的分片对应原始检索内容。
+        """
+        if self._shingles is None:
+            self._shingles = shingle_hashes(self.content)
+        return self._shingles
+
     def to_dict(self):
         """将文档转换为字典表示"""
         return {
@@ -59,16 +108,21 @@ class Document:
 class UnifiedRetrievalAgent:
     """统一检索智能体，整合网络和本地知识库检索"""
     
-    def __init__(self, web_config: Dict[str, Any], kb_config: Dict[str, Any]):
+    def __init__(self, web_config: Dict[str, Any], kb_config: Dict[str, Any],
+                 web_search_agent: Optional[WebSearchAgent] = None, local_kb_agent: Optional[LocalKBAgent] = None):
         """初始化统一检索智能体
         
         Args:
             web_config: 网络检索配置
             kb_config: 本地知识库配置
+            web_search_agent: 可选，已创建的网络检索智能体（默认按 web_config 创建）
+            local_kb_agent: 可选，已创建的本地知识库智能体（默认按 kb_config 创建，如基准测试传入合成知识库）
         """
         # 初始化网络和本地知识库检索工具
-        self.web_search_agent = WebSearchAgent(web_config)
-        self.local_kb_agent = LocalKBAgent(kb_config)
+        self.web_search_agent = web_search_agent or WebSearchAgent(web_config)
+        self.local_kb_agent = local_kb_agent or LocalKBAgent(kb_config, llm_settings=web_config)
+        # 网页段落选择复用本地知识库已加载的编码器
+        self.web_search_agent.passage_embeddings = getattr(self.local_kb_agent, 'embeddings', None)
         
         # 配置参数
         self.max_iterations = web_config.get('max_iterations', 3)
@@ -77,15 +131,58 @@ class UnifiedRetrievalAgent:
         self.kb_concurrency = kb_config.get('max_concurrency', 2)
         self.similarity_threshold = web_config.get('similarity_threshold', 0.7)
         
-        # 错误处理和重试配置
+        # 语义去重配置：复用本地知识库已加载的编码器，按余弦相似度过滤跨来源的重复内容
+        self.semantic_dedup = web_config.get('semantic_dedup', False)
+        self.semantic_similarity_threshold = web_config.get('semantic_similarity_threshold', 0.92)
+        
+        # 迭代模式：'separate' 为优化与评估两次调用，'fused' 为一次结构化调用同时完成
+        self.iteration_mode = web_config.get('iteration_mode', 'separate')
+        
+        # 批量精炼：每次请求最多打包的文档数，1 表示逐篇精炼
+        self.refine_batch_size = max(1, int(web_config.get('refine_batch_size', 1)))
+        
+        # 相关性门控：按来源设置分数阈值，低于阈值的文档不经过LLM精炼，而是丢弃或抽取式裁剪
+        self.refine_score_thresholds = web_config.get('refine_score_thresholds') or {}
+        self.low_score_action = web_config.get('low_score_action', 'trim')  # 'trim' 或 'drop'
+        self.extractive_trim_chars = web_config.get('extractive_trim_chars', 500)
+        
+        # 各提示词（PROMPTS键）的输入token预算，未配置的提示词不做裁剪
+        self.prompt_token_budgets = web_config.get('prompt_token_budgets') or {}
+        self.token_counter = TokenCounter(web_config.get('model')) if self.prompt_token_budgets else None
+        
+        # 启发式新颖度提前停止配置，命中时跳过评估LLM调用
+        self.novelty_scorer = NoveltyScorer(web_config.get('novelty_stop'))
+        
+        # 合并并发相同查询时区分不同检索配置的作用域
+        self._web_flight_scope = (web_config.get('search_engine'), repr(web_config.get('search_providers')), web_config.get('search_profile', 'lean'), web_config.get('web_num'), web_config.get('max_length'))
+        self._kb_flight_scope = (kb_config.get('kb_path'), kb_config.get('embedding_model'), kb_config.get('reranker_model'), kb_config.get('k'), kb_config.get('top_n'))
+        
+        # 错误处理和重试配置：带抖动的指数退避，重试次数受服务器级重试预算约束
         self.max_retries = web_config.get('max_retries', 3)
         self.retry_delay = web_config.get('retry_delay', 1)
+        self.max_retry_delay = web_config.get('max_retry_delay', 10)
+        retry_budget_config = web_config.get('retry_budget')
+        if retry_budget_config:
+            retry_budget.configure(**retry_budget_config)
         
-        # 初始化OpenAI客户端
-        self.llm = OpenAI(
-            api_key=web_config['api_key'] or os.environ['OPENAI_API_KEY'],
-            base_url=web_config['base_url'] or os.environ['OPENAI_BASE_URL']
-        )
+        # 按后端共享的熔断器，后端故障时快速失败并在恢复后逐步探测
+        breaker_config = web_config.get('circuit_breaker') or {}
+        self._breakers = {
+            'web_search': get_circuit_breaker('web_search', **breaker_config),
+            'kb_search': get_circuit_breaker(f"kb_search:{kb_config.get('kb_path')}", **breaker_config),
+            'llm': get_circuit_breaker(f"llm:{web_config.get('base_url') or os.environ.get('OPENAI_BASE_URL', '')}", **breaker_config),
+        }
+        
+        # 各后端调用的截止时间与对冲请求配置，设置相同的调用器在服务器内按后端共享
+        call_deadlines = web_config.get('call_deadlines') or {}
+        self._callers = {
+            backend: get_hedged_caller(backend, **caller_settings(web_config, backend))
+            for backend in ('web_search', 'kb_search', 'llm')
+        }
+        
+        # 初始化OpenAI客户端；重试由 _complete 按全局重试预算执行，关闭SDK自身的重试
+        llm_kwargs = {"timeout": call_deadlines['llm']} if call_deadlines.get('llm') else {}
+        self.llm = get_openai_client(api_key=web_config['api_key'], base_url=web_config['base_url'], max_retries=0, **llm_kwargs)
         self.model = web_config['model']
         
         # 初始化提示模板
@@ -104,7 +201,7 @@ class UnifiedRetrievalAgent:
         """
         # 兼容性处理：如果没有提供process_id和status_manager，使用默认值
         if process_id is None:
-            process_id = "default"
+            process_id = current_context().get('process_id') or "default"
         if status_manager is None:
             # 创建一个简单的mock状态管理器
             class MockStatusManager:
@@ -112,6 +209,10 @@ class UnifiedRetrievalAgent:
                     pass
                 def update_leaf_node_status(self, *args, **kwargs):
                     pass
+                def update_retrieval_stats(self, *args, **kwargs):
+                    pass
+                def get_process_state(self, *args, **kwargs):
+                    return None
             status_manager = MockStatusManager()
         
         logger.info(f"PID-{process_id}: 开始对叶节点进行迭代检索. 使用网络: {use_web}, 使用知识库: {use_kb}")
@@ -129,10 +230,25 @@ class UnifiedRetrievalAgent:
         else:
             logger.info(f"PID-{process_id}: 找到 {len(leaf_nodes)} 个叶节点")
         
+        # 同一篇文章的所有叶节点共享一个文档池
+        document_pool = DocumentPool()
+        early_stop_stats = EarlyStopStats()
+        
+        def process_node_timed(node):
+            node_start = time.time()
+            try:
+                with metrics_context(process_id=process_id, node_id=self._get_node_display_id(node), iteration=0), \
+                        trace_span('_process_node', 'retrieval', title=node.get('title')):
+                    self._process_node(node, process_id, status_manager, use_web, use_kb, document_pool, early_stop_stats)
+            finally:
+                early_stop_stats.record_node(self._get_node_display_id(node), time.time() - node_start)
+        
         # 使用线程池并发处理每个叶节点
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = [executor.submit(self._process_node, node, process_id, status_manager, use_web, use_kb) 
-                      for node in leaf_nodes]
+        with metrics_context(process_id=process_id), \
+                trace_span('iterative_retrieval_for_leaf_nodes', 'retrieval', leaf_nodes=len(leaf_nodes), use_web=use_web, use_kb=use_kb), \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            gauges.register_executor('retrieval_nodes', executor)
+            futures = [submit_with_context(executor, process_node_timed, node) for node in leaf_nodes]
             
             for future in as_completed(futures):
                 try:
@@ -143,6 +259,17 @@ class UnifiedRetrievalAgent:
                     logger.error(f"PID-{process_id}: 处理叶节点时发生未捕获的严重错误: {str(e)}")
                     # status_manager.update_overall_retrieval_message(process_id, "Error during leaf node processing", error=str(e))
         
+        document_pool.log_summary(process_id)
+        status_manager.update_retrieval_stats(process_id, "document_pool", document_pool.stats())
+        status_manager.update_retrieval_stats(process_id, "search_single_flight", search_flight.stats())
+        status_manager.update_retrieval_stats(process_id, "early_stopping", early_stop_stats.stats())
+        search_metrics = getattr(self.web_search_agent, 'search_metrics', None)
+        if use_web and search_metrics is not None:
+            status_manager.update_retrieval_stats(process_id, "web_search", search_metrics.stats())
+        status_manager.update_retrieval_stats(process_id, "call_latency", latency_stats())
+        status_manager.update_retrieval_stats(process_id, "circuit_breakers", circuit_breaker_stats())
+        status_manager.update_retrieval_stats(process_id, "retry_budget", retry_budget.stats())
+        logger.info(f"PID-{process_id}: 评估调用统计: {early_stop_stats.stats()}")
         logger.info(f"PID-{process_id}: 叶节点迭代检索完成或已处理所有节点。检查最终状态...")
         # Overall status (Completed / Completed with Errors) should be set by the last node update in status_manager
     
@@ -150,7 +277,7 @@ class UnifiedRetrievalAgent:
         # Helper to create a consistent ID for status reporting, can be enhanced
         return f"level{node.get('level', 'N')}-{node.get('title', 'Untitled').replace(' ', '_')[:30]}"
 
-    def _process_node(self, node: Dict[str, Any], process_id: str, status_manager: Any, use_web: bool, use_kb: bool):
+    def _process_node(self, node: Dict[str, Any], process_id: str, status_manager: Any, use_web: bool, use_kb: bool, document_pool: Optional[DocumentPool] = None, early_stop_stats: Optional[EarlyStopStats] = None):
         """处理单个叶节点的迭代检索流程
         
         Args:
@@ -159,7 +286,14 @@ class UnifiedRetrievalAgent:
             status_manager: 状态管理器实例
             use_web: 是否使用网络检索
             use_kb: 是否使用本地知识库检索
+            document_pool: 文章级共享文档池（可选）
+            early_stop_stats: 评估调用统计（可选）
         """
+        if document_pool is None:
+            document_pool = DocumentPool()
+        if early_stop_stats is None:
+            early_stop_stats = EarlyStopStats()
+        
         # from web_api.models_api import LeafNodeStatusUpdate # Moved here to avoid circular deps if file structure is flat
         # This import should ideally be at the top or managed by dependency injection.
         # For now, to make it runnable in isolation, assuming models_api is accessible.
@@ -174,6 +308,8 @@ class UnifiedRetrievalAgent:
         node['retrieval_history'] = []
         node['content'] = ""
         node['references'] = []
+        # 当前节点历史文档的语义向量集合（每行一个归一化向量）
+        history_vectors = np.empty((0, 0), dtype=np.float32)
         
         # 生成初始检索语句
         logger.info(f"PID-{process_id} Node-{node_display_id}: 生成初始检索语句")
@@ -183,7 +319,7 @@ class UnifiedRetrievalAgent:
             summary=node['summary']
         )
         
-        response = self._complete(initial_prompt, process_id, node_display_id)
+        response = self._complete(initial_prompt, process_id, node_display_id, prompt_key='generate_initial_queries')
         try:
             # 处理可能的markdown格式，去除```json和```
             response = self._clean_json_response(response)
@@ -277,6 +413,8 @@ class UnifiedRetrievalAgent:
         iteration = 0
         
         while iteration < self.max_iterations:
+            update_metrics_context(iteration=iteration + 1)
+            trace_phase('iteration', 'retrieval', queries=len(queries))
             current_iter_progress = f"{iteration + 1}/{self.max_iterations}"
             logger.info(f"PID-{process_id} Node-{node_display_id}: 第 {iteration+1} 次迭代检索")
             status_manager.update_leaf_node_status(process_id, node_display_id, 
@@ -287,7 +425,8 @@ class UnifiedRetrievalAgent:
             
             # 执行检索
             try:
-                results = self._execute_searches(queries, node, use_web, use_kb, process_id, node_display_id)
+                with gauges.stage_timer('search'), trace_span('search', 'stage', queries=len(queries)):
+                    results = self._execute_searches(queries, node, use_web, use_kb, process_id, node_display_id, document_pool)
             except Exception as e:
                 logger.error(f"PID-{process_id} Node-{node_display_id}: _execute_searches 失败: {str(e)}")
                 status_manager.update_leaf_node_status(process_id, node_display_id, 
@@ -299,17 +438,48 @@ class UnifiedRetrievalAgent:
                 LeafNodeStatusUpdate(status_message=f"Iteration {current_iter_progress}: Processing {len(results)} search results...")
             )
             
+            # 登记到文章级文档池，复用其他节点已获取的文档
+            results = [document_pool.acquire(doc) for doc in results]
+            status_manager.update_retrieval_stats(process_id, "document_pool", document_pool.stats())
+            
             # 去重处理
             new_results = self._deduplicate(results, node['retrieval_history'])
+            candidate_vectors = {}
+            if self.semantic_dedup:
+                new_results, candidate_vectors = self._semantic_deduplicate(new_results, history_vectors, process_id, node_display_id)
+            # 新颖度按去重后的文档数计算，不受之后的相关性门控和token预算影响
+            unique_count = len(new_results)
+            new_results, results_to_refine = self._gate_by_relevance(new_results, process_id, node_display_id)
             if not new_results:
                 logger.info(f"PID-{process_id} Node-{node_display_id}: 无新结果，停止迭代")
                 status_manager.update_leaf_node_status(process_id, node_display_id, 
                     LeafNodeStatusUpdate(status_message=f"Iteration {current_iter_progress}: No new unique documents found. Stopping iteration.", is_completed=True)
                 )
                 break  # 没有新结果，停止迭代
+            
+            # 只对去重后保留下来的文档进行精炼，避免为重复文档浪费LLM调用；
+            # 配置了提示词预算时，只精炼预算内装得下的文档
+            status_manager.update_leaf_node_status(process_id, node_display_id, 
+                LeafNodeStatusUpdate(status_message=f"Iteration {current_iter_progress}: Refining {len(results_to_refine)} unique documents...")
+            )
+            is_last_iteration = iteration >= self.max_iterations - 1
+            use_fused = self.iteration_mode == 'fused' and not is_last_iteration
+            prompt_fields = {'title': node['title'], 'summary': node['summary'], 'current_content': node['content']}
+            if use_fused:
+                prompt_fields['previous_queries'] = self._format_previous_queries(all_used_queries)
+            with gauges.stage_timer('refine_docs'), trace_span('refine_docs', 'stage', documents=len(results_to_refine)):
+                new_results = self._refine_within_budget(
+                    'refine_and_evaluate' if use_fused else 'refine_content_with_new_results',
+                    new_results, results_to_refine, process_id, node_display_id, document_pool, **prompt_fields
+                )
                 
-            # 更新检索历史
+            # 更新检索历史；只有进入检索历史的文档才加入语义去重的历史向量，
+            # 被相关性门控或预算舍弃的文档之后仍可被重新检索到
             node['retrieval_history'].extend(new_results)
+            kept_vectors = [candidate_vectors[id(doc)] for doc in new_results if id(doc) in candidate_vectors]
+            if kept_vectors:
+                kept_vectors = np.vstack(kept_vectors)
+                history_vectors = np.vstack([history_vectors, kept_vectors]) if history_vectors.size else kept_vectors
             logger.info(f"PID-{process_id} Node-{node_display_id}: 获取到 {len(new_results)} 个新结果")
             
             # 生成 DocumentPreview 列表用于状态更新
@@ -355,37 +525,73 @@ class UnifiedRetrievalAgent:
                         logger.error(f"PID-{process_id} Node-{node_display_id}: 更新检索文档预览失败: {str(e)}")
                         # 如果更新失败，继续执行但不更新文档预览
             
-            # 格式化检索结果用于提示
-            formatted_results = self._format_retrieval_results_for_prompt(new_results)
-            
             # 更新节点内容
             logger.info(f"PID-{process_id} Node-{node_display_id}: 更新内容")
             status_manager.update_leaf_node_status(process_id, node_display_id, 
                 LeafNodeStatusUpdate(status_message=f"Iteration {current_iter_progress}: Refining content with {len(new_results)} new documents...")
             )
-            refine_prompt = self.prompts['refine_content_with_new_results'].format(
-                title=node['title'],
-                summary=node['summary'],
-                current_content=node['content'],
-                new_results=formatted_results
-            )
-            node['content'] = self._complete(refine_prompt, process_id, node_display_id)
+            previous_content = node['content']
+            
+            # 融合模式下一次结构化调用同时完成内容优化和检索评估（最后一轮无需评估，仍走普通优化）
+            fused_result = None
+            if use_fused:
+                fused_prompt, packed_results = self._build_prompt_with_results(
+                    'refine_and_evaluate', new_results, process_id, node_display_id, **prompt_fields
+                )
+                with gauges.stage_timer('refine'), trace_span('refine', 'stage', documents=len(new_results)):
+                    fused_result = self._refine_and_evaluate(fused_prompt, process_id, node_display_id)
+            
+            if fused_result is not None:
+                node['content'] = fused_result['content']
+            else:
+                refine_prompt, packed_results = self._build_prompt_with_results(
+                    'refine_content_with_new_results', new_results, process_id, node_display_id,
+                    title=node['title'],
+                    summary=node['summary'],
+                    current_content=node['content']
+                )
+                with gauges.stage_timer('refine'), trace_span('refine', 'stage', documents=len(new_results)):
+                    node['content'] = self._complete(refine_prompt, process_id, node_display_id, prompt_key='refine_content_with_new_results')
             # 更新内容预览
             content_preview_text = (node['content'][:200] + '...') if node['content'] else "内容尚未生成"
             status_manager.update_leaf_node_status(process_id, node_display_id,
                 LeafNodeStatusUpdate(content_preview=content_preview_text)
             )
             
-            # 更新引用列表
-            self._update_references(node, new_results)
+            # 更新引用列表（只包含实际放入提示词的文档）
+            self._update_references(node, packed_results)
             
             # 如果已达到最大迭代次数，停止
-            if iteration >= self.max_iterations - 1:
+            if is_last_iteration:
                 logger.info(f"PID-{process_id} Node-{node_display_id}: 达到最大迭代次数 {self.max_iterations}")
                 status_manager.update_leaf_node_status(process_id, node_display_id, 
                     LeafNodeStatusUpdate(status_message=f"Max iterations ({self.max_iterations}) reached.", is_completed=True, iteration_progress=current_iter_progress)
                 )
                 break
+            
+            # 融合模式已在同一次调用中给出评估结果
+            if fused_result is not None:
+                if fused_result['retrieval_complete'] or not fused_result['new_queries']:
+                    logger.info(f"PID-{process_id} Node-{node_display_id}: 检索完成")
+                    status_manager.update_leaf_node_status(process_id, node_display_id, 
+                        LeafNodeStatusUpdate(status_message="Retrieval marked complete by LLM.", is_completed=True, iteration_progress=current_iter_progress)
+                    )
+                    break
+                all_used_queries.extend(fused_result['new_queries'])
+                queries = fused_result['new_queries']
+                iteration += 1
+                continue
+            
+            # 新颖度不足时直接停止，省去评估LLM调用
+            if self.novelty_scorer.enabled:
+                novelty = self.novelty_scorer.score(len(results), unique_count, previous_content, node['content'])
+                if novelty['should_stop']:
+                    logger.info(f"PID-{process_id} Node-{node_display_id}: 新颖度不足，提前停止迭代 ({', '.join(novelty['reasons'])})")
+                    early_stop_stats.record_skip(node_display_id)
+                    status_manager.update_leaf_node_status(process_id, node_display_id, 
+                        LeafNodeStatusUpdate(status_message=f"Stopped early: low novelty ({', '.join(novelty['reasons'])}).", is_completed=True, iteration_progress=current_iter_progress)
+                    )
+                    break
                 
             # 判断是否需要继续检索
             logger.info(f"PID-{process_id} Node-{node_display_id}: 判断是否需要继续检索")
@@ -399,7 +605,11 @@ class UnifiedRetrievalAgent:
                 previous_queries=self._format_previous_queries(all_used_queries)
             )
             
-            response = self._complete(evaluate_prompt, process_id, node_display_id)
+            evaluate_start = time.time()
+            with trace_span('evaluate', 'stage'):
+                response = self._complete(evaluate_prompt, process_id, node_display_id, prompt_key='evaluate_and_generate_new_queries')
+            early_stop_stats.record_evaluate(time.time() - evaluate_start)
+            gauges.observe_stage('evaluate', time.time() - evaluate_start)
             
             # 检查是否完成检索
             if "[RETRIEVAL_COMPLETE]" in response:
@@ -466,7 +676,6 @@ class UnifiedRetrievalAgent:
                     if new_queries:
                         all_used_queries.extend(new_queries)
                         queries = new_queries  # 设置为下一轮迭代的查询
-                        iteration += 1
                     else:
                         # 如果没有新查询，停止迭代
                         logger.warning(f"PID-{process_id} Node-{node_display_id}: 未能提取到有效的新查询，停止迭代")
@@ -484,7 +693,9 @@ class UnifiedRetrievalAgent:
             iteration += 1
         
         # Final status update if loop exited without specific completion status set
-        final_node_status = status_manager.get_process_state(process_id).retrieval_status.leaf_nodes_status.get(node_display_id)
+        process_state = status_manager.get_process_state(process_id)
+        leaf_nodes_status = process_state.retrieval_status.leaf_nodes_status if process_state and process_state.retrieval_status else {}
+        final_node_status = leaf_nodes_status.get(node_display_id)
         if final_node_status and not final_node_status.is_completed:
             logger.info(f"PID-{process_id} Node-{node_display_id}: 迭代循环结束，标记为完成。")
             
@@ -514,7 +725,7 @@ class UnifiedRetrievalAgent:
         else:
              logger.info(f"PID-{process_id} Node-{node_display_id}: 迭代检索完成，状态已更新。")
              # 确保即使LLM标记完成，也有最新的内容预览
-             final_node_status_obj = status_manager.get_process_state(process_id).retrieval_status.leaf_nodes_status.get(node_display_id)
+             final_node_status_obj = leaf_nodes_status.get(node_display_id)
              if final_node_status_obj and final_node_status_obj.is_completed:
                 content_preview = (node['content'][:200] + '...') if node['content'] else "最终内容未生成"
                 try:
@@ -524,7 +735,8 @@ class UnifiedRetrievalAgent:
                 except Exception as e:
                     logger.error(f"PID-{process_id} Node-{node_display_id}: 更新内容预览失败: {str(e)}")
     
-    def _execute_searches(self, queries: List[str], node: Dict[str, Any], use_web: bool, use_kb: bool, process_id: str, node_display_id: str) -> List[Document]:
+    def _execute_searches(self, queries: List[str], node: Dict[str, Any], use_web: bool, use_kb: bool, process_id: str, node_display_id: str,
+                          document_pool: Optional[DocumentPool] = None) -> List[Document]:
         """执行检索，包括网络和本地知识库
         
         Args:
@@ -534,6 +746,7 @@ class UnifiedRetrievalAgent:
             use_kb: 是否使用本地知识库检索
             process_id: 当前处理流程的ID
             node_display_id: 当前节点的显示ID
+            document_pool: 文章级共享文档池（可选），其他节点已完成的相同查询直接复用结果
             
         Returns:
             List[Document]: 检索结果列表
@@ -546,13 +759,14 @@ class UnifiedRetrievalAgent:
 
         # 使用线程池执行，确保并发性
         with ThreadPoolExecutor(max_workers=self.web_concurrency + self.kb_concurrency) as executor:
+            gauges.register_executor('search', executor)
             if use_web:
                 for query in queries:
-                    web_search_futures.append(executor.submit(self._execute_web_search_with_retry, query, node, process_id, node_display_id)) # 传递node用于日志记录
+                    web_search_futures.append(submit_with_context(executor, self._execute_web_search_with_retry, query, node, process_id, node_display_id, document_pool)) # 传递node用于日志记录
             
             if use_kb:
                 for query in queries:
-                    kb_search_futures.append(executor.submit(self._execute_kb_search_with_retry, query, node, process_id, node_display_id)) # 传递node用于日志记录
+                    kb_search_futures.append(submit_with_context(executor, self._execute_kb_search_with_retry, query, node, process_id, node_display_id, document_pool)) # 传递node用于日志记录
 
             # 收集网络搜索结果
             for future in as_completed(web_search_futures):
@@ -575,85 +789,265 @@ class UnifiedRetrievalAgent:
         logger.info(f"PID-{process_id} Node-{node_display_id}: 查询执行完毕，共获得 {len(all_results)} 个初步结果。")
         return all_results
     
-    def _execute_web_search_with_retry(self, query: str, node: Optional[Dict[str, Any]], process_id: str, node_display_id: str) -> List[Document]:
+    def _execute_web_search_with_retry(self, query: str, node: Optional[Dict[str, Any]], process_id: str, node_display_id: str,
+                                       document_pool: Optional[DocumentPool] = None) -> List[Document]:
         """为单个查询执行网络搜索，包含重试逻辑
         
+        同一篇文章中其他节点已完成的相同查询（规范化后）直接复用文档池中的结果；
+        并发中规范化后相同的查询（跨节点、跨流程）只会发起一次后端调用，共享其原始结果。
+        
         Args:
             query: 搜索查询语句
             node: 当前处理的节点 (可选, 用于日志)
             process_id: 当前处理流程的ID
             node_display_id: 当前节点的显示ID
+            document_pool: 文章级共享文档池（可选）
         Returns:
             List[Document]: 适配后的文档列表
         """
         # node_title = node.get('title', 'Unknown') if node else 'Unknown' # node_display_id is more specific
         logger.info(f"PID-{process_id} Node-{node_display_id}: 开始网络搜索，查询: \"{query}\"")
-        retry_count = 0
-        while retry_count < self.max_retries:
-            try:
-                # 使用现有的web_search_agent执行搜索，需要传递title和summary
-                # 由于这里我们只有query，我们将query作为title和summary
-                raw_results = self.web_search_agent._search_docs(title=query, summary=query)
-                
-                # 转换为Document格式
-                results = []
-                for result in raw_results:
-                    doc = self._adapt_web_result(result, query)
-                    # 同样需要传递title和summary
-                    refined_content = self.web_search_agent._refine_doc(doc.content, title=query, summary=query)
-                    doc.content = refined_content
-                    results.append(doc)
-                
-                logger.info(f"PID-{process_id} Node-{node_display_id}: 网络搜索查询 \"{query}\" 成功，获得 {len(results)} 个结果。")
-                return results
-            
-            except Exception as e:
-                retry_count += 1
-                logger.warning(f"PID-{process_id} Node-{node_display_id}: 网络检索失败 ({retry_count}/{self.max_retries}): {str(e)}")
-                if retry_count >= self.max_retries:
-                    logger.error(f"PID-{process_id} Node-{node_display_id}: 网络检索最终失败: {str(e)}")
-                    return []
-                time.sleep(self.retry_delay * retry_count)  # 指数退避
+        flight_key = ('web', self._web_flight_scope, normalize_query(query))
+        raw_results = self._shared_search('web_search', flight_key, lambda: self._search_web_with_retry(query, process_id, node_display_id),
+                                          document_pool, query, process_id, node_display_id)
+        
+        # 转换为Document格式（精炼在去重之后统一进行）
+        results = [self._adapt_web_result(result, query) for result in raw_results]
+        logger.info(f"PID-{process_id} Node-{node_display_id}: 网络搜索查询 \"{query}\" 成功，获得 {len(results)} 个结果。")
+        return results
+    
+    def _shared_search(self, backend: str, flight_key, search, document_pool: Optional[DocumentPool], query: str,
+                       process_id: str, node_display_id: str) -> List[dict]:
+        """先查文档池中本文章已完成的相同查询，再经 single-flight 合并并发的相同查询，最后才调用后端
+        
+        Returns:
+            List[dict]: 原始检索结果
+        """
+        start_time = time.perf_counter()
+        if document_pool is not None:
+            pooled = document_pool.get_search(flight_key)
+            if pooled is not None:
+                recorder.record('search', backend, time.perf_counter() - start_time, cache_hit=True)
+                logger.info(f"PID-{process_id} Node-{node_display_id}: 查询 \"{query}\" 复用了文档池中其他节点的检索结果")
+                return pooled
+        
+        raw_results, shared = search_flight.do(flight_key, search)
+        if shared:
+            recorder.record('search', backend, time.perf_counter() - start_time, cache_hit=True)
+            logger.info(f"PID-{process_id} Node-{node_display_id}: 查询 \"{query}\" 复用了进行中的相同查询结果")
+        # 失败的检索返回空列表，不缓存，之后的节点仍会重新检索
+        if document_pool is not None and raw_results:
+            document_pool.put_search(flight_key, raw_results)
+        return raw_results
     
-    def _execute_kb_search_with_retry(self, query: str, node: Optional[Dict[str, Any]], process_id: str, node_display_id: str) -> List[Document]:
+    def _search_web_with_retry(self, query: str, process_id: str, node_display_id: str) -> List[dict]:
+        """调用网络搜索后端，失败时重试
+        
+        Returns:
+            List[dict]: 原始搜索结果，最终失败时为空列表
+        """
+        # 使用现有的web_search_agent执行搜索，需要传递title和summary
+        # 由于这里我们只有query，我们将query作为title和summary
+        return self._call_backend_with_retry(
+            'web_search', lambda: self.web_search_agent._search_docs(title=query, summary=query, raise_errors=True),
+            "网络检索", process_id, node_display_id
+        )
+    
+    def _execute_kb_search_with_retry(self, query: str, node: Optional[Dict[str, Any]], process_id: str, node_display_id: str,
+                                      document_pool: Optional[DocumentPool] = None) -> List[Document]:
         """为单个查询执行知识库搜索，包含重试逻辑
         
+        同一篇文章中其他节点已完成的相同查询（规范化后）直接复用文档池中的结果；
+        并发中规范化后相同的查询（跨节点、跨流程）只会发起一次后端调用，共享其原始结果。
+        
         Args:
             query: 搜索查询语句 (通常是原始查询，HyDE在内部处理)
             node: 当前处理的节点 (可选, 用于日志)
             process_id: 当前处理流程的ID
             node_display_id: 当前节点的显示ID
+            document_pool: 文章级共享文档池（可选）
         Returns:
             List[Document]: 适配后的文档列表
         """
         # node_title = node.get('title', 'Unknown') if node else 'Unknown' # node_display_id is more specific
         logger.info(f"PID-{process_id} Node-{node_display_id}: 开始知识库搜索，原始查询: \"{query}\"")
+        flight_key = ('kb', self._kb_flight_scope, normalize_query(query))
+        kb_search_results = self._shared_search('kb_search', flight_key, lambda: self._search_kb_with_retry(query, process_id, node_display_id),
+                                                document_pool, query, process_id, node_display_id)
+        
+        results = []
+        for doc_dict in kb_search_results: # doc_dict is a dictionary
+            # Adapt dictionary to Document instance (refinement happens after deduplication)
+            document_instance = self._adapt_kb_result(doc_dict, query)
+            if document_instance: # Ensure adaptation was successful
+                results.append(document_instance)
+        
+        logger.info(f"PID-{process_id} Node-{node_display_id}: 知识库搜索查询 \"{query}\" 成功，获得 {len(results)} 个结果。")
+        return results
+    
+    def _search_kb_with_retry(self, query: str, process_id: str, node_display_id: str) -> List[dict]:
+        """调用本地知识库检索，失败时重试
+        
+        Returns:
+            List[dict]: 原始检索结果，最终失败时为空列表
+        """
+        return self._call_backend_with_retry(
+            'kb_search', lambda: self.local_kb_agent._search_docs(query, raise_errors=True),
+            "本地检索", process_id, node_display_id
+        )
+    
+    def _call_backend_with_retry(self, backend: str, fn, label: str, process_id: str, node_display_id: str) -> List[dict]:
+        """经熔断器和截止时间调用检索后端，失败时按带抖动的指数退避重试
+        
+        熔断器打开或全局重试预算耗尽时立即放弃，不再占用工作线程。
+        
+        Args:
+            backend: 后端名称（web_search / kb_search）
+            fn: 执行一次检索的无参函数
+            label: 日志中的后端描述
+            process_id: 当前处理流程的ID
+            node_display_id: 当前节点的显示ID
+            
+        Returns:
+            List[dict]: 原始检索结果，最终失败时为空列表
+        """
+        breaker = self._breakers[backend]
+        caller = self._callers[backend]
+        retry_budget.deposit()
         retry_count = 0
-        while retry_count < self.max_retries:
+        start_time = time.perf_counter()
+        
+        def failed():
+            recorder.record('search', backend, time.perf_counter() - start_time, retries=retry_count, error=True)
+            return []
+        
+        while True:
             try:
-                kb_search_results = self.local_kb_agent._search_docs(query) # Assuming this returns a list of dictionaries
-                
-                results = []
-                for doc_dict in kb_search_results: # doc_dict is a dictionary
-                    # Step 1: Adapt dictionary to Document instance
-                    document_instance = self._adapt_kb_result(doc_dict, query)
-                    
-                    # Step 2: Refine the content of the Document instance
-                    if document_instance: # Ensure adaptation was successful
-                        refined_content = self.local_kb_agent._refine_doc(document_instance.content, title=query, summary=query)
-                        document_instance.content = refined_content
-                        results.append(document_instance)
-                
-                logger.info(f"PID-{process_id} Node-{node_display_id}: 知识库搜索查询 \"{query}\" 成功，获得 {len(results)} 个结果。")
+                with gauges.in_flight(backend), trace_span(backend, 'search', attempt=retry_count + 1):
+                    results = breaker.call(lambda: caller.call(fn))
+                recorder.record('search', backend, time.perf_counter() - start_time, retries=retry_count)
                 return results
-                
+            except CircuitOpenError as e:
+                logger.warning(f"PID-{process_id} Node-{node_display_id}: {label}快速失败: {str(e)}")
+                return failed()
             except Exception as e:
+                if is_rate_limited(e):
+                    gauges.increment('rate_limited', backend)
+                logger.warning(f"PID-{process_id} Node-{node_display_id}: {label}失败 ({retry_count + 1}/{self.max_retries}): {str(e)}")
+                if retry_count + 1 >= self.max_retries:
+                    logger.error(f"PID-{process_id} Node-{node_display_id}: {label}最终失败: {str(e)}")
+                    return failed()
+                if not retry_budget.try_acquire():
+                    logger.error(f"PID-{process_id} Node-{node_display_id}: 全局重试预算已耗尽，{label}不再重试: {str(e)}")
+                    return failed()
                 retry_count += 1
-                logger.warning(f"PID-{process_id} Node-{node_display_id}: 本地检索失败 ({retry_count}/{self.max_retries}): {str(e)}")
-                if retry_count >= self.max_retries:
-                    logger.error(f"PID-{process_id} Node-{node_display_id}: 本地检索最终失败: {str(e)}")
-                    return []
-                time.sleep(self.retry_delay * retry_count)  # 指数退避
+                time.sleep(backoff_delay(self.retry_delay, retry_count, self.max_retry_delay))
+    
+    def _gate_by_relevance(self, docs: List[Document], process_id: str, node_display_id: str):
+        """按来源的相关性分数阈值过滤文档，低分文档被丢弃或用抽取式裁剪代替LLM精炼
+        
+        Args:
+            docs: 去重后的文档列表
+            process_id: 当前处理流程的ID
+            node_display_id: 当前节点的显示ID
+            
+        Returns:
+            Tuple[List[Document], List[Document]]: 保留的全部文档，以及其中需要LLM精炼的文档
+        """
+        if not self.refine_score_thresholds:
+            return docs, docs
+        
+        kept, to_refine = [], []
+        trimmed = dropped = 0
+        for doc in docs:
+            threshold = self.refine_score_thresholds.get(doc.source)
+            score = doc.metadata.get('score')
+            if threshold is None or score is None or score >= threshold:
+                kept.append(doc)
+                to_refine.append(doc)
+            elif self.low_score_action == 'drop':
+                dropped += 1
+            else:
+                doc.content = extractive_trim(doc.content, doc.query, self.extractive_trim_chars)
+                kept.append(doc)
+                trimmed += 1
+        
+        if trimmed or dropped:
+            logger.info(f"PID-{process_id} Node-{node_display_id}: 相关性门控丢弃 {dropped} 个、抽取式裁剪 {trimmed} 个低分文档，{len(to_refine)} 个文档进入LLM精炼")
+        return kept, to_refine
+    
+    def _refine_documents(self, docs: List[Document], process_id: str, node_display_id: str, document_pool: Optional[DocumentPool] = None) -> List[Document]:
+        """并发精炼文档内容（原地替换content）
+        
+        Args:
+            docs: 去重后的文档列表
+            process_id: 当前处理流程的ID
+            node_display_id: 当前节点的显示ID
+            document_pool: 文章级共享文档池（可选），用于在节点间复用相同输入的精炼结果
+            
+        Returns:
+            List[Document]: 精炼后的文档列表
+        """
+        # 优先使用文档池中缓存的精炼结果（其他节点以相同查询精炼过的同一文档）
+        pending = []
+        refine_keys: Dict[int, str] = {}
+        for doc in docs:
+            cached = None
+            if document_pool is not None:
+                refine_keys[id(doc)] = document_pool.refine_key(doc)
+                cached = document_pool.get_refined(refine_keys[id(doc)], doc.content)
+            if cached is not None:
+                doc.content = cached
+                recorder.record('llm', 'refine_doc', 0.0, cache_hit=True)
+            else:
+                pending.append(doc)
+        
+        def store(doc: Document):
+            if document_pool is not None and doc.content:
+                document_pool.put_refined(refine_keys[id(doc)], doc.content)
+        
+        def refine_single(doc: Document):
+            # 与检索时一致，使用检索查询作为title和summary
+            agent = self.web_search_agent if doc.source == 'web' else self.local_kb_agent
+            doc.content = agent._refine_doc(doc.content, title=doc.query, summary=doc.query)
+            store(doc)
+        
+        def refine_batch(batch: List[Document]):
+            agent = self.web_search_agent if batch[0].source == 'web' else self.local_kb_agent
+            refined = agent._refine_docs_batch([doc.content for doc in batch], title=batch[0].query, summary=batch[0].query)
+            if refined is None:
+                logger.warning(f"PID-{process_id} Node-{node_display_id}: 批量精炼输出解析失败，回退到逐篇精炼 ({len(batch)} 个文档)")
+                for doc in batch:
+                    refine_single(doc)
+                return
+            for doc, content in zip(batch, refined):
+                doc.content = content
+                store(doc)
+        
+        # 同一来源、同一查询的文档共享相同的title/summary前言，按批次打包精炼
+        tasks = []
+        if self.refine_batch_size > 1:
+            groups: Dict[Any, List[Document]] = {}
+            for doc in pending:
+                groups.setdefault((doc.source, doc.query), []).append(doc)
+            for group in groups.values():
+                for i in range(0, len(group), self.refine_batch_size):
+                    batch = group[i:i + self.refine_batch_size]
+                    tasks.append((refine_batch, batch) if len(batch) > 1 else (refine_single, batch[0]))
+        else:
+            tasks = [(refine_single, doc) for doc in pending]
+        
+        with ThreadPoolExecutor(max_workers=self.web_concurrency + self.kb_concurrency) as executor:
+            gauges.register_executor('refine', executor)
+            futures = [submit_with_context(executor, fn, arg) for fn, arg in tasks]
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"PID-{process_id} Node-{node_display_id}: 精炼文档失败: {str(e)}")
+        
+        logger.info(f"PID-{process_id} Node-{node_display_id}: 精炼了 {len(pending)} 个文档，共 {len(tasks)} 次请求")
+        return docs
     
     def _adapt_web_result(self, result, query):
         """将网络检索结果转换为统一的Document格式
@@ -688,11 +1082,11 @@ class UnifiedRetrievalAgent:
         Returns:
             Document: 统一格式的文档
         """
-        # 直接使用doc中的metadata
-        metadata = doc.get('metadata', {})
+        # 复制doc中的metadata（原始结果可能被多个并发查询共享）
+        metadata = dict(doc.get('metadata', {}))
         
         # 添加其他重要字段到metadata
-        for key in ['source', 'title', 'page', 'author']:
+        for key in ['source', 'title', 'page', 'author', 'score']:
             if key in doc and key not in metadata:
                 metadata[key] = doc[key]
         
@@ -716,45 +1110,80 @@ class UnifiedRetrievalAgent:
         deduplicated = []
         
         # 创建历史文档索引
-        history_ids = {doc.id for doc in history_docs}
-        history_titles = {}
+        seen_ids = {doc.id for doc in history_docs}
+        batch_keys = set()
+        shingle_index = ShingleIndex()
         for doc in history_docs:
-            title = doc.metadata.get('title', '')
-            if title:
-                if title not in history_titles:
-                    history_titles[title] = []
-                history_titles[title].append(doc)
+            shingle_index.add(doc.shingles)
         
         for new_doc in new_docs:
-            # 1. 检查ID是否重复（URL或文件路径+页码）
-            if new_doc.id in history_ids:
+            # 1. 检查ID是否与历史文档重复（URL或知识库片段）
+            if new_doc.id in seen_ids:
                 continue
-                
-            # 2. 检查标题是否重复
-            title = new_doc.metadata.get('title', '')
-            if title and title in history_titles:
-                # 如果标题相同，检查内容相似度
-                similar = False
-                for old_doc in history_titles[title]:
-                    if self._content_similarity(new_doc.content, old_doc.content) > self.similarity_threshold:
-                        similar = True
-                        break
-                if similar:
-                    continue
-                    
-            # 3. 对于没有明确标识的文档，检查内容相似度
-            if not title and not new_doc.id:
-                similar = False
-                for old_doc in history_docs:
-                    if self._content_similarity(new_doc.content, old_doc.content) > self.similarity_threshold:
-                        similar = True
-                        break
-                if similar:
-                    continue
-                    
+            
+            # 2. 同一批次内不同查询返回的同一文档：ID和内容都相同才视为重复
+            batch_key = (new_doc.id, new_doc.content)
+            if batch_key in batch_keys:
+                continue
+            
+            # 3. 检查内容是否与历史文档或本批次已保留的文档近似重复
+            if shingle_index.max_similarity(new_doc.shingles) > self.similarity_threshold:
+                logger.debug(f"丢弃近似重复文档: {new_doc.id}")
+                continue
+            
+            batch_keys.add(batch_key)
+            shingle_index.add(new_doc.shingles)
             deduplicated.append(new_doc)
         return deduplicated
     
+    def _semantic_deduplicate(self, new_docs: List[Document], history_vectors: np.ndarray, process_id: str, node_display_id: str):
+        """基于向量的语义去重，过滤与历史文档或本批次其他文档语义重复的文档
+        
+        Args:
+            new_docs: 词法去重后的新文档
+            history_vectors: 当前节点历史文档的归一化向量矩阵（不会被修改）
+            process_id: 当前处理流程的ID
+            node_display_id: 当前节点的显示ID
+            
+        Returns:
+            Tuple[List[Document], Dict[int, np.ndarray]]: 去重后的文档列表，以及按 id(doc) 索引的保留文档归一化向量，
+            由调用方在文档确定进入检索历史后再加入历史向量
+        """
+        embeddings = getattr(self.local_kb_agent, 'embeddings', None)
+        if not new_docs or embeddings is None:
+            return new_docs, {}
+        
+        try:
+            # 一次批量编码所有候选文档
+            vectors = np.asarray(embeddings.embed_documents([doc.content for doc in new_docs]), dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"PID-{process_id} Node-{node_display_id}: 语义去重编码失败，跳过语义去重: {str(e)}")
+            return new_docs, {}
+        
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms > 0, norms, 1.0)
+        
+        # 与历史文档的最大余弦相似度
+        if history_vectors.size:
+            history_max = (vectors @ history_vectors.T).max(axis=1)
+        else:
+            history_max = np.zeros(len(new_docs), dtype=np.float32)
+        batch_similarity = vectors @ vectors.T
+        
+        kept = []
+        for i in range(len(new_docs)):
+            if history_max[i] > self.semantic_similarity_threshold:
+                continue
+            if kept and batch_similarity[i, kept].max() > self.semantic_similarity_threshold:
+                continue
+            kept.append(i)
+        
+        dropped = len(new_docs) - len(kept)
+        if dropped:
+            logger.info(f"PID-{process_id} Node-{node_display_id}: 语义去重丢弃了 {dropped} 个重复文档")
+        
+        return [new_docs[i] for i in kept], {id(new_docs[i]): vectors[i] for i in kept}
+    
     def _content_similarity(self, text1, text2):
         """计算两段文本的相似度
         
@@ -765,17 +1194,8 @@ class UnifiedRetrievalAgent:
         Returns:
             float: 相似度分数(0-1)
         """
-        # 使用较简单的方法，避免引入额外依赖
-        words1 = set(text1.lower().split())
-        words2 = set(text2.lower().split())
-        
-        if not words1 or not words2:
-            return 0.0
-            
-        intersection = len(words1.intersection(words2))
-        union = len(words1.union(words2))
-        
-        return intersection / union
+        # 中文按字符n-gram、其他语言按单词进行分片后计算Jaccard相似度
+        return jaccard(shingle_hashes(text1), shingle_hashes(text2))
     
     def _update_references(self, node, new_results):
         """更新节点的引用列表
@@ -813,39 +1233,163 @@ class UnifiedRetrievalAgent:
         Returns:
             str: 格式化后的检索结果文本
         """
-        formatted_results = []
-        
-        for doc in results:
-            source_type = "网络来源" if doc.source == 'web' else "本地知识库"
-            
-            # 准备元数据信息
-            metadata_info = []
-            if doc.source == 'web':
-                if 'title' in doc.metadata and doc.metadata['title']:
-                    metadata_info.append(f"标题: {doc.metadata['title']}")
-                if 'url' in doc.metadata and doc.metadata['url']:
-                    metadata_info.append(f"链接: {doc.metadata['url']}")
-            else:  # 本地知识库
-                if 'source' in doc.metadata and doc.metadata['source']:
-                    file_name = os.path.basename(doc.metadata['source'])
-                    metadata_info.append(f"文件: {file_name}")
-                if 'page' in doc.metadata:
-                    metadata_info.append(f"页码: {doc.metadata['page']}")
-                if 'title' in doc.metadata and doc.metadata['title']:
-                    metadata_info.append(f"标题: {doc.metadata['title']}")
-                if 'author' in doc.metadata and doc.metadata['author']:
-                    metadata_info.append(f"作者: {doc.metadata['author']}")
-            
-            # 格式化单个文档
-            formatted_doc = f"""[{doc.citation_key}] {source_type}
+        return "\n\n".join(self._format_document_for_prompt(doc) for doc in results)
+    
+    def _format_document_for_prompt(self, doc, content: Optional[str] = None):
+        """将单个文档格式化为提示文本
+        
+        Args:
+            doc: 文档
+            content: 替代文档内容的文本（如截断后的内容），为None时使用文档原内容
+            
+        Returns:
+            str: 格式化后的文档文本
+        """
+        source_type = "网络来源" if doc.source == 'web' else "本地知识库"
+        
+        # 准备元数据信息
+        metadata_info = []
+        if doc.source == 'web':
+            if 'title' in doc.metadata and doc.metadata['title']:
+                metadata_info.append(f"标题: {doc.metadata['title']}")
+            if 'url' in doc.metadata and doc.metadata['url']:
+                metadata_info.append(f"链接: {doc.metadata['url']}")
+        else:  # 本地知识库
+            if 'source' in doc.metadata and doc.metadata['source']:
+                file_name = os.path.basename(doc.metadata['source'])
+                metadata_info.append(f"文件: {file_name}")
+            if 'page' in doc.metadata:
+                metadata_info.append(f"页码: {doc.metadata['page']}")
+            if 'title' in doc.metadata and doc.metadata['title']:
+                metadata_info.append(f"标题: {doc.metadata['title']}")
+            if 'author' in doc.metadata and doc.metadata['author']:
+                metadata_info.append(f"作者: {doc.metadata['author']}")
+        
+        # 格式化单个文档
+        return f"""[{doc.citation_key}] {source_type}
 {', '.join(metadata_info)}
 ---
-{doc.content}
+{doc.content if content is None else content}
 ---
 """
-            formatted_results.append(formatted_doc)
+    
+    def _build_prompt_with_results(self, prompt_key: str, results: List[Document], process_id: str, node_display_id: str, **fields):
+        """填充包含 {new_results} 的提示词，并在配置了预算时按token预算装入检索结果
+        
+        Args:
+            prompt_key: PROMPTS中的提示词键
+            results: 新检索结果
+            process_id: 当前处理流程的ID
+            node_display_id: 当前节点的显示ID
+            **fields: 提示词的其他字段
+            
+        Returns:
+            Tuple[str, List[Document]]: 填充后的提示词，以及实际装入提示词的文档
+        """
+        template = self.prompts[prompt_key]
+        budget = self.prompt_token_budgets.get(prompt_key)
+        if not budget:
+            return template.format(new_results=self._format_retrieval_results_for_prompt(results), **fields), results
+        
+        # 模板本身和当前内容等固定部分先占用预算，剩余部分用于检索结果
+        fields, results_budget = self._fit_prompt_fields(prompt_key, budget, fields, process_id, node_display_id)
+        separator_tokens = self.token_counter.count("\n\n") * max(len(results) - 1, 0)
+        rendered, packed, truncated = pack_documents(
+            results,
+            results_budget - separator_tokens,
+            self.token_counter,
+            self._format_document_for_prompt
+        )
+        prompt = template.format(new_results="\n\n".join(rendered), **fields)
+        
+        used_tokens = self.token_counter.count(prompt)
+        log = logger.warning if used_tokens > budget else logger.info
+        log(f"PID-{process_id} Node-{node_display_id}: 提示词 {prompt_key} 预算使用 {used_tokens}/{budget} tokens "
+            f"({used_tokens / budget:.0%})，装入文档 {len(packed)}/{len(results)}，截断 {truncated} 个")
+        return prompt, packed
+    
+    def _fit_prompt_fields(self, prompt_key: str, budget: int, fields: Dict[str, Any], process_id: str, node_display_id: str):
+        """计算提示词固定部分（模板与当前内容等字段）占用的token，返回 (字段, 留给检索结果的预算)
+        
+        固定部分超过预算的 (1 - RESULTS_BUDGET_SHARE) 时截断 current_content，保证检索结果至少有
+        RESULTS_BUDGET_SHARE 的预算，提示词总长不超过预算。
+        """
+        template = self.prompts[prompt_key]
+        fixed_tokens = self.token_counter.count(template.format(new_results="", **fields))
+        limit = int(budget * (1 - RESULTS_BUDGET_SHARE))
+        current_content = fields.get('current_content')
+        if fixed_tokens > limit and current_content:
+            content_tokens = self.token_counter.count(current_content)
+            keep_tokens = max(0, content_tokens - (fixed_tokens - limit))
+            fields = {**fields, 'current_content': self.token_counter.truncate(current_content, keep_tokens)}
+            fixed_tokens = self.token_counter.count(template.format(new_results="", **fields))
+            logger.warning(f"PID-{process_id} Node-{node_display_id}: 提示词 {prompt_key} 的当前内容过长，"
+                           f"截断为 {keep_tokens}/{content_tokens} tokens 以留出检索结果的预算")
+        return fields, budget - fixed_tokens
+    
+    def _refine_within_budget(self, prompt_key: str, docs: List[Document], to_refine: List[Document], process_id: str,
+                              node_display_id: str, document_pool: Optional[DocumentPool] = None, **fields) -> List[Document]:
+        """在装入提示词的token预算内精炼文档，返回可能装入提示词的文档
+        
+        未配置预算，或全部文档按原始内容都能装入预算时，一次性精炼全部文档；否则按来源内归一化的相关性
+        从高到低分批精炼，已精炼文档占满预算后不再精炼其余文档，也不把它们加入本轮结果
+        （它们不进入检索历史，之后的迭代仍可再次检索到）。
+        
+        Args:
+            prompt_key: 随后用于装入文档的提示词键
+            docs: 去重、门控后保留的文档
+            to_refine: 其中需要LLM精炼的文档
+            process_id: 当前处理流程的ID
+            node_display_id: 当前节点的显示ID
+            document_pool: 文章级共享文档池（可选）
+            **fields: 提示词的其他字段，用于计算固定部分占用的预算
+            
+        Returns:
+            List[Document]: 精炼后保留的文档（保持原顺序）
+        """
+        budget = self.prompt_token_budgets.get(prompt_key)
+        if not budget or not to_refine:
+            self._refine_documents(to_refine, process_id, node_display_id, document_pool)
+            return docs
         
-        return "\n\n".join(formatted_results)
+        _, results_budget = self._fit_prompt_fields(prompt_key, budget, fields, process_id, node_display_id)
+        separator_tokens = self.token_counter.count("\n\n")
+        
+        def tokens(doc: Document) -> int:
+            return self.token_counter.count(self._format_document_for_prompt(doc)) + separator_tokens
+        
+        # 精炼不会显著增加内容，按原始内容都能装入时无需分批
+        if sum(tokens(doc) for doc in docs) <= results_budget:
+            self._refine_documents(to_refine, process_id, node_display_id, document_pool)
+            return docs
+        
+        refine_ids = {id(doc) for doc in to_refine}
+        ranked = rank_documents(docs)
+        # 第一批为按原始内容就能装入预算的最长前缀（至少一个，与 pack_documents 一致），之后按并发数分批
+        first_wave = 0
+        raw_used = 0
+        for doc in ranked:
+            raw_used += tokens(doc)
+            if raw_used > results_budget:
+                break
+            first_wave += 1
+        wave_size = max(1, self.web_concurrency + self.kb_concurrency)
+        kept_ids = set()
+        used = 0
+        position = 0
+        while position < len(ranked) and (position == 0 or used < results_budget):
+            wave = ranked[position:position + (max(1, first_wave) if position == 0 else wave_size)]
+            position += len(wave)
+            self._refine_documents([doc for doc in wave if id(doc) in refine_ids], process_id, node_display_id, document_pool)
+            for doc in wave:
+                kept_ids.add(id(doc))
+                used += tokens(doc)
+        
+        skipped = len(ranked) - position
+        if skipped:
+            logger.info(f"PID-{process_id} Node-{node_display_id}: 提示词 {prompt_key} 的预算已占满，"
+                        f"{skipped} 个低相关性文档未精炼、不装入本轮提示词")
+        return [doc for doc in docs if id(doc) in kept_ids]
     
     def _format_previous_queries(self, queries):
         """格式化之前的查询列表
@@ -861,23 +1405,84 @@ class UnifiedRetrievalAgent:
             formatted_queries.append(f"{idx+1}. \"{query}\"")
         return "\n".join(formatted_queries)
     
-    def _complete(self, prompt: str, process_id: str, node_display_id: str):
+    def _refine_and_evaluate(self, prompt: str, process_id: str, node_display_id: str) -> Optional[Dict[str, Any]]:
+        """融合模式：一次结构化调用同时返回优化后的内容、检索完成标记和新查询
+        
+        Args:
+            prompt: 已填充的 refine_and_evaluate 提示词
+            process_id: 当前处理流程的ID
+            node_display_id: 当前节点的显示ID
+            
+        Returns:
+            Optional[Dict[str, Any]]: 包含 content、retrieval_complete、new_queries 的字典；
+                调用或校验失败时返回None，由调用方回退到分步模式
+        """
+        try:
+            response = self._complete(prompt, process_id, node_display_id, response_format=REFINE_AND_EVALUATE_RESPONSE_FORMAT, prompt_key='refine_and_evaluate')
+            result = json.loads(response)
+        except Exception as e:
+            logger.warning(f"PID-{process_id} Node-{node_display_id}: 融合调用失败，回退到分步模式: {str(e)}")
+            return None
+        
+        if not isinstance(result, dict) or not isinstance(result.get('content'), str) or not result['content'].strip() \
+                or not isinstance(result.get('retrieval_complete'), bool) or not isinstance(result.get('new_queries'), list):
+            logger.warning(f"PID-{process_id} Node-{node_display_id}: 融合调用返回的结构不符合要求，回退到分步模式")
+            return None
+        
+        result['new_queries'] = [query for query in result['new_queries'] if isinstance(query, str) and query.strip()]
+        return result
+    
+    def _complete(self, prompt: str, process_id: str, node_display_id: str, response_format: Optional[Dict[str, Any]] = None,
+                  prompt_key: Optional[str] = None):
         """调用LLM完成提示
         
+        端点过载（429、5xx、超时）时按带抖动的指数退避重试，最多尝试 max_retries 次，受全局重试预算限制；
+        被路由的提示词由路由表按端点重试并切换备用模型。
+        
         Args:
             prompt: 提示文本
             process_id: 当前处理流程的ID
             node_display_id: 当前节点的显示ID
+            response_format: 可选的结构化输出格式（如JSON Schema）
+            prompt_key: 提示词在PROMPTS中的键，用于按路由表选择模型
             
         Returns:
             str: 模型响应
         """
         try:
-            response = self.llm.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3,
-            )
+            kwargs = {"response_format": response_format} if response_format else {}
+            
+            def create(client, model):
+                try:
+                    return self._callers['llm'].call(lambda: client.chat.completions.create(
+                        model=model,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.3,
+                        **kwargs
+                    ))
+                except Exception as e:
+                    if is_rate_limited(e):
+                        gauges.increment('rate_limited', 'llm')
+                    raise
+            
+            start_time = time.perf_counter()
+            endpoints = model_router.endpoints_for(prompt_key)
+            counter = RetryCounter()
+            try:
+                with gauges.in_flight('llm'), trace_span(prompt_key or 'llm', 'llm', prompt_key=prompt_key):
+                    if endpoints:
+                        response = model_router.call(endpoints, lambda endpoint: create(endpoint.client, endpoint.model), counter)
+                    else:
+                        def on_retry(error, attempt):
+                            logger.warning(f"PID-{process_id} Node-{node_display_id}: 调用LLM失败 ({attempt}/{self.max_retries})，重试: {str(error)}")
+                        response = call_with_retry_budget(
+                            lambda: self._breakers['llm'].call(lambda: create(self.llm, self.model)),
+                            self.max_retries, self.retry_delay, self.max_retry_delay, RETRYABLE_ERRORS, on_retry, counter
+                        )
+            except Exception:
+                record_completion(prompt_key, time.perf_counter() - start_time, retries=counter.retries, error=True)
+                raise
+            record_completion(prompt_key, time.perf_counter() - start_time, response, retries=counter.retries)
             return response.choices[0].message.content
         except Exception as e:
             logger.error(f"PID-{process_id} Node-{node_display_id}: 调用LLM出错: {str(e)}")
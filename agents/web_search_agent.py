@@ -1,54 +1,127 @@
-from langchain_openai import ChatOpenAI
+from agents.model_router import LLMCallGuard, model_router
 from langchain_core.output_parsers import StrOutputParser
 from langchain.prompts import PromptTemplate
 from agents.prompts import PROMPTS
+from agents.batch_refine import format_batch_documents, parse_batch_refine_output
+from agents.passage_selection import select_passages
 from agents.initial_analysis_agent import ArticleOutline
-from tavily import TavilyClient
-from typing import List
+from agents.search_providers import create_search_client
+from typing import Any, Dict, List, Optional
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+import json
 import logging
-import os
+import time
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 搜索档位：lean 只请求摘要片段，full 额外请求网页正文并经段落选择压缩
+SEARCH_PROFILES = ('lean', 'full')
+
+
+class SearchMetrics:
+    """统计每次搜索请求的响应大小和耗时"""
+    
+    def __init__(self):
+        self._lock = Lock()
+        self._queries = 0
+        self._response_bytes = 0
+        self._seconds = 0.0
+        self._max_response_bytes = 0
+        self._max_seconds = 0.0
+    
+    def record(self, response_bytes: int, seconds: float):
+        with self._lock:
+            self._queries += 1
+            self._response_bytes += response_bytes
+            self._seconds += seconds
+            self._max_response_bytes = max(self._max_response_bytes, response_bytes)
+            self._max_seconds = max(self._max_seconds, seconds)
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "queries": self._queries,
+                "response_bytes": self._response_bytes,
+                "avg_response_bytes": self._response_bytes // self._queries if self._queries else 0,
+                "max_response_bytes": self._max_response_bytes,
+                "avg_seconds": round(self._seconds / self._queries, 3) if self._queries else 0.0,
+                "max_seconds": round(self._max_seconds, 3),
+            }
+
+
 class WebSearchAgent:
     def __init__(self, config):
-        self.llm = ChatOpenAI(api_key=config['api_key'] or os.environ['OPENAI_API_KEY'],
-                              base_url=config['base_url'] or os.environ['OPENAI_BASE_URL'],
-                              model=config['model'])
+        # 精炼调用经由截止时间、熔断器和全局重试预算保护，SDK 自身的重试关闭
+        self.llm_guard = LLMCallGuard(config)
+        self.llm = self.llm_guard.chat_model(config)
         self.web_num = config['web_num']
         # 设置最大线程数，可以根据实际情况调整
         self.max_workers = config['max_workers']
         self.max_length = config['max_length']
         
-        if config['search_engine'] == 'tavily':
-            self.search_client = TavilyClient(api_key=config['search_api_key'] or os.environ['TAVILY_API_KEY'])
-        else:
-            raise ImportError("'search_engine' must be 'tavily'.")
+        # 段落选择：按与查询的相关性挑选段落代替从头截断，method 为 bm25 或 embedding
+        passage_config = config.get('passage_selection') or {}
+        self.passage_selection = passage_config.get('enabled', True)
+        self.passage_method = passage_config.get('method', 'bm25')
+        self.passage_chars = passage_config.get('passage_chars', 400)
+        # embedding 模式下由调用方注入已加载的编码器（如本地知识库的编码器），未注入时退化为BM25
+        self.passage_embeddings = None
+        
+        self.search_profile = config.get('search_profile', 'lean')
+        if self.search_profile not in SEARCH_PROFILES:
+            raise ValueError(f"'search_profile' must be one of {SEARCH_PROFILES}.")
+        self.search_metrics = SearchMetrics()
+        
+        # 搜索客户端：单个或多个搜索提供方（tavily / local），多个提供方并行检索并合并结果
+        self.search_client = create_search_client(config)
         
-    def _search_docs(self, title: str, summary: str) -> List[dict]:
+    def _select_content(self, content: str, query: str) -> str:
+        """将网页内容压缩到 max_length 以内"""
+        if not content:
+            return ''
+        if not self.passage_selection:
+            return content[:self.max_length]
+        embeddings = self.passage_embeddings if self.passage_method == 'embedding' else None
+        return select_passages(content, query, self.max_length, self.passage_chars, embeddings)
+    
+    def _search_docs(self, title: str, summary: str, raise_errors: bool = False) -> List[dict]:
+        """搜索网络文档
+        
+        raise_errors 为 True 时搜索异常向上抛出（由调用方重试/熔断），否则记录日志并返回空列表
+        """
+        query = f"{title} {summary}"
         try:
+            start_time = time.perf_counter()
             raw_results = self.search_client.search(
-                query=f"{title} {summary}",
+                query=query,
                 max_results=self.web_num,
                 include_answer=False,
-                include_raw_content=True
+                include_raw_content=self.search_profile == 'full',
+                raise_errors=raise_errors
             )
+            elapsed = time.perf_counter() - start_time
             
             # 添加对raw_results的检查，确保它不是None
             if raw_results is None:
                 logger.warning(f"搜索结果为None (标题: {title})")
                 return []
             
+            response_bytes = len(json.dumps(raw_results, ensure_ascii=False).encode('utf-8'))
+            self.search_metrics.record(response_bytes, elapsed)
+            logger.info(f"搜索完成: {response_bytes} 字节, 耗时 {elapsed:.2f}s, 档位 {self.search_profile} (查询: {query[:50]})")
+            
             # 返回包含必要信息的结构化结果，而不是仅仅返回内容字符串
             structured_results = []
             for result in raw_results.get('results', []):  # 使用get方法安全地访问'results'
                 if 'content' in result:
+                    # full 档位优先使用网页正文，正文缺失时退回摘要片段
+                    content = result.get('raw_content') or result['content']
                     structured_results.append({
-                        'content': result['content'][:self.max_length] if result['content'] else '',
+                        'content': self._select_content(content, query),
                         'url': result.get('url', ''),
                         'title': result.get('title', ''),
                         'score': result.get('score', 0),
@@ -56,6 +129,8 @@ class WebSearchAgent:
             return structured_results
         except Exception as e:
             logger.error(f"搜索文档失败: {e}")
+            if raise_errors:
+                raise
             return []
     
     def _refine_doc(self, doc: str, title: str, summary: str) -> str:
@@ -65,7 +140,7 @@ class WebSearchAgent:
                 template=PROMPTS['refine_doc']
             )
             
-            refine_chain = refine_template | self.llm | StrOutputParser()
+            refine_chain = refine_template | model_router.chat_runnable('refine_doc', self.llm, self.llm_guard) | StrOutputParser()
             
             refine_result = refine_chain.invoke(
                 {
@@ -79,6 +154,28 @@ class WebSearchAgent:
             logger.error(f"精炼文档失败: {e}")
             return ""
     
+    def _refine_docs_batch(self, docs: List[str], title: str, summary: str) -> Optional[List[str]]:
+        """在一次LLM调用中精炼多篇文档，输出无法按编号完整解析时返回None"""
+        try:
+            refine_template = PromptTemplate(
+                input_variables=['title', 'summary', 'documents'],
+                template=PROMPTS['refine_docs_batch']
+            )
+            
+            refine_chain = refine_template | model_router.chat_runnable('refine_docs_batch', self.llm, self.llm_guard) | StrOutputParser()
+            
+            refine_result = refine_chain.invoke(
+                {
+                    'title': title,
+                    'summary': summary,
+                    'documents': format_batch_documents(docs)
+                }
+            )
+            return parse_batch_refine_output(refine_result, len(docs))
+        except Exception as e:
+            logger.error(f"批量精炼文档失败: {e}")
+            return None
+    
     def search_for_leaf_nodes(self, framework: ArticleOutline) -> ArticleOutline:
         leaf_nodes = framework.find_leaf_nodes()
         
@@ -0,0 +1,308 @@
+"""本地知识库微基准：导入吞吐、嵌入吞吐、索引构建、检索延迟和近似索引召回率（CPU即可运行）
+
+测量项：
+    ingest      _file2docs 的文件加载 + 拆分吞吐（片段/s、MB/s）
+    embedding   嵌入吞吐（片段/s）
+    indexes     各索引（Flat 精确检索、HNSW、IVF-Flat、IVF-PQ）的训练 / 添加耗时与序列化大小，
+                以及不同 efSearch / nprobe 下的单查询 p50 / p99 延迟和相对精确检索的 recall@k
+    search_docs LocalKBAgent._search_docs 在不同 k / top_n 下的 p50 / p99 延迟
+
+示例：
+    # 合成语料 + 哈希嵌入，不需要下载模型
+    python -m benchmarks.kb_benchmark --files 200 --output benchmarks/results/kb.json
+    # 使用真实论文库和配置中的模型
+    python -m benchmarks.kb_benchmark --corpus knowledge_base/test \\
+        --embedding-model models/bce-embedding-base_v1 --reranker-model models/bce-reranker-base_v1
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+from loguru import logger
+
+from agents.ann_index import ANNIndexFactory
+from agents.kb_store import MmapKBStore
+from agents.local_kb_agent import LocalKBAgent, ScoredCrossEncoderReranker, _file2docs, _list_files_in_directory
+from benchmarks.synthetic import SIMULATED_ENDPOINT, HashingEmbeddings, topic_corpus
+
+
+def _percentiles(seconds: List[float]) -> Dict[str, float]:
+    return {
+        'p50_ms': round(float(np.percentile(seconds, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(seconds, 99)) * 1000, 3),
+    }
+
+
+def load_embeddings(model: str, device: str):
+    """hashing[:dim] 使用哈希嵌入，否则与 LocalKBAgent 相同方式加载 HuggingFace 嵌入模型"""
+    if model.startswith('hashing'):
+        _, _, dim = model.partition(':')
+        return HashingEmbeddings(int(dim or 768))
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model, model_kwargs={"device": device}, encode_kwargs={"normalize_embeddings": True})
+
+
+def measure_ingest(paths: List[str], chunk_size: int, chunk_overlap: int):
+    start = time.perf_counter()
+    docs = []
+    for path in paths:
+        docs.extend(_file2docs(path, chunk_size, chunk_overlap))
+    seconds = time.perf_counter() - start
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    return docs, {
+        'files': len(paths),
+        'chunks': len(docs),
+        'megabytes': round(total_bytes / 2 ** 20, 2),
+        'seconds': round(seconds, 3),
+        'chunks_per_second': round(len(docs) / seconds, 1) if seconds else None,
+        'megabytes_per_second': round(total_bytes / 2 ** 20 / seconds, 2) if seconds else None,
+    }
+
+
+def measure_embedding(embeddings, texts: List[str], batch_size: int):
+    start = time.perf_counter()
+    vectors = []
+    for offset in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[offset:offset + batch_size]))
+    seconds = time.perf_counter() - start
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix, {
+        'dimension': int(matrix.shape[1]),
+        'seconds': round(seconds, 3),
+        'embeddings_per_second': round(len(texts) / seconds, 1) if seconds else None,
+    }
+
+
+def index_factory(args, index_type: str = 'auto') -> ANNIndexFactory:
+    return ANNIndexFactory({
+        'type': index_type, 'hnsw_m': args.hnsw_m, 'nlist': args.nlist, 'pq_m': args.pq_m, 'pq_nbits': args.pq_nbits,
+        'train_sample': args.train_sample, 'seed': args.seed,
+    })
+
+
+def build_index(factory: ANNIndexFactory, index_type: str, vectors: np.ndarray):
+    index = factory.create(index_type, len(vectors), vectors.shape[1])
+    start = time.perf_counter()
+    factory.train(index, vectors)
+    train_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index.add(vectors)
+    add_seconds = time.perf_counter() - start
+    return index, {
+        'factory': factory.factory_string(index_type, len(vectors), vectors.shape[1]),
+        'train_seconds': round(train_seconds, 3),
+        'add_seconds': round(add_seconds, 3),
+        'bytes': int(faiss.serialize_index(index).nbytes),
+    }
+
+
+def measure_queries(index, queries: np.ndarray, k: int, exact: Optional[np.ndarray]):
+    """逐条查询测延迟（与在线检索一致），exact 不为空时计算 recall@k"""
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0])
+    result = _percentiles(latencies)
+    if exact is not None:
+        hits = [len(set(approx[approx >= 0]) & set(truth[truth >= 0])) for approx, truth in zip(found, exact)]
+        result['recall'] = round(sum(hits) / (k * len(queries)), 4)
+    return result, np.asarray(found)
+
+
+def measure_indexes(vectors: np.ndarray, queries: np.ndarray, args) -> Dict[str, Any]:
+    results = {}
+    exact_index = faiss.IndexFlatL2(vectors.shape[1])
+    exact_index.add(vectors)
+    _, exact = exact_index.search(queries, args.recall_k)
+    for name in args.indexes:
+        factory = index_factory(args, name)
+        description = factory.factory_string(name, len(vectors), vectors.shape[1])
+        try:
+            index, stats = build_index(factory, name, vectors)
+        except RuntimeError as e:
+            logger.warning(f"索引 {name} ({description}) 构建失败: {e}")
+            results[name] = {'factory': description, 'error': str(e)}
+            continue
+        parameter, values = {'hnsw': ('ef_search', args.ef_search), 'ivf_flat': ('nprobe', args.nprobe),
+                             'ivf_pq': ('nprobe', args.nprobe)}.get(name, (None, [None]))
+        stats['search'] = []
+        for value in values:
+            if parameter:
+                setattr(factory, parameter, value)
+                factory.apply_search_parameters(index)
+            measured, _ = measure_queries(index, queries, args.recall_k, exact)
+            stats['search'].append({**({parameter: value} if parameter else {}), **measured})
+        results[name] = stats
+        print(f"索引 {name} ({description}): 训练 {stats['train_seconds']}s, 添加 {stats['add_seconds']}s, "
+              f"{stats['bytes'] / 2 ** 20:.1f}MB; " + "; ".join(
+                  f"{parameter or 'exact'}={entry.get(parameter, '-')}: p50 {entry['p50_ms']}ms p99 {entry['p99_ms']}ms recall@{args.recall_k} {entry['recall']}"
+                  for entry in stats['search']), flush=True)
+    return results
+
+
+class PrebuiltKBAgent(LocalKBAgent):
+    """使用外部构建的检索器的 LocalKBAgent，只用于测量 _search_docs"""
+
+    def __init__(self, config: Dict[str, Any], retriever):
+        self._prebuilt_retriever = retriever
+        super().__init__(config)
+
+    def _create_retriever(self, kb_path, embedding_model, reranker_model, k, top_n, chunk_size, chunk_overlap):
+        self.embeddings = None
+        self.retriever = self._prebuilt_retriever
+
+
+def measure_search_docs(docs, vectors: np.ndarray, embeddings, query_texts: List[str], args) -> List[Dict[str, Any]]:
+    """与 LocalKBAgent 相同的 FAISS 向量库（索引类型由 --search-docs-index 指定，可选交叉编码器重排），
+    测量 _search_docs 在不同 k / top_n 下的延迟"""
+    from langchain.retrievers import ContextualCompressionRetriever
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+
+    factory = index_factory(args, args.search_docs_index)
+    index_type = factory.resolve_type(len(vectors))
+    index = factory.build(vectors, index_type)
+    if args.persist_dir:
+        # 与 local_kb.index.persist_dir 相同：保存后以 mmap 方式重新打开，文档从 SQLite 按需读取
+        kb_store = MmapKBStore(args.persist_dir)
+        kb_store.save(index, index_type, docs, 'benchmark', factory)
+        start = time.perf_counter()
+        store = kb_store.load(embeddings, factory)
+        print(f"磁盘索引加载耗时 {(time.perf_counter() - start) * 1000:.1f}ms", flush=True)
+    else:
+        ids = [str(position) for position in range(len(docs))]
+        store = FAISS(embeddings, index, InMemoryDocstore(dict(zip(ids, docs))), dict(enumerate(ids)))
+    cross_encoder = None
+    if args.reranker_model:
+        from langchain_community.cross_encoders import HuggingFaceCrossEncoder
+        cross_encoder = HuggingFaceCrossEncoder(model_name=args.reranker_model, model_kwargs={"device": args.device})
+
+    config = {**SIMULATED_ENDPOINT, 'kb_path': '', 'embedding_model': '', 'reranker_model': args.reranker_model or '',
+              'k': 0, 'top_n': 0, 'chunk_size': args.chunk_size, 'chunk_overlap': args.chunk_overlap,
+              'device': args.device, 'max_workers': 1}
+    agent = PrebuiltKBAgent(config, None)
+    results = []
+    for k in args.k:
+        for top_n in (args.top_n if cross_encoder else [None]):
+            if top_n is not None and top_n > k:
+                continue
+            retriever = store.as_retriever(search_type='similarity', search_kwargs={"k": k})
+            if cross_encoder:
+                retriever = ContextualCompressionRetriever(base_compressor=ScoredCrossEncoderReranker(model=cross_encoder, top_n=top_n),
+                                                           base_retriever=retriever)
+            agent.retriever = retriever
+            agent._search_docs(query_texts[0])
+            latencies = []
+            for query in query_texts:
+                start = time.perf_counter()
+                agent._search_docs(query)
+                latencies.append(time.perf_counter() - start)
+            results.append({'k': k, 'top_n': top_n, **_percentiles(latencies)})
+            print(f"_search_docs k={k} top_n={top_n}: p50 {results[-1]['p50_ms']}ms, p99 {results[-1]['p99_ms']}ms", flush=True)
+    return results
+
+
+def sample_queries(docs, count: int, length: int, seed: int) -> List[str]:
+    """从随机片段中截取一段文字作为查询，查询与语料有真实的文本重叠"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        text = rng.choice(docs).page_content
+        offset = rng.randrange(max(1, len(text) - length))
+        queries.append(text[offset:offset + length])
+    return queries
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="本地知识库微基准（CPU）")
+    parser.add_argument('--corpus', help="论文目录（PDF / TXT / DOCX 等），不指定时生成合成语料")
+    parser.add_argument('--files', type=int, default=100, help="合成语料的文件数")
+    parser.add_argument('--file-chars', type=int, default=30000, help="合成语料每个文件的字符数")
+    parser.add_argument('--chunk-size', type=int, default=2000)
+    parser.add_argument('--chunk-overlap', type=int, default=200)
+    parser.add_argument('--embedding-model', default='hashing:768', help="嵌入模型路径；hashing[:维度] 为无需模型的哈希嵌入")
+    parser.add_argument('--reranker-model', help="交叉编码器路径，指定后 _search_docs 包含重排")
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--batch-size', type=int, default=32, help="嵌入批大小")
+    parser.add_argument('--indexes', nargs='+', choices=['flat', 'hnsw', 'ivf_flat', 'ivf_pq'], default=['flat', 'hnsw', 'ivf_flat', 'ivf_pq'])
+    parser.add_argument('--hnsw-m', type=int, default=32)
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 64, 256])
+    parser.add_argument('--nlist', type=int, default=0, help="IVF 聚类中心数，0 表示按 4*sqrt(n) 自动选择")
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--pq-m', type=int, default=0, help="PQ 子空间数，0 表示自动选择")
+    parser.add_argument('--pq-nbits', type=int, default=0, help="PQ 每个子空间的码本位数，0 表示按样本数自动选择")
+    parser.add_argument('--train-sample', type=int, default=20000, help="IVF 训练使用的最大样本数")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--query-chars', type=int, default=60)
+    parser.add_argument('--recall-k', type=int, default=10)
+    parser.add_argument('--search-docs-index', choices=['auto', 'flat', 'hnsw', 'ivf_flat', 'ivf_pq'], default='auto',
+                        help="_search_docs 使用的索引类型（auto 与 local_kb.index.type 默认值相同）")
+    parser.add_argument('--persist-dir', help="把 _search_docs 的索引和文档库写入该目录并以 mmap / SQLite 方式读取（local_kb.index.persist_dir）")
+    parser.add_argument('--k', type=int, nargs='+', default=[5, 10, 20], help="_search_docs 的向量检索数量")
+    parser.add_argument('--top-n', type=int, nargs='+', default=[3, 5], help="_search_docs 的重排保留数量（需 --reranker-model）")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="把结果写入该JSON文件")
+    parser.add_argument('--verbose', action='store_true', help="输出智能体日志")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory(prefix="kb-benchmark-") as workdir:
+        if args.corpus:
+            paths = [os.path.join(args.corpus, name) for name in sorted(_list_files_in_directory(args.corpus))]
+        else:
+            paths = topic_corpus(workdir, args.files, args.file_chars, seed=args.seed)
+        docs, ingest = measure_ingest(paths, args.chunk_size, args.chunk_overlap)
+    if not docs:
+        print("没有加载到任何文本片段")
+        sys.exit(1)
+    print(f"导入: {ingest['files']} 个文件, {ingest['chunks']} 个片段, {ingest['seconds']}s, "
+          f"{ingest['chunks_per_second']} 片段/s, {ingest['megabytes_per_second']} MB/s", flush=True)
+
+    embeddings = load_embeddings(args.embedding_model, args.device)
+    vectors, embedding = measure_embedding(embeddings, [doc.page_content for doc in docs], args.batch_size)
+    print(f"嵌入: {embedding['dimension']} 维, {embedding['seconds']}s, {embedding['embeddings_per_second']} 片段/s", flush=True)
+
+    query_texts = sample_queries(docs, args.queries, args.query_chars, args.seed)
+    query_vectors = np.asarray(embeddings.embed_documents(query_texts), dtype=np.float32)
+    indexes = measure_indexes(vectors, query_vectors, args)
+    search_docs = measure_search_docs(docs, vectors, embeddings, query_texts, args)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'faiss': faiss.__version__,
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'verbose')},
+        'ingest': ingest,
+        'embedding': embedding,
+        'indexes': indexes,
+        'search_docs': search_docs,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""端到端基准测试：合成大纲 + 模拟后端，测量检索与合成阶段在不同并发设置下的耗时、吞吐、内存和线程数
+
+示例：
+    python -m benchmarks.pipeline_benchmark --leaves 5 50 200 --max-workers 4 16 --concurrency 5 10
+    python -m benchmarks.pipeline_benchmark --output benchmarks/results/latest.json --baseline benchmarks/baseline.json
+    python -m benchmarks.pipeline_benchmark --update-baseline benchmarks/baseline.json
+
+与基线比较时，任一配置的耗时超过基线的 (1 + tolerance) 倍即视为回归，进程以退出码 1 结束。
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from typing import Any, Dict, List
+
+from loguru import logger
+
+from agents.client_registry import close_http_clients
+from agents.comprehensive_answer_agent import ComprehensiveAnswerAgent
+from agents.initial_analysis_agent import ArticleOutline
+from agents.replay import LatencyModel, traffic_replay
+from agents.unified_retrieval_agent import UnifiedRetrievalAgent
+from agents.web_search_agent import WebSearchAgent
+from benchmarks.synthetic import (SIMULATED_ENDPOINT, ResourceSampler, SimulatedLLMTransport, SimulatedSearchClient,
+                                  SyntheticKBAgent, synthetic_outline)
+
+
+def build_configs(max_workers: int, concurrency: int, args) -> Dict[str, Dict[str, Any]]:
+    web_config = {
+        **SIMULATED_ENDPOINT,
+        'search_engine': 'tavily',
+        'search_api_key': 'simulated',
+        'web_num': args.web_num,
+        'max_length': 2000,
+        'max_workers': max_workers,
+        'max_concurrency': concurrency,
+        'max_iterations': args.max_iterations,
+        'iteration_mode': args.iteration_mode,
+        'refine_batch_size': args.refine_batch_size,
+        'retry_delay': 0.01,
+    }
+    kb_config = {
+        **SIMULATED_ENDPOINT,
+        'kb_path': 'knowledge_base/synthetic',
+        'embedding_model': 'simulated',
+        'reranker_model': 'simulated',
+        'k': 5,
+        'top_n': args.kb_top_n,
+        'chunk_size': 2000,
+        'chunk_overlap': 200,
+        'device': 'cpu',
+        'max_workers': max_workers,
+        'max_concurrency': max(1, concurrency // 2),
+    }
+    compose_config = {**SIMULATED_ENDPOINT, 'max_workers': max_workers}
+    return {'web': web_config, 'kb': kb_config, 'compose': compose_config}
+
+
+def run_case(leaves: int, max_workers: int, concurrency: int, args) -> Dict[str, Any]:
+    """运行一个配置：对合成大纲执行检索和合成，返回测量结果"""
+    llm = SimulatedLLMTransport(LatencyModel({'distribution': 'lognormal', 'median': args.llm_latency, 'sigma': args.sigma}, args.seed),
+                                shared_query_ratio=args.shared_query_ratio)
+    search = SimulatedSearchClient(LatencyModel({'distribution': 'lognormal', 'median': args.search_latency, 'sigma': args.sigma}, args.seed + 1))
+    kb_latency = LatencyModel({'distribution': 'lognormal', 'median': args.kb_latency, 'sigma': args.sigma}, args.seed + 2)
+    traffic_replay.simulate(llm, lambda provider: search)
+    # 共享连接池按端点缓存，关闭后重新创建以使用本次的模拟传输层
+    close_http_clients()
+
+    configs = build_configs(max_workers, concurrency, args)
+    kb_agent = SyntheticKBAgent(configs['kb'], kb_latency, llm_settings=configs['web'])
+    retrieval_agent = UnifiedRetrievalAgent(configs['web'], configs['kb'],
+                                            web_search_agent=WebSearchAgent(configs['web']), local_kb_agent=kb_agent)
+    compose_agent = ComprehensiveAnswerAgent(configs['compose'])
+    framework = ArticleOutline(synthetic_outline(leaves, depth=args.depth, seed=args.seed))
+
+    with ResourceSampler() as sampler:
+        start = time.perf_counter()
+        retrieval_agent.iterative_retrieval_for_leaf_nodes(framework, use_web=not args.no_web, use_kb=not args.no_kb)
+        retrieval_seconds = time.perf_counter() - start
+        compose_start = time.perf_counter()
+        compose_agent.compose(framework)
+        compose_seconds = time.perf_counter() - compose_start
+    total_seconds = retrieval_seconds + compose_seconds
+
+    return {
+        'leaves': leaves,
+        'depth': args.depth,
+        'max_workers': max_workers,
+        'concurrency': concurrency,
+        'retrieval_seconds': round(retrieval_seconds, 3),
+        'compose_seconds': round(compose_seconds, 3),
+        'total_seconds': round(total_seconds, 3),
+        'leaves_per_second': round(leaves / total_seconds, 3) if total_seconds else None,
+        'llm_calls': sum(llm.calls.values()),
+        'llm_calls_by_prompt': dict(sorted(llm.calls.items())),
+        'search_calls': search.calls,
+        'kb_calls': kb_agent.retriever.calls,
+        'peak_rss_mb': round(sampler.peak_rss / 2 ** 20, 1),
+        'peak_threads': sampler.peak_threads,
+    }
+
+
+def case_key(result: Dict[str, Any]) -> str:
+    return f"leaves={result['leaves']},depth={result['depth']},max_workers={result['max_workers']},concurrency={result['concurrency']}"
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线比较总耗时，返回回归描述列表"""
+    baseline_cases = {case_key(case): case for case in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        reference = baseline_cases.get(case_key(result))
+        if reference is None:
+            continue
+        ratio = result['total_seconds'] / reference['total_seconds'] if reference['total_seconds'] else 1.0
+        line = f"{case_key(result)}: {reference['total_seconds']}s -> {result['total_seconds']}s ({ratio:.2f}x)"
+        print(("回归 " if ratio > 1 + tolerance else "     ") + line)
+        if ratio > 1 + tolerance:
+            regressions.append(line)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="检索与合成流程的端到端基准测试（模拟后端）")
+    parser.add_argument('--leaves', type=int, nargs='+', default=[5, 50, 200], help="合成大纲的叶节点数")
+    parser.add_argument('--depth', type=int, default=3, help="大纲层级数")
+    parser.add_argument('--max-workers', type=int, nargs='+', default=[4, 16], help="节点级线程数（max_workers）")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[5], help="每个节点的检索 / 精炼并发数（max_concurrency）")
+    parser.add_argument('--max-iterations', type=int, default=2)
+    parser.add_argument('--iteration-mode', choices=['separate', 'fused'], default='separate')
+    parser.add_argument('--refine-batch-size', type=int, default=1)
+    parser.add_argument('--web-num', type=int, default=5)
+    parser.add_argument('--kb-top-n', type=int, default=2)
+    parser.add_argument('--shared-query-ratio', type=float, default=0.0, help="生成的查询中取自全文共用查询的比例（模拟兄弟章节检索同一主题）")
+    parser.add_argument('--no-web', action='store_true', help="不执行网络检索")
+    parser.add_argument('--no-kb', action='store_true', help="不执行知识库检索")
+    parser.add_argument('--llm-latency', type=float, default=0.05, help="LLM 调用延迟中位数（秒）")
+    parser.add_argument('--search-latency', type=float, default=0.02, help="网络搜索延迟中位数（秒）")
+    parser.add_argument('--kb-latency', type=float, default=0.01, help="知识库检索延迟中位数（秒）")
+    parser.add_argument('--sigma', type=float, default=0.5, help="对数正态延迟分布的 sigma（越大尾延迟越长）")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="把结果写入该JSON文件")
+    parser.add_argument('--baseline', help="与该基线JSON比较，出现回归时以退出码 1 结束")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许的耗时增幅（相对基线）")
+    parser.add_argument('--update-baseline', metavar='PATH', help="把本次结果写为新的基线")
+    parser.add_argument('--verbose', action='store_true', help="输出智能体日志")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.verbose:
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+        logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for leaves, max_workers, concurrency in itertools.product(args.leaves, args.max_workers, args.concurrency):
+        result = run_case(leaves, max_workers, concurrency, args)
+        results.append(result)
+        print(f"{case_key(result)}: 检索 {result['retrieval_seconds']}s, 合成 {result['compose_seconds']}s, "
+              f"{result['leaves_per_second']} 叶节点/s, LLM {result['llm_calls']} 次, 搜索 {result['search_calls']} 次, "
+              f"峰值RSS {result['peak_rss_mb']}MB, 峰值线程 {result['peak_threads']}", flush=True)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline', 'update_baseline', 'verbose')},
+        'results': results,
+    }
+    for path in filter(None, (args.output, args.update_baseline)):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {path}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} 个配置相对基线出现回归")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
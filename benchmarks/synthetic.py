@@ -0,0 +1,325 @@
+"""基准测试用的合成大纲、合成语料和模拟后端（LLM / 网络搜索 / 知识库）
+
+不访问网络：LLM 请求由接入共享连接池的 httpx 传输层应答（见 agents.replay.TrafficReplay.simulate），
+搜索由进程内的 TavilyClient 替身应答，知识库检索由模拟检索器应答。
+每个后端按 agents.replay.LatencyModel 抽样的延迟休眠。
+"""
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import resource
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from agents.local_kb_agent import LocalKBAgent
+from agents.prompts import PROMPTS
+from agents.replay import LatencyModel
+
+# 模拟后端的LLM端点配置，请求由 SimulatedLLMTransport 应答，不会发出
+SIMULATED_ENDPOINT = {'api_key': 'simulated', 'base_url': 'http://simulated.invalid/v1', 'model': 'simulated'}
+
+_WORDS = ("跑步 训练 耐力 速度 姿势 步频 步幅 心率 乳酸 有氧 无氧 恢复 营养 蛋白质 碳水 补水 伤病 膝盖 "
+          "足底 拉伸 力量 核心 研究 数据 实验 结果 表明 影响 机制 方法").split()
+
+
+def _seed(*parts: Any) -> int:
+    return int(hashlib.md5("|".join(map(str, parts)).encode('utf-8')).hexdigest()[:8], 16)
+
+
+def filler_text(seed: int, chars: int) -> str:
+    """按种子生成约 chars 个字符的确定性伪中文文本"""
+    rng = random.Random(seed)
+    parts, length = [], 0
+    while length < chars:
+        sentence = "".join(rng.choice(_WORDS) for _ in range(rng.randint(6, 14))) + "。"
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)[:chars]
+
+
+def synthetic_outline(leaves: int, depth: int = 3, seed: int = 0) -> Dict[str, Any]:
+    """生成恰好有 leaves 个叶节点的 ArticleOutline 字典
+
+    叶节点位于第 depth 层，自底向上按约 leaves ** (1 / (depth - 1)) 的分支数归入父节点，各层扇出相近。
+    """
+    depth = max(2, depth)
+    branching = max(2, math.ceil(leaves ** (1 / (depth - 1))))
+    nodes = [{'level': depth, 'children': []} for _ in range(leaves)]
+    for level in range(depth - 1, 1, -1):
+        nodes = [{'level': level, 'children': nodes[i:i + branching]} for i in range(0, len(nodes), branching)]
+    root = {'level': 1, 'children': nodes}
+
+    rng = random.Random(seed)
+
+    def name(node: Dict[str, Any], number: str):
+        topic = "".join(rng.choice(_WORDS) for _ in range(2))
+        node['title'] = f"{number} {topic}" if number else f"合成文章（{leaves}个叶节点）"
+        node['summary'] = filler_text(_seed(seed, number), 60)
+        for index, child in enumerate(node['children'], 1):
+            name(child, f"{number}.{index}" if number else str(index))
+
+    name(root, "")
+    return root
+
+
+def topic_corpus(directory: str, files: int, chars: int, topics: int = 20, vocabulary: int = 3000, seed: int = 0) -> List[str]:
+    """在 directory 下生成 files 个约 chars 字符的 .txt 文件，返回文件路径
+
+    每个文件属于 topics 个主题之一，词语按主题内的 Zipf 分布抽取，使语料的向量在空间中成簇，
+    近似检索索引（IVF / HNSW）的召回率和耗时更接近真实论文库。
+    """
+    rng = random.Random(seed)
+    words = ["".join(chr(rng.randint(0x4e00, 0x9fa5)) for _ in range(2)) for _ in range(vocabulary)]
+    weights = [1.0 / rank for rank in range(1, vocabulary + 1)]
+    orders = [rng.sample(words, vocabulary) for _ in range(topics)]
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(files):
+        order = orders[index % topics]
+        parts, length = [], 0
+        while length < chars:
+            sentence = "".join(rng.choices(order, weights=weights, k=rng.randint(8, 20))) + "。"
+            if rng.random() < 0.2:
+                sentence += "\n\n"
+            parts.append(sentence)
+            length += len(sentence)
+        path = os.path.join(directory, f"paper_{index:05d}.txt")
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write("".join(parts))
+        paths.append(path)
+    return paths
+
+
+class HashingEmbeddings(Embeddings):
+    """按字符二元组哈希到 dim 维并归一化的嵌入，无需下载模型即可在CPU上测量索引与检索
+
+    与真实嵌入模型一样，文本重叠越多向量越接近，但编码成本远低于 Transformer，测得的嵌入吞吐不代表真实模型。
+    """
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        buckets = [zlib.crc32(text[i:i + 2].encode('utf-8')) % self.dim for i in range(len(text) - 1)]
+        if buckets:
+            np.add.at(vector, buckets, 1.0)
+            vector /= np.linalg.norm(vector)
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def _prompt_signatures() -> Dict[str, List[str]]:
+    signatures = {}
+    for key, template in PROMPTS.items():
+        segments = re.split(r'(?<!\{)\{[a-z_]+\}(?!\})', template)
+        signatures[key] = [segment.replace('{{', '{').replace('}}', '}').strip() for segment in segments if segment.strip()]
+    return signatures
+
+
+class SimulatedLLMTransport(httpx.BaseTransport):
+    """模拟 OpenAI chat.completions 接口，按提示词类型返回合成输出
+
+    通过匹配 PROMPTS 模板中的固定文本识别提示词，使各智能体的解析逻辑（查询列表、[RETRIEVAL_COMPLETE]、
+    融合模式的JSON、批量精炼的 <refined> 标签）都能正常工作。
+    生成的查询中 shared_query_ratio 比例取自 shared_queries 个全文共用的查询，模拟兄弟章节检索同一主题的情形。
+    """
+
+    def __init__(self, latency: LatencyModel, stop_probability: float = 0.5, queries_per_call: int = 3,
+                 output_chars: int = 600, shared_query_ratio: float = 0.0, shared_queries: int = 20):
+        self.latency = latency
+        self.stop_probability = stop_probability
+        self.queries_per_call = queries_per_call
+        self.output_chars = output_chars
+        self.shared_query_ratio = shared_query_ratio
+        self.shared_queries = shared_queries
+        self._signatures = _prompt_signatures()
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+
+    def identify(self, prompt: str) -> str:
+        matches = [key for key, segments in self._signatures.items() if segments and all(segment in prompt for segment in segments)]
+        if not matches:
+            return 'unknown'
+        return max(matches, key=lambda key: sum(len(segment) for segment in self._signatures[key]))
+
+    def _queries(self, seed: int) -> List[str]:
+        rng = random.Random(seed)
+        queries = []
+        for i in range(self.queries_per_call):
+            if self.shared_query_ratio and rng.random() < self.shared_query_ratio:
+                queries.append(f"shared topic {rng.randrange(self.shared_queries)}")
+            else:
+                queries.append(f"{''.join(rng.choice(_WORDS) for _ in range(3))} {seed % 100000}-{i}")
+        return queries
+
+    def respond(self, key: str, prompt: str, structured: bool) -> str:
+        seed = _seed(prompt)
+        rng = random.Random(seed)
+        if key == 'generate_initial_queries':
+            return "```json\n" + json.dumps(self._queries(seed), ensure_ascii=False) + "\n```"
+        if key == 'evaluate_and_generate_new_queries':
+            if rng.random() < self.stop_probability:
+                return "[RETRIEVAL_COMPLETE]"
+            return json.dumps(self._queries(seed), ensure_ascii=False)
+        if key == 'refine_and_evaluate' or structured:
+            complete = rng.random() < self.stop_probability
+            return json.dumps({
+                'content': filler_text(seed, self.output_chars),
+                'retrieval_complete': complete,
+                'new_queries': [] if complete else self._queries(seed),
+            }, ensure_ascii=False)
+        if key == 'refine_docs_batch':
+            count = len(re.findall(r'<document id="\d+">', prompt))
+            return "\n".join(f'<refined id="{i}">{filler_text(seed + i, self.output_chars // 3)}</refined>' for i in range(1, count + 1))
+        if key in ('refine_doc',):
+            return filler_text(seed, self.output_chars // 3)
+        return filler_text(seed, self.output_chars)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.read() or b"{}")
+        prompt = "\n".join(str(message.get('content', '')) for message in body.get('messages', []))
+        key = self.identify(prompt)
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+        content = self.respond(key, prompt, structured='response_format' in body)
+        time.sleep(self.latency.sample())
+        prompt_tokens = len(prompt) // 2
+        completion_tokens = len(content) // 2
+        return httpx.Response(200, request=request, json={
+            'id': f"sim-{_seed(prompt, time.monotonic_ns())}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'simulated'),
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens, 'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+
+class SimulatedSearchClient:
+    """TavilyClient 的进程内替身
+
+    URL 从 url_pool 个页面中抽取，不同查询会返回重叠的文档，与真实搜索一样触发去重和共享文档池。
+    """
+
+    def __init__(self, latency: LatencyModel, url_pool: int = 2000, content_chars: int = 1200):
+        self.latency = latency
+        self.url_pool = url_pool
+        self.content_chars = content_chars
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def search(self, query: str, max_results: int = 5, include_raw_content: bool = False, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency.sample())
+        rng = random.Random(_seed(query))
+        results = []
+        for rank in range(max_results):
+            page = rng.randrange(self.url_pool)
+            result = {
+                'url': f"https://example.com/page/{page}",
+                'title': f"页面 {page}",
+                'content': filler_text(page, self.content_chars // 4),
+                'score': round(1.0 - rank / (max_results + 1), 3),
+            }
+            if include_raw_content:
+                result['raw_content'] = filler_text(page, self.content_chars)
+            results.append(result)
+        return {'query': query, 'results': results}
+
+
+class SimulatedRetriever:
+    """代替 LocalKBAgent 中 FAISS + 交叉编码器重排的检索器"""
+
+    def __init__(self, latency: LatencyModel, top_n: int, corpus_pages: int = 500, content_chars: int = 1500):
+        self.latency = latency
+        self.top_n = top_n
+        self.corpus_pages = corpus_pages
+        self.content_chars = content_chars
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def invoke(self, query: str) -> List[Document]:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency.sample())
+        rng = random.Random(_seed('kb', query))
+        docs = []
+        for rank in range(self.top_n):
+            page = rng.randrange(self.corpus_pages)
+            docs.append(Document(
+                page_content=filler_text(_seed('kb', page), self.content_chars),
+                metadata={'source': f"knowledge_base/synthetic/paper_{page % 50}.pdf", 'page': page,
+                          'relevance_score': round(1.0 - rank / (self.top_n + 1), 3)},
+            ))
+        return docs
+
+
+class SyntheticKBAgent(LocalKBAgent):
+    """使用模拟检索器的 LocalKBAgent，文档精炼仍经由（模拟的）LLM"""
+
+    def __init__(self, config: Dict[str, Any], latency: LatencyModel, llm_settings: Optional[Dict[str, Any]] = None):
+        self._simulated_latency = latency
+        super().__init__(config, llm_settings)
+
+    def _create_retriever(self, kb_path, embedding_model, reranker_model, k, top_n, chunk_size, chunk_overlap):
+        self.embeddings = None
+        self.retriever = SimulatedRetriever(self._simulated_latency, top_n)
+
+
+def current_rss_bytes() -> int:
+    """当前进程的常驻内存（读取 /proc，不可用时退回 getrusage 的峰值）"""
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class ResourceSampler:
+    """后台采样常驻内存和线程数，保留峰值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+        # 不计采样线程本身
+        self.peak_threads = max(self.peak_threads, threading.active_count() - 1)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self._thread = threading.Thread(target=self._loop, name="resource-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        return False
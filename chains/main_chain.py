@@ -2,11 +2,23 @@ from agents.initial_analysis_agent import InitialAnalysisAgent
 from agents.unified_retrieval_agent import UnifiedRetrievalAgent
 from agents.comprehensive_answer_agent import ComprehensiveAnswerAgent
 from agents.intro_conclusion_agent import IntroductionConclusionAgent
+from agents.client_registry import configure_http_clients
+from agents.model_router import configure_model_routing
+from agents.replay import configure_replay
+from agents.instrumentation import metrics_context
+from agents.tracing import configure_tracing, trace_span, tracer
 from loguru import logger
 from rich.pretty import pprint
+import uuid
 
 class ScienceArticleChain:
     def __init__(self, config):
+        # 所有智能体按 (base_url, api_key) 共享长连接池，并按提示词路由表选择模型；录制 / 回放须在创建任何客户端之前配置
+        configure_replay(config.get('replay'))
+        configure_http_clients(config.get('http_client'))
+        configure_model_routing(config.get('model_routing'))
+        configure_tracing(config.get('tracing'))
+        
         logger.info("正在创建 InitialAnalysisAgent")
         self.initial_agent = InitialAnalysisAgent(config['initial_analysis'])
         
@@ -20,6 +32,16 @@ class ScienceArticleChain:
         self.intro_conclusion_agent = IntroductionConclusionAgent(config['intro_conclusion'])
     
     def run(self, topic, description, problem):
+        # 每次运行使用独立的ID标记统计和追踪，启用追踪时运行结束后导出 Chrome trace 文件
+        run_id = str(uuid.uuid4())
+        try:
+            with metrics_context(process_id=run_id), trace_span('ScienceArticleChain.run', 'article', topic=topic):
+                return self._run(topic, description, problem)
+        finally:
+            if tracer.enabled:
+                tracer.export(run_id)
+    
+    def _run(self, topic, description, problem):
         # 生成框架
         framework = self.initial_agent.get_framework(
             topic=topic, description=description, problem=problem
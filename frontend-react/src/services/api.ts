@@ -114,6 +114,7 @@ export interface RetrievalOverallStatus {
   start_time?: string;
   end_time?: string;
   error_message?: string;
+  retrieval_stats?: Record<string, Record<string, unknown>>;
 }
 
 export interface RetrievalStartResponse {
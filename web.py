@@ -269,7 +269,7 @@ def main():
                         st.session_state.web_agent.search_for_leaf_nodes(st.session_state.outline_dict)
                     if use_kb:
                         config['local_kb']['kb_path'] = foldername
-                        st.session_state.kb_agent = LocalKBAgent(config=config['local_kb'])
+                        st.session_state.kb_agent = LocalKBAgent(config=config['local_kb'], llm_settings=config['web_search'])
                         st.session_state.kb_agent.search_for_leaf_nodes(st.session_state.outline_dict)
                     st.session_state.step = 3
                     st.rerun()
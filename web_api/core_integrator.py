@@ -7,6 +7,10 @@ from agents.initial_analysis_agent import InitialAnalysisAgent, ArticleOutline
 from agents.unified_retrieval_agent import UnifiedRetrievalAgent
 from agents.comprehensive_answer_agent import ComprehensiveAnswerAgent
 from agents.intro_conclusion_agent import IntroductionConclusionAgent
+from agents.client_registry import configure_http_clients
+from agents.model_router import configure_model_routing
+from agents.replay import configure_replay
+from agents.tracing import configure_tracing
 
 # Configuration loading - adjust path as necessary
 CONFIG_PATH = 'config/config.yaml' # Relative to the root of where the FastAPI app might run from
@@ -32,6 +36,11 @@ def load_app_config() -> Dict[str, Any]:
 class AgentIntegrator:
     def __init__(self):
         self.config = load_app_config()
+        # All agents share one keep-alive connection pool per (base_url, api_key), the per-prompt model routing table and the tracer
+        configure_replay(self.config.get('replay'))
+        configure_http_clients(self.config.get('http_client'))
+        configure_model_routing(self.config.get('model_routing'))
+        configure_tracing(self.config.get('tracing'))
         self.initial_analysis_agent = InitialAnalysisAgent(self.config['initial_analysis'])
         # UnifiedRetrievalAgent and ComprehensiveAnswerAgent might be better instantiated on-demand 
         # if they hold significant state or resources, or if their configs can change per process.
@@ -40,6 +49,7 @@ class AgentIntegrator:
         self.unified_retrieval_config_kb = self.config['local_kb']
         self.comprehensive_answer_config = self.config['comprehensive_answer']
         self.intro_conclusion_config = self.config.get('intro_conclusion', {})
+        self._intro_conclusion_agent: Optional[IntroductionConclusionAgent] = None
 
     def generate_initial_outline(self, topic: str, description: str, problem: str) -> ArticleOutline:
         return self.initial_analysis_agent.get_framework(topic=topic, description=description, problem=problem)
@@ -56,7 +66,10 @@ class AgentIntegrator:
         return ComprehensiveAnswerAgent(self.config['comprehensive_answer'])
     
     def get_intro_conclusion_agent(self) -> IntroductionConclusionAgent:
-        return IntroductionConclusionAgent(self.intro_conclusion_config)
+        # The agent only holds prebuilt chains and no per-run state, so a single instance is reused
+        if self._intro_conclusion_agent is None:
+            self._intro_conclusion_agent = IntroductionConclusionAgent(self.intro_conclusion_config)
+        return self._intro_conclusion_agent
 
 # Singleton instance of the integrator
 agent_integrator_instance = AgentIntegrator()
@@ -1,7 +1,12 @@
-from fastapi import FastAPI
-from .routers import process_router
+from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse
+from .routers import process_router, admin_router
+from .dependencies import get_status_manager
+from .services.metrics import CONTENT_TYPE, render_metrics
+from .services.status_manager import ProcessStatusManager
 # Remove or conditionally enable CORS if running frontend on a different port during development
 from fastapi.middleware.cors import CORSMiddleware
+from agents.client_registry import close_http_clients
 
 app = FastAPI(title="Editorial Agents API")
 
@@ -15,11 +20,21 @@ app.add_middleware(
 )
 
 app.include_router(process_router.router, prefix="/api/process", tags=["Process Management"])
+app.include_router(admin_router.router, prefix="/api/admin", tags=["Admin"])
+
+@app.on_event("shutdown")
+def shutdown_http_clients():
+    close_http_clients()
 
 @app.get("/health", tags=["Health"])
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Health"])
+def metrics(status_manager: ProcessStatusManager = Depends(get_status_manager)):
+    """Prometheus scrape endpoint: stage latency histograms, in-flight calls, queue depths and error counters."""
+    return PlainTextResponse(render_metrics(status_manager), media_type=CONTENT_TYPE)
+
 # Potentially load main configuration here if needed globally
 # from editorial_agents_project.config import load_config # Adjust import path
 # global_config = load_config()
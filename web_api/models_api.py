@@ -39,6 +39,7 @@ class RetrievalOverallStatus(BaseModel):
     start_time: Optional[datetime.datetime] = None
     end_time: Optional[datetime.datetime] = None
     error_message: Optional[str] = None # For overall process errors
+    retrieval_stats: Dict[str, Dict[str, Any]] = Field(default_factory=dict) # e.g. {"document_pool": {"hits": 3, "bytes_saved": 1024}}
 
 class ProcessState(BaseModel):
     process_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -106,3 +107,14 @@ class ArticleResponse(BaseModel):
     composition_status: str
     article_content: Optional[str] = None
     references_raw: Optional[List[Dict[str, Any]]] = None # For raw references if needed
+
+class ProcessMetricsResponse(BaseModel):
+    process_id: str
+    totals: Dict[str, Any] = Field(default_factory=dict)
+    by_key: Dict[str, Dict[str, Any]] = Field(default_factory=dict) # e.g. {"llm:refine_doc": {"calls": 12, "prompt_tokens": 9000}}
+    by_node: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+    by_iteration: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+
+class MetricsSummaryResponse(BaseModel):
+    processes: int
+    by_key: Dict[str, Dict[str, Any]] = Field(default_factory=dict) # sorted by total seconds, hottest first
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from agents.profiler import ProfilerBusyError, profile_for
+from ..core_integrator import AgentIntegrator, get_agent_integrator
+
+router = APIRouter()
+
+
+@router.post("/profile", response_class=PlainTextResponse)
+def profile_server(
+    seconds: float = Query(30.0, gt=0, description="How long to sample for"),
+    interval: float = Query(0.01, ge=0.001, le=1.0, description="Seconds between samples"),
+    integrator: AgentIntegrator = Depends(get_agent_integrator)
+):
+    """
+    Sample the stacks of every thread in this server process for `seconds` and return them in
+    collapsed-stack format (one "thread;outer;...;inner count" line per stack), ready for
+    flamegraph.pl, speedscope or inferno. Disabled unless `profiling.enabled` is set in the config.
+    """
+    settings = integrator.config.get('profiling') or {}
+    if not settings.get('enabled', False):
+        raise HTTPException(status_code=404, detail="Profiling is disabled (set profiling.enabled in config.yaml)")
+    max_seconds = settings.get('max_seconds', 120)
+    if seconds > max_seconds:
+        raise HTTPException(status_code=400, detail=f"seconds must not exceed {max_seconds}")
+    # Declared as a sync endpoint so FastAPI runs it in a worker thread and the event loop keeps serving requests
+    try:
+        collapsed = profile_for(seconds, interval)
+    except ProfilerBusyError:
+        raise HTTPException(status_code=409, detail="A profiling session is already running")
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'})
@@ -4,7 +4,8 @@ from ..models_api import (
     ProcessCreationInput, ProcessCreationResponse, 
     OutlineUpdateRequest, OutlineUpdateResponse,
     RetrievalStartRequest, RetrievalStartResponse,
-    RetrievalStatusResponse, CompositionStartResponse, ArticleResponse
+    RetrievalStatusResponse, CompositionStartResponse, ArticleResponse,
+    ProcessMetricsResponse, MetricsSummaryResponse
 )
 from ..services.process_service import ProcessService
 from ..services.status_manager import ProcessStatusManager, status_manager_instance # Singleton instance
@@ -73,3 +74,26 @@ async def get_article(
 ):
     """Get the composed article and its status."""
     return await service.get_composed_article(process_id)
+
+@router.get("/metrics/summary", response_model=MetricsSummaryResponse)
+async def get_metrics_summary(
+    service: ProcessService = Depends(get_process_service)
+):
+    """Get server-wide token, latency, retry and cache-hit totals per prompt key and search backend."""
+    return await service.get_metrics_summary()
+
+@router.get("/{process_id}/metrics", response_model=ProcessMetricsResponse)
+async def get_process_metrics(
+    process_id: str,
+    service: ProcessService = Depends(get_process_service)
+):
+    """Get token, latency, retry and cache-hit totals for a process, broken down by prompt key, node and iteration."""
+    return await service.get_process_metrics(process_id)
+
+@router.get("/{process_id}/trace")
+async def get_process_trace(
+    process_id: str,
+    service: ProcessService = Depends(get_process_service)
+):
+    """Get the spans recorded so far for a process as Chrome trace-event JSON (open in chrome://tracing or Perfetto)."""
+    return await service.get_process_trace(process_id)
@@ -0,0 +1,111 @@
+from typing import Dict, Iterable, List, Tuple
+
+from agents.circuit_breaker import circuit_breaker_stats, retry_budget
+from agents.hedging import latency_stats
+from agents.instrumentation import gauges, recorder
+from .status_manager import ProcessStatusManager
+
+# Prometheus text exposition format, rendered by hand so the API does not depend on prometheus_client
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+PREFIX = "editorial"
+
+BREAKER_STATES = ("closed", "half_open", "open")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _Exposition:
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def family(self, name: str, kind: str, help_text: str, samples: Iterable[Tuple[Dict[str, str], float]]):
+        self.lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        self.lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{PREFIX}_{name}{_labels(labels)} {value}")
+
+    def histogram(self, name: str, help_text: str, label: str, series: Dict[str, dict]):
+        """series maps a label value to a LatencyTracker.stats()-style dict (histogram, count, sum_seconds)"""
+        self.lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        self.lines.append(f"# TYPE {PREFIX}_{name} histogram")
+        for value, stats in sorted(series.items()):
+            for bound, count in stats["histogram"].items():
+                self.lines.append(f"{PREFIX}_{name}_bucket{_labels({label: value, 'le': bound})} {count}")
+            self.lines.append(f"{PREFIX}_{name}_sum{_labels({label: value})} {stats['sum_seconds']}")
+            self.lines.append(f"{PREFIX}_{name}_count{_labels({label: value})} {stats['count']}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics(status_manager: ProcessStatusManager) -> str:
+    """Render server-wide metrics in the Prometheus text format for GET /metrics."""
+    out = _Exposition()
+
+    out.histogram("stage_duration_seconds", "Duration of pipeline stages (outline, per-iteration search, refine, evaluate, compose).",
+                  "stage", {stage: tracker.stats() for stage, tracker in gauges.stage_stats().items()})
+    backends = latency_stats()
+    out.histogram("backend_call_duration_seconds", "Latency of successful backend calls made through the deadline/hedging caller.",
+                  "backend", backends)
+
+    activity = status_manager.activity_snapshot()
+    out.family("processes", "gauge", "Processes held by the status manager.", [({}, activity["processes"])])
+    out.family("active_processes", "gauge", "Processes currently retrieving or composing.",
+               [({"phase": "retrieval"}, activity["retrieving"]), ({"phase": "composition"}, activity["composing"])])
+    out.family("status_manager_bytes", "gauge", "Approximate memory held by ProcessStatusManager._processes (serialized JSON size).",
+               [({}, activity["approx_bytes"])])
+
+    out.family("in_flight_calls", "gauge", "LLM and search calls currently in flight.",
+               [({"kind": kind}, count) for kind, count in sorted(gauges.in_flight_stats().items())])
+
+    executors = {name: dict(stats) for name, stats in gauges.executor_stats().items()}
+    for backend, stats in backends.items():
+        executors[f"hedged-{backend}"] = {"queue_depth": stats["queue_depth"], "threads": stats["threads"]}
+    out.family("executor_queue_depth", "gauge", "Tasks waiting in thread pool queues.",
+               [({"executor": name}, stats["queue_depth"]) for name, stats in sorted(executors.items())])
+    out.family("executor_threads", "gauge", "Worker threads started by thread pools.",
+               [({"executor": name}, stats["threads"]) for name, stats in sorted(executors.items())])
+
+    by_key = recorder.summary()["by_key"]
+    calls = []
+    for name, counters in sorted(by_key.items()):
+        kind, key = name.split(":", 1)
+        calls.append(({"kind": kind, "key": key}, counters))
+    out.family("calls_total", "counter", "LLM and search calls by prompt key or backend.",
+               [(labels, counters["calls"]) for labels, counters in calls])
+    out.family("call_errors_total", "counter", "Calls that ultimately failed.",
+               [(labels, counters["errors"]) for labels, counters in calls])
+    out.family("retries_total", "counter", "Retries performed by the retrieval agent.",
+               [(labels, counters["retries"]) for labels, counters in calls])
+    out.family("cache_hits_total", "counter", "Calls served from a cache or a shared in-flight call.",
+               [(labels, counters["cache_hits"]) for labels, counters in calls])
+    out.family("tokens_total", "counter", "Tokens used by LLM calls.",
+               [({**labels, "type": token_type}, counters[f"{token_type}_tokens"])
+                for labels, counters in calls if labels["kind"] == "llm" for token_type in ("prompt", "completion")])
+
+    counters = gauges.counter_stats()
+    out.family("rate_limited_total", "counter", "Responses rejected with HTTP 429 by a backend.",
+               [({"backend": label}, value) for (name, label), value in sorted(counters.items()) if name == "rate_limited"])
+
+    breakers = circuit_breaker_stats()
+    out.family("circuit_breaker_state", "gauge", "Circuit breaker state (1 for the current state).",
+               [({"backend": name, "state": state}, int(stats["state"] == state))
+                for name, stats in sorted(breakers.items()) for state in BREAKER_STATES])
+    out.family("circuit_breaker_rejected_total", "counter", "Calls rejected by an open circuit breaker.",
+               [({"backend": name}, stats["rejected"]) for name, stats in sorted(breakers.items())])
+
+    budget = retry_budget.stats()
+    out.family("retry_budget_tokens", "gauge", "Tokens left in the global retry budget.", [({}, budget["tokens"])])
+    out.family("retry_budget_exhausted_total", "counter", "Retries refused because the global retry budget was empty.",
+               [({}, budget["exhausted"])])
+
+    return out.render()
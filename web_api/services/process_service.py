@@ -6,11 +6,14 @@ from ..models_api import (
     OutlineUpdateRequest, OutlineUpdateResponse,
     RetrievalStartRequest, RetrievalStartResponse,
     RetrievalStatusResponse, CompositionStartResponse, ArticleResponse,
+    ProcessMetricsResponse, MetricsSummaryResponse,
     LeafNodeStatusUpdate # For direct use in agent if type hinting is strict
 )
 from .status_manager import ProcessStatusManager
 from ..core_integrator import AgentIntegrator
 from agents.initial_analysis_agent import ArticleOutline # For type hinting
+from agents.instrumentation import metrics_context, recorder
+from agents.tracing import trace_span, tracer
 
 class ProcessService:
     def __init__(self, status_manager: ProcessStatusManager, agent_integrator: AgentIntegrator):
@@ -26,11 +29,12 @@ class ProcessService:
         try:
             # This is a synchronous call from the agent, potentially long.
             # For a production app, InitialAnalysisAgent might also need to be async or run in a thread.
-            article_outline_obj: ArticleOutline = self.agent_integrator.generate_initial_outline(
-                topic=process_state.topic,
-                description=process_state.description,
-                problem=process_state.problem
-            )
+            with metrics_context(process_id=process_state.process_id):
+                article_outline_obj: ArticleOutline = self.agent_integrator.generate_initial_outline(
+                    topic=process_state.topic,
+                    description=process_state.description,
+                    problem=process_state.problem
+                )
             self.status_manager.update_outline(process_state.process_id, article_outline_obj.outline)
             return ProcessCreationResponse(
                 process_id=process_state.process_id,
@@ -146,7 +150,7 @@ class ProcessService:
         intro_conclusion_agent = self.agent_integrator.get_intro_conclusion_agent()
         
         # The compose method in the agent is synchronous
-        def composition_task():
+        def run_composition():
             try:
                 # 更新状态：开始生成主体内容
                 self.status_manager.update_composition_status(process_id, "正在生成主体内容...")
@@ -197,9 +201,34 @@ class ProcessService:
             except Exception as e:
                 self.status_manager.update_composition_status(process_id, "Error", article_content=f"Error during composition: {str(e)}")
         
+        def composition_task():
+            # Tag every LLM call made while composing with this process for /metrics and tracing
+            with metrics_context(process_id=process_id, node_id="composition"), trace_span("compose_article", "compose"):
+                run_composition()
+            # Composition ends the article run: write outline, retrieval and composition spans to one trace file
+            if tracer.enabled:
+                tracer.export(process_id)
+        
         background_tasks.add_task(composition_task)
         return CompositionStartResponse(process_id=process_id, message="Article composition started in background.")
 
+    async def get_process_metrics(self, process_id: str) -> ProcessMetricsResponse:
+        if not self.status_manager.get_process_state(process_id):
+            raise HTTPException(status_code=404, detail="Process not found")
+        metrics = recorder.process_metrics(process_id) or {}
+        return ProcessMetricsResponse(process_id=process_id, **metrics)
+
+    async def get_metrics_summary(self) -> MetricsSummaryResponse:
+        return MetricsSummaryResponse(**recorder.summary())
+
+    async def get_process_trace(self, process_id: str) -> Dict[str, Any]:
+        if not self.status_manager.get_process_state(process_id):
+            raise HTTPException(status_code=404, detail="Process not found")
+        trace = tracer.chrome_trace(process_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail="No trace recorded for this process (is tracing enabled?)")
+        return trace
+
     async def get_composed_article(self, process_id: str) -> ArticleResponse:
         process_state = self.status_manager.get_process_state(process_id)
         if not process_state:
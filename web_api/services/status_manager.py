@@ -20,6 +20,8 @@ class ProcessStatusManager:
         # Ensure __init__ is only called once for the singleton
         if not hasattr(self, '_initialized'): 
             self._processes: Dict[str, ProcessState] = {}
+            # process_id -> (last_updated, serialized size) for activity_snapshot
+            self._size_cache: Dict[str, Tuple[datetime.datetime, int]] = {}
             self._initialized = True
 
     def create_process(self, topic: str, description: Optional[str], problem: Optional[str]) -> ProcessState:
@@ -28,6 +30,12 @@ class ProcessStatusManager:
             self._processes[new_process.process_id] = new_process
             return new_process
 
+    def remove_process(self, process_id: str) -> Optional[ProcessState]:
+        """Forgets a process and its cached size. Returns the removed state, if any."""
+        with self._lock:
+            self._size_cache.pop(process_id, None)
+            return self._processes.pop(process_id, None)
+
     def get_process_state(self, process_id: str) -> Optional[ProcessState]:
         with self._lock:
             return self._processes.get(process_id)
@@ -128,6 +136,18 @@ class ProcessStatusManager:
             process.last_updated = datetime.datetime.utcnow()
             return process.retrieval_status
 
+    def update_retrieval_stats(self, process_id: str, section: str, stats: Dict[str, Any]) -> Optional[RetrievalOverallStatus]:
+        """
+        Replaces one named section of the retrieval statistics (e.g. "document_pool").
+        """
+        with self._lock:
+            process = self._processes.get(process_id)
+            if not process:
+                return None
+            process.retrieval_status.retrieval_stats[section] = stats
+            process.last_updated = datetime.datetime.utcnow()
+            return process.retrieval_status
+
     def update_composition_status(self, process_id: str, status: str, article_content: Optional[str] = None) -> Optional[ProcessState]:
         with self._lock:
             process = self._processes.get(process_id)
@@ -142,5 +162,43 @@ class ProcessStatusManager:
                 return process
             return None
 
+    def activity_snapshot(self) -> Dict[str, int]:
+        """
+        Counts processes by phase and estimates the memory held by _processes.
+        The size is the length of each process serialized to JSON, a lower bound that grows with outlines and articles.
+        Sizes are cached per process and only re-measured, outside the lock, for processes updated since the last call,
+        so a /metrics scrape does not hold up status updates while it serializes; the cache itself is only
+        read and written under the lock, and entries of removed processes are dropped.
+        """
+        with self._lock:
+            processes = list(self._processes.items())
+            retrieving = sum(
+                1 for _, p in processes
+                if p.retrieval_status.start_time is not None and p.retrieval_status.error_message is None
+                and any(not ns.is_completed for ns in p.retrieval_status.leaf_nodes_status.values())
+            )
+            composing = sum(1 for _, p in processes if p.composition_status not in ("Not Started", "Completed", "Error"))
+            # Drop sizes of processes that are no longer held
+            for pid in self._size_cache.keys() - self._processes.keys():
+                del self._size_cache[pid]
+            sizes = {pid: self._size_cache.get(pid) for pid, _ in processes}
+        measured = {
+            pid: (process.last_updated, len(process.model_dump_json()))
+            for pid, process in processes
+            if sizes[pid] is None or sizes[pid][0] != process.last_updated
+        }
+        sizes.update(measured)
+        with self._lock:
+            for pid, entry in measured.items():
+                if pid in self._processes:
+                    self._size_cache[pid] = entry
+        approx_bytes = sum(size for _, size in sizes.values())
+        return {
+            "processes": len(processes),
+            "retrieving": retrieving,
+            "composing": composing,
+            "approx_bytes": approx_bytes,
+        }
+
 # Global instance of the manager
 status_manager_instance = ProcessStatusManager()